@@ -0,0 +1,149 @@
+"""
+User activity retention.
+
+Raw UserActivity rows are kept for ``ACTIVITY_RETENTION_DAYS``. Older rows
+are rolled up into UserActivityRollup, one row per user, local day, activity
+type and movie, and then deleted. Each chunk of raw rows is counted into the
+rollups and deleted in one short transaction, so a run can stop at any point
+without losing or double counting events, and locks are held only for a
+chunk. Concurrent runs skip the raw rows another run has locked, and the
+rollups they share are locked before their counts are read, so no count is
+lost between them.
+
+Readers that need history (``activity_summary``, the view counts of the
+recommendation index, ``/api/users/activity/``) add the rollups to the raw
+rows; the two never overlap.
+"""
+import logging
+from collections import Counter
+from datetime import datetime, time as dt_time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .models import UserActivity, UserActivityRollup
+from .upserts import upsert
+
+logger = logging.getLogger(__name__)
+
+
+def _rollup_chunk(cutoff, chunk_size):
+    """Roll up and delete the oldest ``chunk_size`` raw rows before ``cutoff``; returns how many"""
+    # Raw rows and rollups are both event tables, in the same database
+    with transaction.atomic(using=settings.EVENTS_DATABASE):
+        rows = list(
+            UserActivity.objects
+            .select_for_update(skip_locked=True)
+            .filter(created_at__lt=cutoff)
+            .order_by('created_at')
+            .values_list('id', 'user_id', 'activity_type', 'movie_id', 'created_at')[:chunk_size]
+        )
+        if not rows:
+            return 0
+
+        counts = Counter(
+            (user_id, timezone.localdate(created_at), activity_type, movie_id)
+            for _, user_id, activity_type, movie_id, created_at in rows
+        )
+        # Empty rollups give every key with a movie a row to lock, so two runs
+        # creating the same rollup wait for each other instead of overwriting
+        UserActivityRollup.objects.bulk_create([
+            UserActivityRollup(user_id=user_id, day=day, activity_type=activity_type, movie_id=movie_id)
+            for user_id, day, activity_type, movie_id in counts if movie_id is not None
+        ], batch_size=1000, ignore_conflicts=True)
+        existing = {
+            (rollup.user_id, rollup.day, rollup.activity_type, rollup.movie_id): rollup
+            for rollup in UserActivityRollup.objects.select_for_update().filter(
+                user_id__in={key[0] for key in counts},
+                day__in={key[1] for key in counts},
+            ).order_by('pk')
+        }
+        rollups = []
+        for (user_id, day, activity_type, movie_id), count in counts.items():
+            rollup = existing.get((user_id, day, activity_type, movie_id)) or UserActivityRollup(
+                user_id=user_id, day=day, activity_type=activity_type, movie_id=movie_id
+            )
+            rollup.count += count
+            rollups.append(rollup)
+        upsert(UserActivityRollup, rollups, unique_fields=['id'], update_fields=['count'])
+        # No signals or cascades hang off UserActivity, so this is a single DELETE ... IN
+        UserActivity.objects.filter(id__in=[row[0] for row in rows]).delete()
+    return len(rows)
+
+
+def rollup_activity(days, chunk_size=2000):
+    """Roll up raw activity older than ``days`` days, chunk by chunk; returns rows rolled up"""
+    cutoff = timezone.now() - timedelta(days=days)
+    total = 0
+    while True:
+        rolled = _rollup_chunk(cutoff, chunk_size)
+        if not rolled:
+            break
+        total += rolled
+        logger.info("Rolled up %d activity rows (%d so far)", rolled, total)
+    return total
+
+
+def activity_summary(user_id, days):
+    """
+    Per-day activity counts of a user for the last ``days`` local days,
+    newest first: ``[{'date': date, 'activity_type': str, 'count': int}]``.
+    """
+    start_day = timezone.localdate() - timedelta(days=days - 1)
+    start = timezone.make_aware(datetime.combine(start_day, dt_time.min))
+
+    counts = Counter()
+    raw = (
+        UserActivity.objects
+        .filter(user_id=user_id, created_at__gte=start)
+        .order_by()
+        .values_list('created_at', 'activity_type')
+    )
+    for created_at, activity_type in raw:
+        counts[(timezone.localdate(created_at), activity_type)] += 1
+    rolled_up = (
+        UserActivityRollup.objects
+        .filter(user_id=user_id, day__gte=start_day)
+        .values('day', 'activity_type')
+        .annotate(total=Sum('count'))
+        .order_by()
+        .values_list('day', 'activity_type', 'total')
+    )
+    for day, activity_type, total in rolled_up:
+        counts[(day, activity_type)] += total
+
+    # Newest day first, activity types alphabetically within a day
+    ordered = sorted(counts.items(), key=lambda item: item[0][1])
+    ordered.sort(key=lambda item: item[0][0], reverse=True)
+    return [
+        {'date': day, 'activity_type': activity_type, 'count': count}
+        for (day, activity_type), count in ordered
+    ]
+
+
+def movie_view_counts():
+    """``(user_id, movie_id, views)`` over raw and rolled up movie views"""
+    views = Counter()
+    raw = (
+        UserActivity.objects
+        .filter(activity_type='movie_view', movie__isnull=False)
+        .values('user_id', 'movie_id')
+        .annotate(views=Count('id'))
+        .order_by()
+        .values_list('user_id', 'movie_id', 'views')
+    )
+    for user_id, movie_id, count in raw.iterator(chunk_size=10000):
+        views[(user_id, movie_id)] += count
+    rolled_up = (
+        UserActivityRollup.objects
+        .filter(activity_type='movie_view', movie__isnull=False)
+        .values('user_id', 'movie_id')
+        .annotate(views=Sum('count'))
+        .order_by()
+        .values_list('user_id', 'movie_id', 'views')
+    )
+    for user_id, movie_id, count in rolled_up.iterator(chunk_size=10000):
+        views[(user_id, movie_id)] += count
+    return ((user_id, movie_id, count) for (user_id, movie_id), count in views.items())
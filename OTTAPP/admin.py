@@ -1,11 +1,15 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
+import logging
+from . import content_similarity, watchlist_cache
 from .models import (
     UserProfile, Movie, Genre, Subscription, Watchlist, 
-    MovieRating, UserActivity
+    MovieRating, UserActivity, UserActivityRollup, PlaybackSession, WatchProgress
 )
 
+logger = logging.getLogger(__name__)
+
 
 # Unregister the default User admin
 admin.site.unregister(User)
@@ -67,6 +71,31 @@ class MovieAdmin(admin.ModelAdmin):
         }),
     )
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Genres are saved here, so this is the first point the movie is complete
+        try:
+            content_similarity.update_movie(form.instance)
+        except Exception as e:
+            logger.error(f"Error updating content index for movie {form.instance.pk}: {e}")
+
+    def delete_model(self, request, obj):
+        movie_id = obj.pk
+        super().delete_model(request, obj)
+        try:
+            content_similarity.remove_movie(movie_id)
+        except Exception as e:
+            logger.error(f"Error removing movie {movie_id} from content index: {e}")
+
+    def delete_queryset(self, request, queryset):
+        movie_ids = list(queryset.values_list('id', flat=True))
+        super().delete_queryset(request, queryset)
+        try:
+            for movie_id in movie_ids:
+                content_similarity.remove_movie(movie_id)
+        except Exception as e:
+            logger.error(f"Error removing movies from content index: {e}")
+
 
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
@@ -89,6 +118,20 @@ class WatchlistAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('user', 'movie')
 
+    def save_model(self, request, obj, form, change):
+        previous_user_id = Watchlist.objects.filter(pk=obj.pk).values_list('user_id', flat=True).first()
+        super().save_model(request, obj, form, change)
+        watchlist_cache.invalidate(*{obj.user_id, previous_user_id} - {None})
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        watchlist_cache.invalidate(obj.user_id)
+
+    def delete_queryset(self, request, queryset):
+        user_ids = set(queryset.values_list('user_id', flat=True))
+        super().delete_queryset(request, queryset)
+        watchlist_cache.invalidate(*user_ids)
+
 
 @admin.register(MovieRating)
 class MovieRatingAdmin(admin.ModelAdmin):
@@ -101,18 +144,71 @@ class MovieRatingAdmin(admin.ModelAdmin):
         return super().get_queryset(request).select_related('user', 'movie')
 
 
+class EventAdmin(admin.ModelAdmin):
+    """
+    Admin for event tables, which may be in the events database: users and
+    movies are prefetched and searched by id instead of joined.
+    """
+    # Not False: with relations in list_display that would select_related() them
+    list_select_related = ()
+    # COUNT(*) over the whole table on every page is slow once it is large
+    show_full_result_count = False
+    related_search = {'user': (User, 'username'), 'movie': (Movie, 'title')}
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('user', 'movie')
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        search_term = search_term.strip()
+        if search_term:
+            for field, (model, attribute) in self.related_search.items():
+                ids = list(
+                    model.objects.filter(**{f'{attribute}__icontains': search_term}).values_list('pk', flat=True)[:1000]
+                )
+                if ids:
+                    results |= queryset.filter(**{f'{field}_id__in': ids})
+        return results, may_have_duplicates
+
+    def has_add_permission(self, request):
+        return False  # Events are only written by the application
+
+
 @admin.register(UserActivity)
-class UserActivityAdmin(admin.ModelAdmin):
+class UserActivityAdmin(EventAdmin):
     list_display = ('user', 'activity_type', 'description', 'created_at')
     list_filter = ('activity_type', 'created_at')
-    search_fields = ('user__username', 'description')
+    search_fields = ('description',)
     readonly_fields = ('created_at',)
-    
+
+
+@admin.register(UserActivityRollup)
+class UserActivityRollupAdmin(EventAdmin):
+    list_display = ('user', 'day', 'activity_type', 'movie', 'count')
+    list_filter = ('activity_type', 'day')
+    search_fields = ('activity_type',)
+    readonly_fields = ('user', 'day', 'activity_type', 'movie', 'count')
+
+
+@admin.register(PlaybackSession)
+class PlaybackSessionAdmin(EventAdmin):
+    list_display = ('user', 'movie', 'started_at', 'ended_at', 'bytes_served', 'range_requests')
+    list_filter = ('started_at',)
+    search_fields = ('=ip_address',)
+    readonly_fields = (
+        'user', 'movie', 'started_at', 'ended_at', 'bytes_served', 'furthest_byte',
+        'file_size', 'range_requests', 'plan', 'ip_address', 'user_agent'
+    )
+
+
+@admin.register(WatchProgress)
+class WatchProgressAdmin(admin.ModelAdmin):
+    list_display = ('user', 'movie', 'position', 'completed', 'updated_at')
+    list_filter = ('completed', 'updated_at')
+    search_fields = ('user__username', 'movie__title')
+
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('user', 'movie')
-    
-    def has_add_permission(self, request):
-        return False  # Prevent manual creation of activity logs
 
 
 # Customize admin site
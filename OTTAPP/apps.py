@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class OttappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'OTTAPP'
+
+    def ready(self):
+        from . import metrics, query_inspector, signals  # noqa: F401
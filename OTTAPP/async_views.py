@@ -0,0 +1,242 @@
+"""
+Async versions of the read-only catalog API, for serving under ASGI.
+
+The endpoints under ``/api/async/`` (movie list, detail, search, featured,
+trending and statistics) return the same JSON as their counterparts under
+``/api/``, including ``?fields=`` / ``?expand=``, pagination and the catalog
+ETags. Queries go through the async ORM, and the independent ones of a
+request (a page and its count, the rows and the user's watchlist, a movie
+and its ratings, the relations of a page) are awaited together with
+``asyncio.gather``.
+
+Under an ASGI server a client that is slow to send its request or read the
+response costs a coroutine instead of a worker, so a fan-out of slow clients
+no longer exhausts the workers. Run the project under ASGI
+(``OTTPROJECT.asgi``) and route ``/api/async/`` to it next to the WSGI
+workers; the views also work under WSGI, a thread per request.
+``manage.py benchmark --suite async`` compares the two stacks.
+
+Requests authenticate and negotiate the format (JSON, MessagePack, CBOR) as
+the sync API does, with ``DEFAULT_AUTHENTICATION_CLASSES`` (session or
+token) and ``Accept`` / ``?format=``. The views only read.
+"""
+import asyncio
+import math
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db.models import Avg, Count, Q, Sum
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .catalog_version import acatalog_condition
+from .fast_serializers import FastSerializer, movie_fast, movie_list_fast
+from .models import Movie, MovieRating
+from .renderers import AvailableRendererNegotiation, CBORRenderer, FastJSONRenderer, MessagePackRenderer
+from .serializers import MovieDetailSerializer, parse_fields
+from .watchlist_cache import get_request_watchlist
+
+SAFE_METHODS = ('GET', 'HEAD')
+DETAIL_FIELDS = list(MovieDetailSerializer().fields)
+
+# The sync API's renderers, less the browsable API, which needs a DRF view
+RENDERERS = [FastJSONRenderer(), MessagePackRenderer(), CBORRenderer()]
+negotiator = AvailableRendererNegotiation()
+
+
+def api_response(request, data, status=200):
+    """``data`` in the format ``async_api_view`` negotiated for ``request``"""
+    renderer = getattr(request, 'accepted_renderer', RENDERERS[0])
+    response = HttpResponse(renderer.render(data), status=status, content_type=renderer.media_type)
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def _authenticate(request):
+    """The user the configured authentication classes find; sets ``request.user``"""
+    authenticators = [authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    # Assigning the DRF request's user assigns the Django request's too
+    return Request(request, authenticators=authenticators).user
+
+
+def async_api_view(view):
+    """
+    What ``api_view(['GET'])`` and ``IsAuthenticated`` do for the sync views,
+    in the same order and with the same error bodies: content negotiation,
+    authentication, then the method.
+    """
+    @wraps(view)
+    async def inner(request, *args, **kwargs):
+        try:
+            request.accepted_renderer, _ = negotiator.select_renderer(Request(request), RENDERERS)
+        except exceptions.NotAcceptable as e:
+            return api_response(request, {'detail': e.detail}, status=e.status_code)
+        try:
+            user = await sync_to_async(_authenticate)(request)
+        except exceptions.AuthenticationFailed as e:
+            # Session authentication comes first and sends no WWW-Authenticate, so DRF answers 403
+            return api_response(request, {'detail': e.detail}, status=403)
+        if not user.is_authenticated:
+            return api_response(request, {'detail': 'Authentication credentials were not provided.'}, status=403)
+        if request.method not in SAFE_METHODS:
+            response = api_response(request, {'detail': f'Method "{request.method}" not allowed.'}, status=405)
+            response['Allow'] = ', '.join(SAFE_METHODS)
+            return response
+        return await view(request, *args, **kwargs)
+    return inner
+
+
+async def fetch(queryset):
+    return [row async for row in queryset]
+
+
+def sparse_options(request):
+    return {param: parse_fields(request.GET[param]) for param in ('fields', 'expand') if param in request.GET}
+
+
+def sparse_fast(fast, options):
+    """``fast``, recompiled for the requested fields (see SparseFieldsViewMixin)"""
+    if not options:
+        return fast
+    return FastSerializer(fast.serializer_class(**options), fast.strings)
+
+
+async def serialize_movies(request, fast, options, queryset):
+    """Load and serialize ``queryset`` and flag the movies on the user's watchlist"""
+    fields = options.get('fields')
+    rows = fetch(fast.values(queryset, 'id'))
+    if fields is None or 'in_watchlist' in fields:
+        rows, watchlist = await asyncio.gather(rows, sync_to_async(get_request_watchlist)(request))
+    else:
+        rows, watchlist = await rows, None
+    movies = await fast.aserialize(rows, {'request': request})
+    if watchlist is not None:
+        for row, movie in zip(rows, movies):
+            movie['in_watchlist'] = row['id'] in watchlist
+    return movies
+
+
+async def movies_response(request, fast, queryset):
+    options = sparse_options(request)
+    return api_response(request, await serialize_movies(request, sparse_fast(fast, options), options, queryset))
+
+
+@async_api_view
+@acatalog_condition('movies', 'genres', per_user=True)
+async def movie_list(request):
+    """``GET /api/movies/``, paginated like PageNumberPagination"""
+    queryset = Movie.objects.all()
+    page_size = api_settings.PAGE_SIZE
+    page = request.GET.get('page', 1)
+    if page == 'last':
+        count = await queryset.acount()
+        number = max(math.ceil(count / page_size), 1)
+    else:
+        try:
+            number = int(page)
+        except (TypeError, ValueError):
+            number = 0
+        count = None
+    if number < 1:
+        return api_response(request, {'detail': 'Invalid page.'}, status=404)
+
+    options = sparse_options(request)
+    start = (number - 1) * page_size
+    fast = sparse_fast(movie_list_fast, options)
+    page_rows = serialize_movies(request, fast, options, queryset[start:start + page_size])
+    if count is None:
+        count, movies = await asyncio.gather(queryset.acount(), page_rows)
+    else:
+        movies = await page_rows
+    if number > max(math.ceil(count / page_size), 1):
+        return api_response(request, {'detail': 'Invalid page.'}, status=404)
+
+    url = request.build_absolute_uri()
+    next_url = replace_query_param(url, 'page', number + 1) if start + page_size < count else None
+    if number == 1:
+        previous_url = None
+    elif number == 2:
+        previous_url = remove_query_param(url, 'page')
+    else:
+        previous_url = replace_query_param(url, 'page', number - 1)
+    return api_response(request, {'count': count, 'next': next_url, 'previous': previous_url, 'results': movies})
+
+
+@async_api_view
+async def movie_detail(request, pk):
+    """``GET /api/movies/<pk>/``; the movie and its ratings load together"""
+    options = sparse_options(request)
+    fast = sparse_fast(movie_fast, options)
+    names = list(MovieDetailSerializer(**options).fields) if options else DETAIL_FIELDS
+
+    rows = fetch(fast.values(Movie.objects.filter(pk=pk), 'id'))
+    if 'average_rating' in names or 'total_ratings' in names:
+        ratings = MovieRating.objects.filter(movie_id=pk).aaggregate(total=Sum('rating'), count=Count('id'))
+        rows, ratings = await asyncio.gather(rows, ratings)
+    else:
+        rows, ratings = await rows, None
+    if not rows:
+        return api_response(request, {'detail': 'No Movie matches the given query.'}, status=404)
+
+    movie = (await fast.aserialize(rows, {'request': request}))[0]
+    if ratings is not None:
+        # The same arithmetic as MovieDetailSerializer.get_average_rating
+        movie['average_rating'] = ratings['total'] / ratings['count'] if ratings['count'] else 0.0
+        movie['total_ratings'] = ratings['count']
+    return api_response(request, {name: movie[name] for name in names})
+
+
+@async_api_view
+async def movie_search(request):
+    """``GET /api/movies/search/?q=``"""
+    query = request.GET.get('q', '')
+    if not query:
+        return api_response(request, [])
+    movies = Movie.objects.filter(
+        Q(title__icontains=query) |
+        Q(description__icontains=query) |
+        Q(director__icontains=query) |
+        Q(cast__icontains=query)
+    )
+    return await movies_response(request, movie_fast, movies)
+
+
+@async_api_view
+@acatalog_condition('featured', 'genres', per_user=True)
+async def featured_movies(request):
+    """``GET /api/movies/featured/``"""
+    return await movies_response(request, movie_fast, Movie.objects.filter(is_featured=True))
+
+
+@async_api_view
+@acatalog_condition('trending', 'genres', per_user=True)
+async def trending_movies(request):
+    """``GET /api/movies/trending/``"""
+    return await movies_response(request, movie_fast, Movie.objects.filter(is_trending=True))
+
+
+@async_api_view
+async def movie_statistics(request):
+    """``GET /api/statistics/`` in two queries: the totals in one pass, and the counts per language"""
+    totals, by_language = await asyncio.gather(
+        Movie.objects.aaggregate(
+            total_movies=Count('id'),
+            featured_movies=Count('id', filter=Q(is_featured=True)),
+            trending_movies=Count('id', filter=Q(is_trending=True)),
+            total_views=Sum('view_count'),
+            average_rating=Avg('rating'),
+        ),
+        fetch(Movie.objects.values('language').annotate(count=Count('id')).values_list('language', 'count')),
+    )
+    return api_response(request, {
+        'total_movies': totals['total_movies'],
+        'featured_movies': totals['featured_movies'],
+        'trending_movies': totals['trending_movies'],
+        'total_views': totals['total_views'] or 0,
+        'average_rating': totals['average_rating'] or 0,
+        'movies_by_language': dict(by_language),
+    })
@@ -0,0 +1,78 @@
+"""
+Write-behind buffers in the cache.
+
+``CacheJournal`` is an append-only list of small items (ids, keys) kept in
+the cache, so request handlers can note work for a periodic flush command
+instead of writing to the database themselves.
+
+Items go into per-interval buckets. Each append takes a slot number from
+``cache.incr`` on the bucket's counter, so concurrent processes never
+overwrite each other. The flusher only reads buckets that closed at least one
+interval ago, which leaves appends in progress time to land.
+
+Like everything in the cache, journal entries can be evicted under memory
+pressure; buffered data must be safe to lose in that case. A flush command
+runs in its own process, so it only finds what the workers buffered when the
+cache is shared (``cache_is_shared``); callers write through otherwise.
+"""
+import time
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def cache_is_shared():
+    """Whether every process sees the same default cache; local memory is per process"""
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+class CacheJournal:
+    def __init__(self, name, bucket_seconds=60, timeout=60 * 60 * 24):
+        self.name = name
+        self.bucket_seconds = bucket_seconds
+        self.timeout = timeout
+
+    def _counter_key(self, bucket):
+        return f'journal:{self.name}:{bucket}:n'
+
+    def _slot_key(self, bucket, slot):
+        return f'journal:{self.name}:{bucket}:{slot}'
+
+    @property
+    def _cursor_key(self):
+        return f'journal:{self.name}:cursor'
+
+    def _bucket(self, now=None):
+        return int((now or time.time()) // self.bucket_seconds)
+
+    def append(self, item):
+        bucket = self._bucket()
+        counter = self._counter_key(bucket)
+        cache.add(counter, 0, self.timeout)
+        try:
+            slot = cache.incr(counter)
+        except ValueError:
+            # Evicted between add() and incr()
+            cache.add(counter, 0, self.timeout)
+            slot = cache.incr(counter)
+        cache.set(self._slot_key(bucket, slot), item, self.timeout)
+
+    def drain(self):
+        """Yield the items of every closed bucket not drained yet, oldest first"""
+        last_closed = self._bucket() - 2
+        oldest = self._bucket(time.time() - self.timeout)
+        cursor = cache.get(self._cursor_key)
+        start = oldest if cursor is None else max(cursor, oldest)
+
+        for bucket in range(start, last_closed + 1):
+            count = cache.get(self._counter_key(bucket))
+            if count:
+                keys = [self._slot_key(bucket, slot) for slot in range(1, count + 1)]
+                items = cache.get_many(keys)
+                for key in keys:
+                    if key in items:
+                        yield items[key]
+                cache.delete_many(keys)
+            cache.delete(self._counter_key(bucket))
+            cache.set(self._cursor_key, bucket + 1, self.timeout)
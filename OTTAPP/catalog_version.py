@@ -0,0 +1,165 @@
+"""
+Catalog versions for cache keys and conditional GETs.
+
+Every scope of the catalog has a version number in the cache that is bumped
+whenever something in that scope changes (see signals.py):
+
+* ``catalog`` - anything at all
+* ``movies`` - any movie
+* ``genres`` - any genre (genre names appear in every movie list)
+* ``featured`` / ``trending`` - movies entering, leaving or changing in those lists
+* ``language:<Language>`` - movies of one language
+
+Versions are bumped with ``cache.incr``. A version lost to cache eviction is
+re-seeded from the current time in microseconds, so it never goes back to a
+value a client may still hold in an ETag.
+
+``catalog_condition`` turns the versions into strong ETags and Last-Modified
+headers. Unchanged polls get a 304 before the view runs any catalog queries.
+Last-Modified has whole seconds, so it is rounded up from the newest change
+and not sent at all during the second of that change, when another change
+could still come without moving it.
+``acatalog_condition`` does the same for async views.
+"""
+import calendar
+import hashlib
+import math
+import time
+from datetime import datetime, timezone as dt_timezone
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from django.views.decorators.http import condition
+
+from .watchlist_cache import get_modified, get_request_watchlist
+
+GLOBAL_SCOPE = 'catalog'
+
+VERSION_KEY = 'catalog_version:{}'
+MODIFIED_KEY = 'catalog_modified:{}'
+
+
+def _seed():
+    return int(time.time() * 1_000_000)
+
+
+def get_versions(*scopes):
+    """Return ``{scope: (version, modified timestamp)}``"""
+    keys = [VERSION_KEY.format(s) for s in scopes] + [MODIFIED_KEY.format(s) for s in scopes]
+    found = cache.get_many(keys)
+
+    versions = {}
+    for scope in scopes:
+        version = found.get(VERSION_KEY.format(scope))
+        modified = found.get(MODIFIED_KEY.format(scope))
+        if version is None:
+            # Never set or evicted: start again from a value above anything issued before
+            cache.add(VERSION_KEY.format(scope), _seed(), None)
+            version = cache.get(VERSION_KEY.format(scope))
+        if modified is None:
+            modified = time.time()
+            cache.add(MODIFIED_KEY.format(scope), modified, None)
+        versions[scope] = (version, modified)
+    return versions
+
+
+def get_version(scope=GLOBAL_SCOPE):
+    return get_versions(scope)[scope][0]
+
+
+def bump(*scopes):
+    """Mark ``scopes`` (and the global scope) as changed"""
+    now = time.time()
+    for scope in {GLOBAL_SCOPE, *scopes}:
+        key = VERSION_KEY.format(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _seed(), None)
+            cache.incr(key)
+    cache.set_many({MODIFIED_KEY.format(scope): now for scope in {GLOBAL_SCOPE, *scopes}}, None)
+
+
+def movie_scopes(language=None, is_featured=False, is_trending=False):
+    """Scopes affected by a change to a movie with these attributes"""
+    scopes = {'movies'}
+    if language:
+        scopes.add(f'language:{language}')
+    if is_featured:
+        scopes.add('featured')
+    if is_trending:
+        scopes.add('trending')
+    return scopes
+
+
+def _validators(scopes, per_user):
+    """``(etag_func, last_modified_func)`` for ``catalog_condition``"""
+    def _versions(request):
+        if not hasattr(request, '_catalog_versions'):
+            request._catalog_versions = get_versions(*scopes)
+        return request._catalog_versions
+
+    def etag_func(request, *args, **kwargs):
+        versions = _versions(request)
+        parts = [f'{scope}={versions[scope][0]}' for scope in scopes]
+        parts.append(request.get_full_path())
+        parts.append(request.META.get('HTTP_ACCEPT', ''))
+        if per_user:
+            parts.append(f'user={request.user.pk}:{get_request_watchlist(request).version}')
+        return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+    def last_modified_func(request, *args, **kwargs):
+        modified = max(modified for _, modified in _versions(request).values())
+        if per_user and request.user.is_authenticated:
+            modified = max(modified, get_modified(request.user.pk))
+        modified = math.ceil(modified)
+        if modified > time.time():
+            return None
+        return datetime.fromtimestamp(modified, tz=dt_timezone.utc)
+
+    return etag_func, last_modified_func
+
+
+def catalog_condition(*scopes, per_user=False):
+    """
+    Conditional GET decorator driven by catalog versions.
+
+    The ETag covers the scope versions, the full path (filters, page) and the
+    Accept header (API format). Pages that render user-specific content pass
+    ``per_user=True`` so the user and their watchlist version (for "in
+    watchlist" badges) are part of the ETag too, and a watchlist change moves
+    Last-Modified.
+    """
+    etag_func, last_modified_func = _validators(scopes, per_user)
+    return condition(etag_func=etag_func, last_modified_func=last_modified_func)
+
+
+def acatalog_condition(*scopes, per_user=False):
+    """``catalog_condition`` for async views, which Django's ``condition`` cannot wrap"""
+    etag_func, last_modified_func = _validators(scopes, per_user)
+
+    def validators(request):
+        # Cache reads (and a watchlist query on a miss), off the event loop
+        last_modified = last_modified_func(request)
+        if last_modified is not None:
+            last_modified = calendar.timegm(last_modified.utctimetuple())
+        return quote_etag(etag_func(request)), last_modified
+
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await view(request, *args, **kwargs)
+            etag, last_modified = await sync_to_async(validators)(request)
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if last_modified is not None and not response.has_header('Last-Modified'):
+                response.headers['Last-Modified'] = http_date(last_modified)
+            response.headers.setdefault('ETag', etag)
+            return response
+        return inner
+    return decorator
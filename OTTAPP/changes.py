@@ -0,0 +1,122 @@
+"""
+Changes feed for clients that keep the catalog offline.
+
+A client syncs from scratch once (no cursor) and from then on only asks for
+what changed after its cursor: movies saved since then (upserts) and movies
+deleted since then (tombstones). Both streams are read in
+``(timestamp, id)`` order from their indexes and merged into pages.
+
+The cursor is opaque to clients. It holds the position reached in each
+stream and is only valid while the tombstones it may still need are kept
+(``CHANGES_TOMBSTONE_DAYS``); older cursors must sync from scratch.
+
+Changes from the last ``CHANGES_SAFETY_WINDOW`` seconds are held back until
+the next sync. ``updated_at`` is set before a transaction commits, so without
+the window a slow transaction could commit a timestamp behind a cursor that
+was already handed out.
+"""
+import base64
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Movie, MovieTombstone
+
+CURSOR_VERSION = 'v1'
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class ExpiredCursor(ValueError):
+    pass
+
+
+def _to_micros(value):
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def _from_micros(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def encode_cursor(movies, tombstones):
+    """``movies`` and ``tombstones`` are ``(timestamp, id)`` positions"""
+    parts = [CURSOR_VERSION, _to_micros(movies[0]), movies[1], _to_micros(tombstones[0]), tombstones[1]]
+    return base64.urlsafe_b64encode(':'.join(map(str, parts)).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        version, *numbers = raw.split(':')
+        movie_ts, movie_id, tomb_ts, tomb_id = map(int, numbers)
+    except ValueError:
+        raise InvalidCursor(cursor)
+    if version != CURSOR_VERSION:
+        raise InvalidCursor(cursor)
+    return (_from_micros(movie_ts), movie_id), (_from_micros(tomb_ts), tomb_id)
+
+
+def _after(queryset, field, position, upper):
+    timestamp, pk = position
+    # The >= bound alone is a range on the (field, id) index, read in order;
+    # the OR only drops the rows at the cursor's timestamp already listed
+    return (
+        queryset
+        .filter(**{f'{field}__gte': timestamp, f'{field}__lte': upper})
+        .filter(Q(**{f'{field}__gt': timestamp}) | Q(id__gt=pk))
+        .order_by(field, 'id')
+    )
+
+
+def get_changes(fast, cursor=None, limit=500):
+    """
+    Return ``(upsert rows, deleted movie ids, next cursor, has_more)``.
+    Upsert rows are ``fast.values()`` rows, ready for ``fast.serialize``.
+    """
+    upper = timezone.now() - timedelta(seconds=settings.CHANGES_SAFETY_WINDOW)
+    if cursor:
+        movie_position, tomb_position = decode_cursor(cursor)
+        horizon = timezone.now() - timedelta(days=settings.CHANGES_TOMBSTONE_DAYS)
+        if tomb_position[0] < horizon:
+            raise ExpiredCursor(cursor)
+    else:
+        # A first sync lists every movie; deletions from here on are tombstones
+        movie_position, tomb_position = (EPOCH, 0), (upper, 0)
+
+    movies = list(
+        fast.values(_after(Movie.objects.all(), 'updated_at', movie_position, upper), 'id', 'updated_at')[:limit + 1]
+    )
+    tombstones = list(
+        _after(MovieTombstone.objects.all(), 'deleted_at', tomb_position, upper)
+        .values_list('deleted_at', 'id', 'movie_id')[:limit + 1]
+    )
+
+    # Merge both streams in timestamp order and take the first `limit` events
+    events = sorted(
+        [(row['updated_at'], 0, row['id'], row) for row in movies]
+        + [(deleted_at, 1, pk, movie_id) for deleted_at, pk, movie_id in tombstones]
+    )
+    has_more = len(events) > limit
+    upserts, deletes = [], []
+    for timestamp, kind, pk, item in events[:limit]:
+        if kind == 0:
+            upserts.append(item)
+            movie_position = (timestamp, pk)
+        else:
+            deletes.append(item)
+            tomb_position = (timestamp, pk)
+
+    # A stream read to the end has nothing left up to `upper`; moving its
+    # position there keeps quiet streams from ageing the cursor
+    if len(upserts) == len(movies) <= limit:
+        movie_position = max(movie_position, (upper, 0))
+    if len(deletes) == len(tombstones) <= limit:
+        tomb_position = max(tomb_position, (upper, 0))
+
+    return upserts, deletes, encode_cursor(movie_position, tomb_position), has_more
@@ -0,0 +1,345 @@
+"""
+Content-based "similar titles".
+
+Every movie is turned into a TF-IDF weighted feature vector over its
+description, title, genres, director, cast and language. Features are hashed
+into a fixed number of dimensions so vectors of new movies can be computed
+without refitting a vocabulary, and the vectors are L2 normalised so a dot
+product is the cosine similarity.
+
+The index lives in ``settings.CONTENT_SIMILARITY_DIR``:
+
+* ``manifest.json`` - dimensions, document count and the current build id
+* ``idf-<build>.npy`` - inverse document frequency per hashed dimension
+* ``vectors-<build>.f32`` - raw float32 rows, one per movie
+* ``meta-<build>.bin`` - raw rows of (movie id, language, certification)
+
+The raw files are append-only, so saving a single movie in the admin either
+rewrites its row in place or appends a new one, without a rebuild. Readers
+memory-map them and notice appended rows when the file grows.
+"""
+import fcntl
+import json
+import logging
+import os
+import re
+import time
+import uuid
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+from .models import Movie
+
+logger = logging.getLogger(__name__)
+
+META_DTYPE = np.dtype([('movie_id', '<i8'), ('language', 'i1'), ('certification', 'i1')])
+
+LANGUAGE_CODES = {value: code for code, (value, _) in enumerate(Movie.LANGUAGE_CHOICES)}
+CERTIFICATION_CODES = {value: code for code, (value, _) in enumerate(Movie.RATING_CHOICES)}
+
+# Relative weight of each metadata field
+FIELD_WEIGHTS = {
+    'description': 1.0,
+    'title': 0.5,
+    'genre': 2.0,
+    'director': 1.5,
+    'cast': 1.0,
+    'language': 1.0,
+}
+
+STOP_WORDS = frozenset("""
+    a an and are as at be but by for from has have he her his in into is it its
+    of on or she that the their them they this to was were when where which who
+    will with after before about while
+""".split())
+
+BATCH_SIZE = 2000
+INDEX_RELOAD_INTERVAL = 5.0
+
+WORD_RE = re.compile(r'[a-z0-9]+')
+
+MOVIE_FIELDS = ('id', 'title', 'description', 'director', 'cast', 'language', 'certification')
+
+
+# Feature extraction
+
+def _words(text):
+    return [w for w in WORD_RE.findall(text.lower()) if len(w) > 2 and w not in STOP_WORDS]
+
+
+def movie_features(movie, genre_names):
+    """Return ``{feature: weight}`` for a movie given as a dict of MOVIE_FIELDS"""
+    features = Counter()
+    for field in ('description', 'title'):
+        for word, count in Counter(_words(movie[field] or '')).items():
+            features[f'w:{word}'] += FIELD_WEIGHTS[field] * (1 + np.log(count))
+    for name in genre_names:
+        features[f'genre:{name.lower()}'] += FIELD_WEIGHTS['genre']
+    if movie['director']:
+        features[f'director:{movie["director"].strip().lower()}'] += FIELD_WEIGHTS['director']
+    for name in (movie['cast'] or '').split(','):
+        if name.strip():
+            features[f'cast:{name.strip().lower()}'] += FIELD_WEIGHTS['cast']
+    features[f'language:{movie["language"].lower()}'] += FIELD_WEIGHTS['language']
+    return features
+
+
+def hash_features(features, dims):
+    """Hash features into ``(buckets, signed weights)`` arrays"""
+    hashes = np.fromiter((zlib.crc32(name.encode()) for name in features), dtype=np.uint32, count=len(features))
+    weights = np.fromiter(features.values(), dtype=np.float32, count=len(features))
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+    return (hashes % dims).astype(np.int64), signs * weights
+
+
+def _movie_batches(queryset):
+    """Yield lists of ``(movie dict, genre names)`` in batches"""
+    through = Movie.genre.through
+    batch = []
+    for movie in queryset.order_by('id').values(*MOVIE_FIELDS).iterator(chunk_size=BATCH_SIZE):
+        batch.append(movie)
+        if len(batch) == BATCH_SIZE:
+            yield _with_genres(batch, through)
+            batch = []
+    if batch:
+        yield _with_genres(batch, through)
+
+
+def _with_genres(batch, through):
+    genres = {}
+    rows = through.objects.filter(movie_id__in=[m['id'] for m in batch]).values_list('movie_id', 'genre__name')
+    for movie_id, name in rows:
+        genres.setdefault(movie_id, []).append(name)
+    return [(movie, genres.get(movie['id'], [])) for movie in batch]
+
+
+def vectorize(batch, idf):
+    """Normalised feature vectors for a batch of ``(movie, genres)``"""
+    dims = len(idf)
+    vectors = np.zeros((len(batch), dims), dtype=np.float32)
+    for row, (movie, genre_names) in enumerate(batch):
+        buckets, weights = hash_features(movie_features(movie, genre_names), dims)
+        np.add.at(vectors[row], buckets, weights * idf[buckets])
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def meta_rows(batch):
+    meta = np.zeros(len(batch), dtype=META_DTYPE)
+    meta['movie_id'] = [movie['id'] for movie, _ in batch]
+    meta['language'] = [LANGUAGE_CODES.get(movie['language'], -1) for movie, _ in batch]
+    meta['certification'] = [CERTIFICATION_CODES.get(movie['certification'], -1) for movie, _ in batch]
+    return meta
+
+
+# Index files
+
+def _path(name, directory=None):
+    return os.path.join(directory or settings.CONTENT_SIMILARITY_DIR, name)
+
+
+def read_manifest(directory=None):
+    try:
+        with open(_path('manifest.json', directory)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+@contextmanager
+def _locked(directory=None):
+    """Serialise writers (rebuilds and single-movie updates) across processes"""
+    os.makedirs(directory or settings.CONTENT_SIMILARITY_DIR, exist_ok=True)
+    with open(_path('.lock', directory), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def build_index(directory=None, dims=None):
+    """Rebuild the whole index and return the number of movies in it"""
+    dims = dims or settings.CONTENT_SIMILARITY_DIMS
+    started = time.monotonic()
+
+    # First pass: document frequencies per hashed dimension
+    doc_freq = np.zeros(dims, dtype=np.int64)
+    documents = 0
+    for batch in _movie_batches(Movie.objects.all()):
+        for movie, genre_names in batch:
+            buckets, _ = hash_features(movie_features(movie, genre_names), dims)
+            doc_freq[np.unique(buckets)] += 1
+        documents += len(batch)
+    idf = (np.log((1 + documents) / (1 + doc_freq)) + 1).astype(np.float32)
+
+    # Second pass: vectors, written batch by batch
+    build = uuid.uuid4().hex[:12]
+    with _locked(directory):
+        np.save(_path(f'idf-{build}.npy', directory), idf)
+        with open(_path(f'vectors-{build}.f32', directory), 'wb') as vectors_file, \
+                open(_path(f'meta-{build}.bin', directory), 'wb') as meta_file:
+            for batch in _movie_batches(Movie.objects.all()):
+                vectors_file.write(vectorize(batch, idf).tobytes())
+                meta_file.write(meta_rows(batch).tobytes())
+
+        previous = read_manifest(directory)
+        manifest = {'build': build, 'dims': dims, 'documents': documents, 'built_at': time.time()}
+        tmp_path = _path(f'manifest.json.{build}', directory)
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, _path('manifest.json', directory))
+
+        if previous:
+            for name in ('idf-{}.npy', 'vectors-{}.f32', 'meta-{}.bin'):
+                try:
+                    os.remove(_path(name.format(previous['build']), directory))
+                except FileNotFoundError:
+                    pass
+
+    logger.info("Built content index for %d movies in %.1fs", documents, time.monotonic() - started)
+    return documents
+
+
+def update_movie(movie, directory=None):
+    """
+    Write the vector of a single movie into the current index, replacing its
+    row if it is already indexed. Uses the IDF of the last full build.
+    Returns False when no index has been built yet.
+    """
+    batch = _with_genres(list(Movie.objects.filter(pk=movie.pk).values(*MOVIE_FIELDS)), Movie.genre.through)
+    if not batch:
+        return remove_movie(movie.pk, directory)
+
+    # A rebuild may replace the files until the lock is held
+    with _locked(directory):
+        manifest = read_manifest(directory)
+        if manifest is None:
+            return False
+        build = manifest['build']
+        idf = np.load(_path(f'idf-{build}.npy', directory))
+        vector, meta = vectorize(batch, idf), meta_rows(batch)
+
+        meta_path = _path(f'meta-{build}.bin', directory)
+        vectors_path = _path(f'vectors-{build}.f32', directory)
+        row = _find_row(meta_path, movie.pk)
+        if row is None:
+            with open(vectors_path, 'ab') as f:
+                f.write(vector.tobytes())
+            with open(meta_path, 'ab') as f:
+                f.write(meta.tobytes())
+        else:
+            with open(vectors_path, 'r+b') as f:
+                f.seek(row * vector.nbytes)
+                f.write(vector.tobytes())
+            with open(meta_path, 'r+b') as f:
+                f.seek(row * META_DTYPE.itemsize)
+                f.write(meta.tobytes())
+    return True
+
+
+def remove_movie(movie_id, directory=None):
+    """Blank out the row of a deleted movie"""
+    with _locked(directory):
+        manifest = read_manifest(directory)
+        if manifest is None:
+            return False
+        meta_path = _path(f'meta-{manifest["build"]}.bin', directory)
+        row = _find_row(meta_path, movie_id)
+        if row is not None:
+            with open(meta_path, 'r+b') as f:
+                f.seek(row * META_DTYPE.itemsize)
+                f.write(np.array([(-1, -1, -1)], dtype=META_DTYPE).tobytes())
+    return True
+
+
+def _find_row(meta_path, movie_id):
+    meta = np.fromfile(meta_path, dtype=META_DTYPE)
+    rows = np.flatnonzero(meta['movie_id'] == movie_id)
+    return int(rows[0]) if len(rows) else None
+
+
+# Querying
+
+class ContentIndex:
+    """Memory-mapped view over the content similarity index"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._state = None
+        self._checked_at = 0.0
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._state is not None and now - self._checked_at < INDEX_RELOAD_INTERVAL:
+            return
+        self._checked_at = now
+
+        manifest = read_manifest(self.directory)
+        if manifest is None:
+            self._state = None
+            return
+        build, dims = manifest['build'], manifest['dims']
+        meta_path = _path(f'meta-{build}.bin', self.directory)
+        try:
+            rows = os.path.getsize(meta_path) // META_DTYPE.itemsize
+        except FileNotFoundError:
+            self._state = None
+            return
+        if self._state and self._state['build'] == build and self._state['rows'] == rows:
+            return
+        if rows == 0:
+            self._state = None
+            return
+
+        meta = np.memmap(meta_path, dtype=META_DTYPE, mode='r', shape=(rows,))
+        vectors = np.memmap(
+            _path(f'vectors-{build}.f32', self.directory), dtype=np.float32, mode='r', shape=(rows, dims)
+        )
+        self._state = {'build': build, 'rows': rows, 'meta': meta, 'vectors': vectors}
+
+    def similar(self, movie_id, limit=10, language=None, certification=None):
+        """
+        Return ``[(movie_id, score), ...]`` for the most similar titles, or
+        None if the movie is not indexed. ``language`` and ``certification``
+        restrict the candidates.
+        """
+        self._refresh()
+        if self._state is None:
+            return None
+        meta, vectors = self._state['meta'], self._state['vectors']
+
+        ids = meta['movie_id']
+        rows = np.flatnonzero(ids == movie_id)
+        if not len(rows):
+            return None
+
+        scores = vectors @ vectors[rows[0]]
+        excluded = ids < 0
+        excluded[rows[0]] = True
+        if language:
+            excluded |= meta['language'] != LANGUAGE_CODES.get(language, -2)
+        if certification:
+            excluded |= meta['certification'] != CERTIFICATION_CODES.get(certification, -2)
+        scores[excluded] = -np.inf
+
+        limit = min(limit, len(scores))
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(int(ids[i]), float(scores[i])) for i in best if np.isfinite(scores[i])]
+
+
+_indexes = {}
+
+
+def get_content_index(directory=None):
+    """Process-wide ContentIndex for ``directory`` (defaults to the configured one)"""
+    directory = directory or settings.CONTENT_SIMILARITY_DIR
+    if directory not in _indexes:
+        _indexes[directory] = ContentIndex(directory)
+    return _indexes[directory]
@@ -0,0 +1,393 @@
+"""
+Synthetic data at benchmark scale.
+
+``generate()`` writes movies (with their genres), users (with profiles and
+subscriptions), ratings and activity in chunks of ``chunk_size`` rows, each
+chunk with ``bulk_create``, on several worker processes if asked. Rows get
+explicit ids following the highest existing ones, so a chunk of ratings can
+point at movies and users written by other chunks without reading them back.
+
+Every chunk draws from its own RNG, seeded with the seed, the table and the
+chunk number: a seed produces the same rows (given the same starting ids, and
+on the same day, as timestamps count back from today) whatever the number of
+workers or the order chunks finish in.
+
+The distributions are skewed the way a real catalog is:
+
+* languages, genres and certifications by fixed weights
+* popularity follows Zipf's law: the movie at popularity rank ``r`` is viewed
+  and rated in proportion to ``1 / r ** MOVIE_ZIPF``, and its ``view_count``
+  too; the most popular movies are the featured and trending ones
+* a few users produce most of the activity (``USER_ZIPF``)
+* release dates lean recent, and ratings cluster around each movie's quality
+"""
+import logging
+import math
+import random
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import django
+from django.apps import apps
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from .catalog_version import bump
+from .models import Genre, Movie, MovieRating, Subscription, UserActivity, UserProfile
+
+logger = logging.getLogger(__name__)
+
+LANGUAGE_WEIGHTS = {
+    'Hindi': 28, 'English': 22, 'Tamil': 12, 'Telugu': 12, 'Malayalam': 8,
+    'Kannada': 6, 'Bengali': 5, 'Marathi': 4, 'Punjabi': 2, 'Gujarati': 1,
+}
+GENRE_WEIGHTS = {
+    'Drama': 25, 'Action': 18, 'Comedy': 16, 'Thriller': 10, 'Romance': 10,
+    'Crime': 7, 'Horror': 5, 'Animation': 4, 'Sci-Fi': 3, 'Documentary': 2,
+}
+CERTIFICATION_WEIGHTS = {'U': 30, 'U/A': 50, 'A': 18, 'S': 2}
+PLAN_WEIGHTS = {'basic': 50, 'standard': 35, 'premium': 15}
+ACTIVITY_WEIGHTS = {'movie_view': 70, 'login': 20, 'logout': 6, 'profile_update': 2, 'subscription': 2}
+ACTIVITY_DESCRIPTIONS = {
+    'movie_view': 'Watched a movie',
+    'login': 'User logged in',
+    'logout': 'User logged out',
+    'profile_update': 'Profile updated',
+    'subscription': 'Subscription changed',
+}
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148',
+    'Mozilla/5.0 (Linux; Android 14; SM-S918B) AppleWebKit/537.36 Chrome/120.0 Mobile Safari/537.36',
+    'Mozilla/5.0 (SMART-TV; Linux; Tizen 7.0) AppleWebKit/537.36 SamsungBrowser/5.0 TV Safari/537.36',
+]
+TITLE_WORDS = (
+    'Silent River Shadow Kingdom Last Monsoon Broken Promise Golden Hour Midnight Express '
+    'Forgotten City Burning Sky Hidden Truth Lost Highway Rising Storm Second Chance '
+    'Distant Shore Crimson Tide Wild Heart Iron Will Secret Garden Endless Night Paper Moon'
+).split()
+NAMES = (
+    'Arjun Priya Rahul Ananya Vikram Meera Karthik Divya Rohan Kavya Aditya Nisha '
+    'Suresh Lakshmi Farhan Zoya Manoj Anjali Ravi Pooja Sanjay Neha Imran Deepa'
+).split()
+SURNAMES = 'Sharma Nair Reddy Iyer Khan Menon Das Patel Rao Singh Pillai Kapoor'.split()
+
+MOVIE_ZIPF = 1.1
+USER_ZIPF = 0.8
+TOP_VIEW_COUNT = 5_000_000
+PASSWORD = 'password123'
+
+
+@contextmanager
+def explicit_timestamps(model):
+    """Let ``model``'s auto_now / auto_now_add fields keep the values they are given"""
+    fields = {
+        field: (field.auto_now, field.auto_now_add) for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    }
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in fields.items():
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Zipf:
+    """
+    Offsets ``0 .. n - 1`` drawn with Zipf's law, in O(1) time and memory.
+
+    Ranks are drawn by inverting the continuous approximation of the
+    distribution, and mapped to offsets by a fixed affine permutation, so the
+    popular items are spread over the id range instead of being the first ids.
+    """
+
+    def __init__(self, n, s, seed, name):
+        rng = random.Random(f'{seed}:{name}:order')
+        self.n, self.s = n, s
+        self.a = 1
+        if n > 2:
+            self.a = rng.randrange(1, n)
+            while math.gcd(self.a, n) != 1:
+                self.a = rng.randrange(1, n)
+        self.b = rng.randrange(n)
+        self.a_inverse = pow(self.a, -1, n) if n > 1 else 0
+        self.top = self._cdf(n + 1)
+
+    def _cdf(self, x):
+        if self.s == 1:
+            return math.log(x)
+        return (x ** (1 - self.s) - 1) / (1 - self.s)
+
+    def _rank(self, u):
+        if self.s == 1:
+            return int(math.exp(u))
+        return int((1 + (1 - self.s) * u) ** (1 / (1 - self.s)))
+
+    def sample(self, rng):
+        rank = min(max(self._rank(rng.random() * self.top), 1), self.n)
+        return (self.a * (rank - 1) + self.b) % self.n
+
+    def rank(self, offset):
+        """Popularity rank (1 is the most popular) of ``offset``"""
+        return (self.a_inverse * (offset - self.b)) % self.n + 1
+
+
+def _weighted(weights):
+    return list(weights), list(weights.values())
+
+
+def _quality(movie_id):
+    """A movie's rating out of 10, fixed by its id"""
+    return round(4.0 + (movie_id * 2654435761 % 1000) / 1000 * 5.0, 1)
+
+
+def _chunks(total, chunk_size):
+    return [(start, min(chunk_size, total - start)) for start in range(0, total, chunk_size)]
+
+
+class Plan:
+    """Everything a chunk needs, picklable for the worker processes"""
+
+    def __init__(self, seed, movies, users, ratings, activity, days, chunk_size):
+        self.seed = seed
+        self.movies, self.users, self.ratings, self.activity = movies, users, ratings, activity
+        self.days = days
+        self.chunk_size = chunk_size
+        # No more rating chunks than users, as each chunk rates with its own users
+        self.rating_chunk_size = max(chunk_size, math.ceil(ratings / users)) if users else chunk_size
+        # Timestamps count back from midnight, so runs on the same day match
+        self.now = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.genre_ids = dict(Genre.objects.filter(name__in=GENRE_WEIGHTS).values_list('name', 'id'))
+        self.movie_base = (Movie.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        self.user_base = (User.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        # Every user gets this one hash, made once, with a salt fixed by the seed
+        self.password = make_password(PASSWORD, salt=f'synthetic{seed}')
+
+    def rng(self, table, chunk):
+        return random.Random(f'{self.seed}:{table}:{chunk}')
+
+    def movie_popularity(self):
+        return Zipf(self.movies, MOVIE_ZIPF, self.seed, 'movies')
+
+    def user_activity(self):
+        return Zipf(self.users, USER_ZIPF, self.seed, 'users')
+
+    def timestamp(self, rng):
+        return self.now - timedelta(seconds=rng.random() * self.days * 86400)
+
+
+def _movies_chunk(plan, start, count):
+    rng = plan.rng('movies', start)
+    popularity = plan.movie_popularity()
+    languages, language_weights = _weighted(LANGUAGE_WEIGHTS)
+    genres, genre_weights = _weighted(GENRE_WEIGHTS)
+    certifications, certification_weights = _weighted(CERTIFICATION_WEIGHTS)
+    featured_ranks = max(10, plan.movies // 2000)
+    trending_ranks = max(20, plan.movies // 1000)
+    today = plan.now.date()
+
+    movies, movie_genres = [], []
+    Through = Movie.genre.through
+    for offset in range(start, start + count):
+        movie_id = plan.movie_base + offset
+        rank = popularity.rank(offset)
+        title = ' '.join(rng.sample(TITLE_WORDS, rng.choice((2, 2, 3))))
+        if rng.random() < 0.2:
+            title += f' {rng.randint(2, 4)}'
+        years_ago = min(int(rng.expovariate(1 / 8)), today.year - 1950)
+        created_at = plan.timestamp(rng)
+        movies.append(Movie(
+            id=movie_id,
+            title=title,
+            description=f'{title}: a story of {" ".join(rng.sample(TITLE_WORDS, 6)).lower()}.',
+            release_date=date(today.year - years_ago, rng.randint(1, 12), rng.randint(1, 28)),
+            thumbnail='thumbnails/synthetic.jpg',
+            video='videos/synthetic.mp4',
+            language=rng.choices(languages, language_weights)[0],
+            duration=timedelta(minutes=max(70, int(rng.gauss(135, 25)))),
+            rating=_quality(movie_id),
+            certification=rng.choices(certifications, certification_weights)[0],
+            director=f'{rng.choice(NAMES)} {rng.choice(SURNAMES)}',
+            cast=', '.join(f'{rng.choice(NAMES)} {rng.choice(SURNAMES)}' for _ in range(rng.randint(2, 5))),
+            is_featured=rank <= featured_ranks,
+            is_trending=rank <= trending_ranks and rng.random() < 0.5,
+            view_count=int(TOP_VIEW_COUNT / rank ** MOVIE_ZIPF),
+            created_at=created_at,
+            updated_at=created_at,
+        ))
+        chosen = set()
+        for _ in range(rng.choices((1, 2, 3), (40, 45, 15))[0]):
+            chosen.add(rng.choices(genres, genre_weights)[0])
+        movie_genres.extend(
+            Through(movie_id=movie_id, genre_id=plan.genre_ids[name]) for name in sorted(chosen)
+        )
+
+    with explicit_timestamps(Movie), transaction.atomic():
+        Movie.objects.bulk_create(movies)
+        Through.objects.bulk_create(movie_genres)
+    return count
+
+
+def _users_chunk(plan, start, count):
+    rng = plan.rng('users', start)
+    plans, plan_weights = _weighted(PLAN_WEIGHTS)
+    users, profiles, subscriptions = [], [], []
+    for offset in range(start, start + count):
+        user_id = plan.user_base + offset
+        joined = plan.timestamp(rng)
+        username = f'synthetic_{user_id}'
+        users.append(User(
+            id=user_id, username=username, email=f'{username}@example.com', password=plan.password,
+            first_name=rng.choice(NAMES), last_name=rng.choice(SURNAMES), date_joined=joined,
+        ))
+        profiles.append(UserProfile(
+            user_id=user_id, email=f'{username}@example.com', phone_number=f'+91{user_id:010d}',
+            is_verified=rng.random() < 0.8, created_at=joined, updated_at=joined,
+        ))
+        if rng.random() < 0.6:
+            end_date = plan.now + timedelta(days=rng.randint(-60, 365))
+            status = 'active' if end_date > plan.now and rng.random() < 0.9 else rng.choice(('expired', 'cancelled'))
+            subscriptions.append(Subscription(
+                user_id=user_id, subscription_plan=rng.choices(plans, plan_weights)[0], status=status,
+                start_date=joined, end_date=end_date, is_active=status == 'active',
+                created_at=joined, updated_at=joined,
+            ))
+
+    with explicit_timestamps(UserProfile), explicit_timestamps(Subscription), transaction.atomic():
+        User.objects.bulk_create(users)
+        UserProfile.objects.bulk_create(profiles)
+        Subscription.objects.bulk_create(subscriptions)
+    return count
+
+
+def _ratings_chunk(plan, start, count):
+    """``count`` ratings by distinct (user, movie) pairs, users drawn from the chunk's own share of users"""
+    rng = plan.rng('ratings', start)
+    popularity = plan.movie_popularity()
+    # Chunks rate with disjoint slices of the users, so pairs never collide across chunks
+    chunks = math.ceil(plan.ratings / plan.rating_chunk_size)
+    index = start // plan.rating_chunk_size
+    first_user = plan.users * index // chunks
+    last_user = plan.users * (index + 1) // chunks
+
+    pairs, ratings = set(), []
+    while len(ratings) < count:
+        user_id = plan.user_base + rng.randrange(first_user, last_user)
+        movie_id = plan.movie_base + popularity.sample(rng)
+        if (user_id, movie_id) in pairs:
+            continue
+        pairs.add((user_id, movie_id))
+        rated_at = plan.timestamp(rng)
+        ratings.append(MovieRating(
+            user_id=user_id, movie_id=movie_id,
+            rating=min(10.0, max(1.0, round(rng.gauss(_quality(movie_id), 1.5)))),
+            created_at=rated_at, updated_at=rated_at,
+        ))
+
+    with explicit_timestamps(MovieRating):
+        MovieRating.objects.bulk_create(ratings)
+    return len(ratings)
+
+
+def _activity_chunk(plan, start, count):
+    rng = plan.rng('activity', start)
+    movies = plan.movie_popularity()
+    users = plan.user_activity()
+    types, type_weights = _weighted(ACTIVITY_WEIGHTS)
+    rows = []
+    for _ in range(count):
+        activity_type = rng.choices(types, type_weights)[0]
+        rows.append(UserActivity(
+            user_id=plan.user_base + users.sample(rng),
+            activity_type=activity_type,
+            description=ACTIVITY_DESCRIPTIONS[activity_type],
+            movie_id=plan.movie_base + movies.sample(rng) if activity_type == 'movie_view' else None,
+            ip_address=f'10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}',
+            user_agent=rng.choice(USER_AGENTS),
+            created_at=plan.timestamp(rng),
+        ))
+    with explicit_timestamps(UserActivity):
+        UserActivity.objects.bulk_create(rows)
+    return count
+
+
+CHUNK_WRITERS = {
+    'movies': _movies_chunk,
+    'users': _users_chunk,
+    'ratings': _ratings_chunk,
+    'activity': _activity_chunk,
+}
+
+
+def setup_worker():
+    # Spawned (not forked) workers start without Django
+    if not apps.ready:
+        django.setup()
+
+
+def _run_chunk(plan, table, start, count):
+    return table, CHUNK_WRITERS[table](plan, start, count)
+
+
+def _reset_sequences(*models):
+    """Move primary key sequences (PostgreSQL) past the explicit ids"""
+    for model in models:
+        connection = connections[router.db_for_write(model)]
+        statements = connection.ops.sequence_reset_sql(no_style(), [model])
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
+
+def generate(movies, users, ratings, activity, seed=1, days=365, chunk_size=10000, workers=1, progress=None):
+    """
+    Write the dataset; returns ``{table: rows written}``. ``progress(table,
+    rows)`` is called after every chunk. Movies and users are written first,
+    then ratings and activity, which refer to them.
+    """
+    if (ratings or activity) and not (movies and users):
+        raise ValueError('Ratings and activity need movies and users to refer to')
+    if ratings > movies * users // 2:
+        raise ValueError('Ratings must be at most half of movies x users, one per user and movie')
+    for name in GENRE_WEIGHTS:
+        Genre.objects.get_or_create(name=name)
+    plan = Plan(seed, movies, users, ratings, activity, days, chunk_size)
+    phases = [
+        [('movies', chunk) for chunk in _chunks(movies, chunk_size)]
+        + [('users', chunk) for chunk in _chunks(users, chunk_size)],
+        [('ratings', chunk) for chunk in _chunks(ratings, plan.rating_chunk_size)]
+        + [('activity', chunk) for chunk in _chunks(activity, chunk_size)],
+    ]
+
+    written = dict.fromkeys(CHUNK_WRITERS, 0)
+
+    def done(table, rows):
+        written[table] += rows
+        if progress:
+            progress(table, rows)
+
+    if workers > 1:
+        # Forked workers must not share the parent's database connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=setup_worker) as pool:
+            for phase in phases:
+                futures = [pool.submit(_run_chunk, plan, table, *chunk) for table, chunk in phase]
+                for future in futures:
+                    done(*future.result())
+    else:
+        for phase in phases:
+            for table, chunk in phase:
+                done(*_run_chunk(plan, table, *chunk))
+
+    _reset_sequences(Movie, User)
+    if movies:
+        bump('movies', 'genres', 'featured', 'trending', *(f'language:{name}' for name in LANGUAGE_WEIGHTS))
+    logger.info("Generated %s", written)
+    return written
@@ -0,0 +1,181 @@
+"""
+Database routing: an events database for append-only tables, and read
+replicas for catalog reads.
+
+Event models (``EVENT_MODELS``) live in ``settings.EVENTS_DATABASE``, which
+is the primary unless ``EVENTS_DB_NAME`` configures a separate ``events``
+database. ``EventRouter`` sends all their reads, writes and migrations
+there. Nothing joins across the two: event relations have no database
+constraints, and code that needs users or movies for events loads them with
+``prefetch_related`` or by id.
+
+The early migrations created the event tables with foreign keys to users and
+movies, which a separate events database does not have. There, the router
+skips every event migration up to ``EVENTS_SCHEMA_MIGRATION``, which creates
+the tables as they are at that point, and applies the event migrations after
+it as usual.
+
+Read replicas
+-------------
+
+With replicas configured (``DB_REPLICA_HOSTS``), ``ReplicaRouter`` sends
+reads of the catalog models (movies, genres) to a replica and everything
+else to the primary. Reads stay on the primary when a replica could return
+data older than what the client just wrote or was just told about:
+
+* for the rest of a request (or management command) once it has written
+* for ``REPLICA_STICKY_SECONDS`` after a client's last write, through a
+  cookie set by ``PrimaryStickinessMiddleware``
+* for ``REPLICA_MAX_LAG_SECONDS`` after any catalog change, since the
+  catalog version (and so ETags and cache keys) moves before replicas catch up
+* for code that needs a consistent view regardless, inside ``primary()``
+
+A replica whose lag exceeds ``REPLICA_MAX_LAG_SECONDS`` or that cannot be
+reached is skipped. Lag is the difference between the heartbeat row on the
+primary and on the replica (``manage.py replication_heartbeat``), checked at
+most every ``LAG_CHECK_INTERVAL`` seconds per process.
+"""
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.migrations.recorder import MigrationRecorder
+
+from .models import ReplicationHeartbeat
+
+logger = logging.getLogger(__name__)
+
+# Catalog models, by ``_meta.label_lower``; the genre through table follows Movie
+REPLICATED_MODELS = {'OTTAPP.movie', 'OTTAPP.genre', 'OTTAPP.movie_genre'}
+EVENT_MODELS = {'OTTAPP.useractivity', 'OTTAPP.useractivityrollup', 'OTTAPP.playbacksession'}
+# Creates the event tables in a separate events database
+EVENTS_SCHEMA_MIGRATION = ('OTTAPP', '0013_events_schema')
+LAG_CHECK_INTERVAL = 5
+
+_pinned = ContextVar('db_pinned', default=False)
+_replica_health = {}  # alias -> (checked at, usable)
+
+
+def is_pinned():
+    return _pinned.get()
+
+
+@contextmanager
+def pinned(value=True):
+    """Inside the block, reads go to the primary if ``value`` (until something writes)"""
+    token = _pinned.set(value)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def primary():
+    """Read from the primary inside the block"""
+    return pinned(True)
+
+
+def replica_lag(alias):
+    """Seconds the replica ``alias`` is behind the primary, or None without a heartbeat"""
+    beats = [
+        ReplicationHeartbeat.objects.using(db).filter(pk=1).values_list('beat_at', flat=True).first()
+        for db in (DEFAULT_DB_ALIAS, alias)
+    ]
+    if beats[0] is None:
+        return None
+    if beats[1] is None:
+        return float('inf')
+    return max((beats[0] - beats[1]).total_seconds(), 0)
+
+
+def replica_usable(alias):
+    checked_at, usable = _replica_health.get(alias, (0, True))
+    now = time.monotonic()
+    if now - checked_at < LAG_CHECK_INTERVAL:
+        return usable
+    try:
+        lag = replica_lag(alias)
+        usable = lag is None or lag <= settings.REPLICA_MAX_LAG_SECONDS
+        if not usable:
+            logger.warning(f"Replica {alias} is {lag}s behind, reading from the primary")
+    except DatabaseError as e:
+        logger.error(f"Replica {alias} unavailable: {e}")
+        connections[alias].close()
+        usable = False
+    _replica_health[alias] = (now, usable)
+    return usable
+
+
+def is_event_model(model):
+    return model._meta.label_lower in EVENT_MODELS
+
+
+def events_schema_created(db):
+    """Whether ``EVENTS_SCHEMA_MIGRATION`` has run on ``db``"""
+    recorder = MigrationRecorder(connections[db])
+    try:
+        return recorder.has_table() and EVENTS_SCHEMA_MIGRATION in recorder.applied_migrations()
+    except DatabaseError:
+        return False
+
+
+class EventRouter:
+    def db_for_read(self, model, **hints):
+        if is_event_model(model):
+            return settings.EVENTS_DATABASE
+        return None
+
+    def db_for_write(self, model, **hints):
+        if is_event_model(model):
+            return settings.EVENTS_DATABASE
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_event_model(obj1) or is_event_model(obj2):
+            # Events point at users and movies by id only
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if settings.EVENTS_DATABASE == DEFAULT_DB_ALIAS:
+            return None
+        if hints.get('events_schema'):
+            return db == settings.EVENTS_DATABASE
+        model = hints.get('model')
+        if model is None and model_name is not None:
+            try:
+                model = apps.get_model(app_label, model_name)
+            except LookupError:
+                # A model since removed from the code
+                pass
+        is_event = model is not None and is_event_model(model)
+        if db == settings.EVENTS_DATABASE:
+            return is_event and events_schema_created(db)
+        return False if is_event else None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = settings.REPLICA_DATABASES
+        if not replicas or _pinned.get() or model._meta.label_lower not in REPLICATED_MODELS:
+            return DEFAULT_DB_ALIAS
+        usable = [alias for alias in replicas if replica_usable(alias)]
+        return random.choice(usable) if usable else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Read what was just written from where it was written
+        _pinned.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        return db not in settings.REPLICA_DATABASES
@@ -0,0 +1,286 @@
+"""
+Fast path for read-only list serializers.
+
+DRF spends most of a list response in per-field ``get_attribute`` and
+``to_representation`` calls on model instances. ``FastSerializer`` compiles a
+ModelSerializer class once into a list of plain converters that run on
+``values()`` rows instead, and loads many-to-many children with one query per
+relation for the whole page. The output is the same as the serializer's.
+
+Supported field types are the ones our list shapes use: model fields, file
+and image fields, nested serializers (foreign keys and many-to-many),
+primary keys of relations and ``StringRelatedField(many=True)``. Anything else (e.g. SerializerMethodField)
+is rejected when the fast serializer is compiled.
+
+``aserialize`` is ``serialize`` for async views: relations are loaded with
+the async ORM, all of them at once.
+"""
+import asyncio
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField, StringRelatedField
+
+from .metrics import timed
+from .serializers import (
+    GenreSerializer, MovieListSerializer, MovieSerializer, WatchlistSerializer, WatchProgressSerializer
+)
+
+
+def _identity(value, context):
+    return value
+
+
+def _file_converter(model_field):
+    storage = model_field.storage
+
+    def convert(name, context):
+        if not name:
+            return None
+        url = storage.url(name)
+        base = context.get('_base_url')
+        if base is not None and url.startswith('/') and not url.startswith('//') and '/.' not in url:
+            # What build_absolute_uri() returns for a plain absolute path
+            return base + url
+        request = context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+    return convert
+
+
+def _datetime_converter(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if (output_format is None or output_format.lower() != ISO_8601
+            or hasattr(field, 'timezone') or not settings.USE_TZ):
+        return lambda value, context: field.to_representation(value)
+
+    def convert(value, context):
+        if timezone.is_naive(value):
+            return field.to_representation(value)
+        value = value.astimezone(context['_timezone']).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+def _scalar_converter(field, model_field):
+    if isinstance(field, serializers.FileField):
+        return _file_converter(model_field)
+    if isinstance(field, serializers.BooleanField):
+        return lambda value, context: bool(value)
+    if isinstance(field, serializers.IntegerField):
+        return lambda value, context: int(value)
+    if isinstance(field, serializers.FloatField):
+        return lambda value, context: float(value)
+    if isinstance(field, serializers.ChoiceField):
+        choices = field.choice_strings_to_values
+        return lambda value, context: value if value == '' else choices.get(str(value), value)
+    if isinstance(field, serializers.CharField):
+        return lambda value, context: str(value)
+    if isinstance(field, serializers.DateTimeField):
+        return _datetime_converter(field)
+    if isinstance(field, serializers.ReadOnlyField):
+        return _identity
+    # Dates, datetimes, durations, decimals...: reuse the field's own formatting
+    return lambda value, context: field.to_representation(value)
+
+
+class FastSerializer:
+    """
+    Read-only serializer compiled from ``serializer``, a serializer class or
+    instance (e.g. one built with sparse ``fields``).
+
+    ``strings`` maps ``StringRelatedField(many=True)`` fields to the related
+    model attribute their ``__str__`` returns, e.g. ``{'genre_names': 'name'}``.
+    """
+
+    def __init__(self, serializer, strings=None):
+        if isinstance(serializer, type):
+            serializer = serializer()
+        self.serializer_class = type(serializer)
+        self.model = serializer.Meta.model
+        self.strings = strings or {}
+        self.paths = []      # values() paths this serializer needs
+        self.fields = []     # (output name, kind, path or relation spec, converter / child / attribute)
+        self._compile(serializer)
+
+    def _compile(self, serializer):
+        opts = self.model._meta
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            source = field.source
+
+            if isinstance(field, serializers.ListSerializer):
+                model_field = opts.get_field(source)
+                child = FastSerializer(field.child, self.strings)
+                self.fields.append((name, 'many', self._many_spec(model_field, child.paths), child))
+            elif isinstance(field, serializers.BaseSerializer):
+                child = FastSerializer(field, self.strings)
+                if 'id' not in child.paths:
+                    # Needed to tell a null foreign key from an empty row
+                    child.paths.append('id')
+                self.paths.extend(f'{source}__{path}' for path in child.paths)
+                self.fields.append((name, 'one', source, child))
+            elif isinstance(field, ManyRelatedField) and isinstance(field.child_relation, StringRelatedField):
+                if name not in self.strings:
+                    raise ImproperlyConfigured(f'{self.serializer_class.__name__}.{name} needs an entry in `strings`')
+                model_field = opts.get_field(source)
+                attribute = self.strings[name]
+                self.fields.append((name, 'flat', self._many_spec(model_field, [attribute]), (attribute, str)))
+            elif isinstance(field, ManyRelatedField) and isinstance(field.child_relation, PrimaryKeyRelatedField):
+                model_field = opts.get_field(source)
+                pk = model_field.related_model._meta.pk.name
+                self.fields.append((name, 'flat', self._many_spec(model_field, [pk]), (pk, lambda value: value)))
+            elif isinstance(field, PrimaryKeyRelatedField):
+                # values() returns the related primary key for a relation name
+                self.paths.append(source)
+                self.fields.append((name, 'scalar', source, _identity))
+            elif '.' not in source and source != '*':
+                model_field = opts.get_field(source)
+                if model_field.is_relation:
+                    raise ImproperlyConfigured(f'{self.serializer_class.__name__}.{name}: relation without serializer')
+                self.paths.append(source)
+                self.fields.append((name, 'scalar', source, _scalar_converter(field, model_field)))
+            else:
+                raise ImproperlyConfigured(
+                    f'{self.serializer_class.__name__}.{name} ({type(field).__name__}) has no fast path'
+                )
+
+        if any(kind in ('many', 'flat') for _, kind, _, _ in self.fields) and 'id' not in self.paths:
+            self.paths.append('id')
+
+    def _many_spec(self, model_field, related_paths):
+        if not isinstance(model_field, models.ManyToManyField):
+            raise ImproperlyConfigured(f'{model_field} is not a many-to-many field')
+        owner = model_field.m2m_field_name()
+        related = model_field.m2m_reverse_field_name()
+        return {
+            'through': model_field.remote_field.through,
+            'owner': f'{owner}_id',
+            'related': related,
+            'paths': [f'{related}__{path}' for path in related_paths],
+        }
+
+    # Loading
+
+    def values(self, queryset, *extra):
+        """``queryset.values()`` with the columns this serializer needs (plus ``extra``)"""
+        return queryset.prefetch_related(None).values(*dict.fromkeys([*self.paths, *extra]))
+
+    def _many_queryset(self, spec, owner_ids):
+        return (
+            spec['through'].objects
+            .filter(**{f"{spec['owner']}__in": owner_ids})
+            .order_by(spec['owner'], f"{spec['related']}_id")
+            .values(spec['owner'], *spec['paths'])
+        )
+
+    def _group_many(self, spec, owner_ids, rows):
+        grouped = {owner_id: [] for owner_id in owner_ids}
+        prefix = len(spec['related']) + 2
+        for row in rows:
+            grouped[row.pop(spec['owner'])].append({path[prefix:]: value for path, value in row.items()})
+        return grouped
+
+    def _load_many(self, spec, owner_ids):
+        return self._group_many(spec, owner_ids, self._many_queryset(spec, owner_ids))
+
+    def _prefetch(self, rows, prefix=''):
+        """Load every many-to-many relation (including nested ones) for ``rows``"""
+        loaded = {}
+        for name, kind, spec, child in self.fields:
+            if kind in ('many', 'flat'):
+                ids = [row[f'{prefix}id'] for row in rows if row[f'{prefix}id'] is not None]
+                related = self._load_many(spec, ids)
+                if kind == 'many':
+                    loaded[(prefix, name)] = (related, child._prefetch(
+                        [r for group in related.values() for r in group]
+                    ))
+                else:
+                    loaded[(prefix, name)] = (related, None)
+            elif kind == 'one':
+                loaded.update(child._prefetch(rows, f'{prefix}{spec}__'))
+        return loaded
+
+    async def _aload(self, key, kind, spec, child, owner_ids):
+        rows = [row async for row in self._many_queryset(spec, owner_ids)]
+        related = self._group_many(spec, owner_ids, rows)
+        if kind == 'many':
+            return {key: (related, await child._aprefetch([r for group in related.values() for r in group]))}
+        return {key: (related, None)}
+
+    async def _aprefetch(self, rows, prefix=''):
+        """``_prefetch`` with the async ORM; the relations are independent, so they load concurrently"""
+        loads = []
+        for name, kind, spec, child in self.fields:
+            if kind in ('many', 'flat'):
+                ids = [row[f'{prefix}id'] for row in rows if row[f'{prefix}id'] is not None]
+                loads.append(self._aload((prefix, name), kind, spec, child, ids))
+            elif kind == 'one':
+                loads.append(child._aprefetch(rows, f'{prefix}{spec}__'))
+        loaded = {}
+        for result in await asyncio.gather(*loads):
+            loaded.update(result)
+        return loaded
+
+    # Serializing
+
+    def _prepare_context(self, context):
+        context = dict(context or {})
+        # Resolved once per call instead of once per value
+        context['_timezone'] = timezone.get_current_timezone()
+        request = context.get('request')
+        if request is not None:
+            context['_base_url'] = request.build_absolute_uri('/')[:-1]
+        return context
+
+    def serialize(self, rows, context=None):
+        """Serialize ``values()`` rows; returns a list of dicts"""
+        with timed('serializer'):
+            rows = list(rows)
+            context = self._prepare_context(context)
+            loaded = self._prefetch(rows)
+            return [self._to_representation(row, context, loaded) for row in rows]
+
+    async def aserialize(self, rows, context=None):
+        """``serialize()`` for async views; ``rows`` is a list"""
+        with timed('serializer'):
+            context = self._prepare_context(context)
+            loaded = await self._aprefetch(rows)
+            return [self._to_representation(row, context, loaded) for row in rows]
+
+    def _to_representation(self, row, context, loaded, prefix=''):
+        ret = {}
+        for name, kind, spec, converter in self.fields:
+            if kind == 'scalar':
+                value = row[prefix + spec]
+                ret[name] = None if value is None else converter(value, context)
+            elif kind == 'one':
+                nested = f'{prefix}{spec}__'
+                if row.get(f'{nested}id', True) is None:
+                    ret[name] = None
+                else:
+                    ret[name] = converter._to_representation(row, context, loaded, nested)
+            elif kind == 'many':
+                related, child_loaded = loaded[(prefix, name)]
+                ret[name] = [
+                    converter._to_representation(item, context, child_loaded)
+                    for item in related[row[f'{prefix}id']]
+                ]
+            else:
+                related, _ = loaded[(prefix, name)]
+                attribute, convert = converter
+                ret[name] = [convert(item[attribute]) for item in related[row[f'{prefix}id']]]
+        return ret
+
+
+genre_fast = FastSerializer(GenreSerializer)
+movie_fast = FastSerializer(MovieSerializer)
+movie_list_fast = FastSerializer(MovieListSerializer, strings={'genre_names': 'name'})
+watchlist_fast = FastSerializer(WatchlistSerializer)
+watch_progress_fast = FastSerializer(WatchProgressSerializer)
@@ -0,0 +1,176 @@
+"""
+Home feed: every catalog row the landing page needs in one response.
+
+The shared rows (featured, trending and one row per home language) are the
+same for every user. They are built with a single windowed query plus one
+genre query and cached as a whole. Per request only the small per-user rows
+(the watchlist and the rows materialised by ``materialize_feeds``) are loaded
+and merged in.
+
+Movies appear once in ``movies`` however many rows reference them; rows only
+carry ids.
+
+Latency target: p95 under 25 ms of server time per request with the shared
+rows cached (``manage.py benchmark --suite home_feed`` measures it).
+"""
+import logging
+
+from django.core.cache import cache
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+
+from .catalog_version import get_version
+from .models import Movie, Watchlist
+from .personalization import get_personal_rows
+
+logger = logging.getLogger(__name__)
+
+HOME_LANGUAGES = ['English', 'Hindi', 'Tamil', 'Telugu', 'Malayalam']
+ROW_SIZE = 20
+
+# Keyed by catalog version, so any catalog change is picked up immediately
+SHARED_ROWS_CACHE_KEY = 'home_feed:shared:{}'
+SHARED_ROWS_TIMEOUT = 60 * 60
+
+# Same fields as MovieListSerializer
+CARD_FIELDS = ('id', 'title', 'thumbnail', 'language', 'rating', 'certification', 'is_featured', 'is_trending')
+
+
+def movie_cards(queryset):
+    """
+    Return ``{id: card}`` for the movies of a ``values(*CARD_FIELDS)``
+    queryset, with genre names loaded in one extra query.
+    """
+    cards = {}
+    for row in queryset:
+        cards[row['id']] = {
+            'id': row['id'],
+            'title': row['title'],
+            'thumbnail': row['thumbnail'],
+            'language': row['language'],
+            'genre_names': [],
+            'rating': row['rating'],
+            'certification': row['certification'],
+            'is_featured': row['is_featured'],
+            'is_trending': row['is_trending'],
+        }
+    if cards:
+        genres = (
+            Movie.genre.through.objects
+            .filter(movie_id__in=list(cards))
+            .order_by('genre_id')
+            .values_list('movie_id', 'genre__name')
+        )
+        for movie_id, name in genres:
+            cards[movie_id]['genre_names'].append(name)
+    return cards
+
+
+def build_shared_rows():
+    """Featured, trending and per-language rows in one query plan"""
+    newest = [F('created_at').desc(), F('id').desc()]
+    ranked = (
+        Movie.objects
+        .filter(Q(is_featured=True) | Q(is_trending=True) | Q(language__in=HOME_LANGUAGES))
+        .annotate(
+            featured_rank=Window(RowNumber(), partition_by=[F('is_featured')], order_by=newest),
+            trending_rank=Window(RowNumber(), partition_by=[F('is_trending')], order_by=newest),
+            language_rank=Window(RowNumber(), partition_by=[F('language')], order_by=newest),
+        )
+        .filter(
+            Q(is_featured=True, featured_rank__lte=ROW_SIZE) |
+            Q(is_trending=True, trending_rank__lte=ROW_SIZE) |
+            Q(language__in=HOME_LANGUAGES, language_rank__lte=ROW_SIZE)
+        )
+        .values(*CARD_FIELDS, 'featured_rank', 'trending_rank', 'language_rank')
+    )
+
+    rows = {'featured': [], 'trending': []}
+    rows.update({language: [] for language in HOME_LANGUAGES})
+    movies = []
+    for movie in ranked:
+        if movie['is_featured'] and movie['featured_rank'] <= ROW_SIZE:
+            rows['featured'].append((movie['featured_rank'], movie['id']))
+        if movie['is_trending'] and movie['trending_rank'] <= ROW_SIZE:
+            rows['trending'].append((movie['trending_rank'], movie['id']))
+        if movie['language'] in rows and movie['language_rank'] <= ROW_SIZE:
+            rows[movie['language']].append((movie['language_rank'], movie['id']))
+        movies.append(movie)
+
+    return {
+        'rows': [
+            {'key': key, 'title': _row_title(key), 'movie_ids': [movie_id for _, movie_id in sorted(ids)]}
+            for key, ids in rows.items()
+        ],
+        'movies': movie_cards(movies),
+    }
+
+
+def _row_title(key):
+    if key == 'featured':
+        return 'Featured'
+    if key == 'trending':
+        return 'Trending Now'
+    return f'{key} Movies'
+
+
+def get_shared_rows():
+    key = SHARED_ROWS_CACHE_KEY.format(get_version())
+    shared = cache.get(key)
+    if shared is None:
+        shared = build_shared_rows()
+        cache.set(key, shared, SHARED_ROWS_TIMEOUT)
+    return shared
+
+
+def build_user_rows(user, known_ids):
+    """Per-user rows; only movies missing from ``known_ids`` are hydrated"""
+    watchlist_ids = list(
+        Watchlist.objects
+        .filter(user=user)
+        .order_by('-added_at')
+        .values_list('movie_id', flat=True)[:ROW_SIZE]
+    )
+    rows = [{'key': 'watchlist', 'title': 'My Watchlist', 'movie_ids': watchlist_ids}]
+    # Personalised rows are materialised offline, see personalization.py
+    for key, title, movie_ids in get_personal_rows(user):
+        rows.append({'key': key, 'title': title, 'movie_ids': movie_ids})
+
+    missing = {movie_id for row in rows for movie_id in row['movie_ids'] if movie_id not in known_ids}
+    movies = movie_cards(Movie.objects.filter(id__in=missing).values(*CARD_FIELDS)) if missing else {}
+
+    # Drop ids of movies deleted since the rows were materialised
+    for row in rows:
+        row['movie_ids'] = [movie_id for movie_id in row['movie_ids'] if movie_id in known_ids or movie_id in movies]
+    return rows, movies
+
+
+def build_home_feed(request):
+    """The complete home feed for ``request.user``"""
+    shared = get_shared_rows()
+    user_rows, user_movies = build_user_rows(request.user, shared['movies'])
+
+    movies = {}
+    for source in (shared['movies'], user_movies):
+        for movie_id, card in source.items():
+            movies[movie_id] = _render_card(card, request)
+
+    rows = user_rows + shared['rows']
+    return {
+        'rows': [row for row in rows if row['movie_ids']],
+        'movies': movies,
+    }
+
+
+def _render_card(card, request):
+    # Same URL MovieListSerializer's ImageField would produce
+    card = dict(card)
+    if card['thumbnail']:
+        card['thumbnail'] = request.build_absolute_uri(_thumbnail_storage().url(card['thumbnail']))
+    else:
+        card['thumbnail'] = None
+    return card
+
+
+def _thumbnail_storage():
+    return Movie._meta.get_field('thumbnail').storage
@@ -0,0 +1,355 @@
+"""
+Bulk catalog ingestion from a content partner's manifest.
+
+A manifest lists one movie per row, as CSV (genres separated by ``|``), JSON
+Lines or a JSON array, with the keys in ``MANIFEST_FIELDS``. The thumbnail and
+video are paths relative to a media directory.
+
+``validate()`` checks every row in one streaming pass, without the database
+or reading the media. ``ingest()`` then works through the rows in batches,
+each batch:
+
+* skipping the movies already in the catalog (same title and release date),
+  so a re-run, or a run resumed after an interruption, adds only what is
+  missing
+* checksumming, probing and storing the media files on a process pool; files
+  are stored under their SHA-256, so a file stored before is not copied again
+* creating the genres it names that do not exist yet, in one insert (names
+  match existing genres whatever their case)
+* inserting the movies and their genre links with ``bulk_create``, in one
+  transaction
+"""
+import csv
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.validators import URLValidator
+from django.db import connections, transaction
+from django.utils.dateparse import parse_date, parse_duration
+from PIL import Image
+
+from .catalog_version import bump, movie_scopes
+from .datasets import setup_worker
+from .models import Genre, Movie
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FIELDS = (
+    'title', 'description', 'release_date', 'language', 'genres', 'duration', 'rating', 'certification',
+    'director', 'cast', 'trailer_url', 'is_featured', 'is_trending', 'thumbnail', 'video',
+)
+REQUIRED_FIELDS = ('title', 'description', 'release_date', 'thumbnail', 'video')
+# Movie field -> the kind of file it takes
+MEDIA_FIELDS = {'thumbnail': 'image', 'video': 'video'}
+LANGUAGES = {value.lower(): value for value, _ in Movie.LANGUAGE_CHOICES}
+CERTIFICATIONS = {value.upper(): value for value, _ in Movie.RATING_CHOICES}
+BOOLEANS = {'1': True, 'true': True, 'yes': True, '0': False, 'false': False, 'no': False, '': False}
+HASH_CHUNK = 1024 * 1024
+
+
+def read_manifest(path):
+    """``(line, row)`` for every row; CSV and JSON Lines are streamed, a JSON array is loaded whole"""
+    if path.endswith('.csv'):
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+    elif path.endswith(('.jsonl', '.ndjson')):
+        with open(path, encoding='utf-8') as f:
+            for line, text in enumerate(f, start=1):
+                if not text.strip():
+                    continue
+                try:
+                    yield line, json.loads(text)
+                except json.JSONDecodeError:
+                    yield line, None
+    elif path.endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            rows = json.load(f)
+        if not isinstance(rows, list):
+            raise ValueError(f'{path}: expected a JSON array of movies')
+        yield from enumerate(rows, start=1)
+    else:
+        raise ValueError(f'{path}: expected a .csv, .jsonl or .json manifest')
+
+
+def _text(row, name, errors, max_length=None):
+    value = row.get(name)
+    value = '' if value is None else str(value).strip()
+    if max_length and len(value) > max_length:
+        errors.append(f'{name} is longer than {max_length} characters')
+    return value
+
+
+def _media_path(media_dir, name, field, errors):
+    path = os.path.realpath(os.path.join(media_dir, name))
+    if not path.startswith(os.path.realpath(media_dir) + os.sep):
+        errors.append(f'{field}: {name} is outside the media directory')
+    elif not os.path.isfile(path):
+        errors.append(f'{field}: {name} not found')
+    elif not (mimetypes.guess_type(path)[0] or '').startswith(MEDIA_FIELDS[field] + '/'):
+        errors.append(f'{field}: {name} is not a {MEDIA_FIELDS[field]} file')
+    return path
+
+
+def clean_row(row, media_dir):
+    """The Movie fields of a manifest row (``genres`` as a list of names), and what is wrong with it"""
+    if not isinstance(row, dict):
+        return None, ['not a JSON object']
+    errors = [f'unknown field {name!r}' for name in row if name not in MANIFEST_FIELDS]
+    movie = {
+        'title': _text(row, 'title', errors, 255),
+        'description': _text(row, 'description', errors),
+        'director': _text(row, 'director', errors, 255),
+        'cast': _text(row, 'cast', errors),
+        'trailer_url': _text(row, 'trailer_url', errors, 200),
+    }
+    for name in REQUIRED_FIELDS:
+        if not _text(row, name, errors):
+            errors.append(f'{name} is required')
+
+    release_date = _text(row, 'release_date', errors)
+    try:
+        movie['release_date'] = parse_date(release_date)
+    except ValueError:
+        movie['release_date'] = None
+    if release_date and movie['release_date'] is None:
+        errors.append(f'release_date {release_date!r} is not a YYYY-MM-DD date')
+
+    language = _text(row, 'language', errors) or 'English'
+    movie['language'] = LANGUAGES.get(language.lower())
+    if movie['language'] is None:
+        errors.append(f'unknown language {language!r}')
+    certification = _text(row, 'certification', errors) or 'U'
+    movie['certification'] = CERTIFICATIONS.get(certification.upper())
+    if movie['certification'] is None:
+        errors.append(f'unknown certification {certification!r}')
+
+    genres = row.get('genres') or []
+    if isinstance(genres, str):
+        genres = genres.split('|')
+    names = {}
+    for name in (str(name).strip() for name in genres):
+        if len(name) > 100:
+            errors.append(f'genre {name[:20]!r}... is longer than 100 characters')
+        elif name:
+            names.setdefault(name.lower(), name)
+    movie['genres'] = list(names.values())
+
+    # Minutes, or [DD ][HH:[MM:]]ss
+    duration = _text(row, 'duration', errors)
+    movie['duration'] = timedelta(minutes=int(duration)) if duration.isdigit() else parse_duration(duration)
+    if duration and movie['duration'] is None:
+        errors.append(f'duration {duration!r} is neither minutes nor HH:MM:SS')
+
+    rating = _text(row, 'rating', errors) or '0'
+    try:
+        movie['rating'] = float(rating)
+    except ValueError:
+        movie['rating'] = None
+    if movie['rating'] is None or not 0 <= movie['rating'] <= 10:
+        errors.append(f'rating {rating!r} is not a number from 0 to 10')
+
+    for name in ('is_featured', 'is_trending'):
+        value = _text(row, name, errors).lower()
+        movie[name] = BOOLEANS.get(value)
+        if movie[name] is None:
+            errors.append(f'{name} {value!r} is not true or false')
+
+    if movie['trailer_url']:
+        try:
+            URLValidator()(movie['trailer_url'])
+        except ValidationError:
+            errors.append(f'trailer_url {movie["trailer_url"]!r} is not a URL')
+    for field in MEDIA_FIELDS:
+        name = _text(row, field, errors)
+        if name:
+            movie[field] = _media_path(media_dir, name, field, errors)
+    return movie, errors
+
+
+def validate(path, media_dir):
+    """``(valid rows, [(line, problem)])`` for the whole manifest"""
+    valid, problems, keys = 0, [], set()
+    for line, row in read_manifest(path):
+        movie, errors = clean_row(row, media_dir)
+        if not errors:
+            key = (movie['title'], movie['release_date'])
+            if key in keys:
+                errors = ['the same title and release date as an earlier row']
+            keys.add(key)
+        problems.extend((line, error) for error in errors)
+        valid += not errors
+    return valid, problems
+
+
+def _probe_duration(path, ffprobe):
+    result = subprocess.run(
+        [ffprobe, '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=nw=1:nk=1', path],
+        capture_output=True, text=True, check=True, timeout=60,
+    )
+    return timedelta(seconds=float(result.stdout.strip()))
+
+
+def process_media(field, path, ffprobe=None):
+    """
+    Checksum, probe and store one media file for ``Movie.<field>``; returns
+    its stored name and, for a video probed with ``ffprobe``, its duration.
+    Raises if the file is not a readable image or video.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+
+    duration = None
+    if MEDIA_FIELDS[field] == 'image':
+        with Image.open(path) as image:
+            image.verify()
+    elif ffprobe:
+        duration = _probe_duration(path, ffprobe)
+
+    model_field = Movie._meta.get_field(field)
+    name = f'{model_field.upload_to}{digest.hexdigest()}{os.path.splitext(path)[1].lower()}'
+    if not model_field.storage.exists(name):
+        with open(path, 'rb') as f:
+            name = model_field.storage.save(name, File(f))
+    return name, duration
+
+
+def _process_all(pool, jobs, ffprobe):
+    """``{(field, path): (name, duration) or the exception}``"""
+    if pool is None:
+        results = {}
+        for job in jobs:
+            try:
+                results[job] = process_media(*job, ffprobe)
+            except Exception as e:
+                results[job] = e
+        return results
+    # Workers may be forked here, and must not share the parent's database connections
+    connections.close_all()
+    futures = {job: pool.submit(process_media, *job, ffprobe) for job in jobs}
+    return {job: future.exception() or future.result() for job, future in futures.items()}
+
+
+def _resolve_genres(names, genre_ids):
+    """Add the ids of ``names`` to ``genre_ids`` (lowercase name -> id), creating missing genres"""
+    missing = {name.lower(): name for name in names if name.lower() not in genre_ids}
+    if not missing:
+        return False
+    Genre.objects.bulk_create([Genre(name=name) for name in missing.values()], ignore_conflicts=True)
+    genre_ids.update(
+        (name.lower(), pk) for name, pk in Genre.objects.filter(name__in=missing.values()).values_list('name', 'id')
+    )
+    return True
+
+
+class Ingestion:
+    """One run of ``ingest()``: its counts, media problems and the catalog scopes it changed"""
+
+    def __init__(self, pool, ffprobe):
+        self.pool = pool
+        self.ffprobe = ffprobe
+        self.counts = {'created': 0, 'existing': 0, 'invalid': 0, 'failed': 0}
+        self.problems = []
+        self.scopes = set()
+        self.genre_ids = {name.lower(): pk for name, pk in Genre.objects.values_list('name', 'id')}
+
+    def batch(self, rows):
+        existing = set(
+            Movie.objects.filter(title__in={movie['title'] for _, movie in rows}).values_list('title', 'release_date')
+        )
+        new = []
+        for line, movie in rows:
+            key = (movie['title'], movie['release_date'])
+            if key in existing:
+                self.counts['existing'] += 1
+            else:
+                existing.add(key)
+                new.append((line, movie))
+
+        media = _process_all(self.pool, {(field, movie[field]) for _, movie in new for field in MEDIA_FIELDS}, self.ffprobe)
+        movies, genres = [], []
+        for line, movie in new:
+            results = {field: media[field, movie[field]] for field in MEDIA_FIELDS}
+            failed = [(line, f'{field}: {result}') for field, result in results.items() if isinstance(result, Exception)]
+            if failed:
+                self.problems.extend(failed)
+                self.counts['failed'] += 1
+                continue
+            fields = {name: value for name, value in movie.items() if name != 'genres'}
+            fields.update((field, name) for field, (name, _) in results.items())
+            fields['duration'] = fields['duration'] or results['video'][1]
+            movies.append(Movie(**fields))
+            genres.append(movie['genres'])
+        if not movies:
+            return
+
+        if _resolve_genres({name for names in genres for name in names}, self.genre_ids):
+            self.scopes.add('genres')
+        Through = Movie.genre.through
+        with transaction.atomic():
+            Movie.objects.bulk_create(movies)
+            if movies[0].pk is None:
+                # MySQL does not return the ids of a bulk insert
+                ids = {
+                    (title, release_date): pk for title, release_date, pk in Movie.objects.filter(
+                        title__in={movie.title for movie in movies}
+                    ).values_list('title', 'release_date', 'id')
+                }
+                for movie in movies:
+                    movie.pk = ids[movie.title, movie.release_date]
+            Through.objects.bulk_create([
+                Through(movie_id=movie.pk, genre_id=self.genre_ids[name.lower()])
+                for movie, names in zip(movies, genres) for name in names
+            ])
+        self.counts['created'] += len(movies)
+        for movie in movies:
+            self.scopes.update(movie_scopes(movie.language, movie.is_featured, movie.is_trending))
+
+
+def ingest(path, media_dir, batch_size=500, workers=1, progress=None):
+    """
+    Ingest the valid rows of the manifest, skipping invalid ones (see
+    ``validate()``); returns ``(counts, [(line, media problem)])``, where
+    counts has the rows created, already in the catalog, invalid, and whose
+    media failed. ``progress(counts)`` is called after every batch.
+    """
+    ffprobe = shutil.which(settings.FFPROBE_PATH)
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=setup_worker) if workers > 1 else None
+
+    with pool or nullcontext():
+        run = Ingestion(pool, ffprobe)
+        rows = []
+        for line, row in read_manifest(path):
+            movie, errors = clean_row(row, media_dir)
+            if errors:
+                run.counts['invalid'] += 1
+                continue
+            rows.append((line, movie))
+            if len(rows) == batch_size:
+                run.batch(rows)
+                rows = []
+                if progress:
+                    progress(run.counts)
+        if rows:
+            run.batch(rows)
+            if progress:
+                progress(run.counts)
+
+    if run.scopes:
+        bump(*run.scopes)
+    logger.info("Ingested %s: %s", path, run.counts)
+    return run.counts, run.problems
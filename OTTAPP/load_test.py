@@ -0,0 +1,266 @@
+"""
+Load test of the main user journeys against a running server.
+
+Every virtual user signs in through the sign-in form, like a browser, and
+then runs a fixed number of journeys picked at random with ``JOURNEYS``
+weights: browsing the movie list, searching, opening a movie, watching it
+(range requests with seeks, and resume heartbeats), rating it and managing
+the watchlist. Each user draws from its own ``random.Random(seed + n)``, so
+a run with the same options sends the same requests in the same order per
+user.
+
+Requests are reported per endpoint (``/api/movies/<id>/`` is one endpoint
+whatever the id) with their throughput, p50/p95/p99 latency and error rate.
+``compare()`` checks a report against a saved baseline, which is only
+meaningful on the same database engine and machine (``environment_changes()``).
+
+Only the standard library is used, so it runs wherever the project does.
+"""
+import http.cookiejar
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+STREAM_CHUNK = 1024 * 1024
+
+# Journey name -> relative weight
+JOURNEYS = {
+    'browse': 30,
+    'search': 20,
+    'detail': 20,
+    'watch': 15,
+    'watchlist': 10,
+    'rate': 5,
+}
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Stats:
+    """Latencies and errors per endpoint, shared by the virtual users"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, endpoint, ms, ok):
+        with self.lock:
+            self.samples[endpoint].append(ms)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def report(self, elapsed):
+        """``{endpoint: {requests, errors, error_rate, rps, p50_ms, p95_ms, p99_ms}}``, plus ``total``"""
+        def summarize(samples, errors):
+            return {
+                'requests': len(samples),
+                'errors': errors,
+                'error_rate': round(errors / len(samples), 4),
+                'rps': round(len(samples) / elapsed, 2),
+                'p50_ms': round(percentile(samples, 50), 2),
+                'p95_ms': round(percentile(samples, 95), 2),
+                'p99_ms': round(percentile(samples, 99), 2),
+            }
+
+        report = {
+            endpoint: summarize(samples, self.errors[endpoint])
+            for endpoint, samples in sorted(self.samples.items())
+        }
+        everything = [ms for samples in self.samples.values() for ms in samples]
+        if everything:
+            report['total'] = summarize(everything, sum(self.errors.values()))
+        return report
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Report redirects (e.g. after signing in) instead of following them"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class VirtualUser:
+    """One signed-in browser session running journeys against ``base_url``"""
+
+    def __init__(self, base_url, username, password, workload, stats, rng, think_time=0):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.workload = workload
+        self.stats = stats
+        self.rng = rng
+        self.think_time = think_time
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies), _NoRedirect()
+        )
+
+    def cookie(self, name):
+        return next((cookie.value for cookie in self.cookies if cookie.name == name), '')
+
+    def request(self, endpoint, path, method='GET', data=None, json_body=None, headers=None, expect=(200,)):
+        """Send one request and record it; returns ``(status, body)``, status 0 on a network error"""
+        headers = dict(headers or {})
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            body = urllib.parse.urlencode(data).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if method not in ('GET', 'HEAD'):
+            headers['X-CSRFToken'] = self.cookie('csrftoken')
+            headers['Referer'] = self.base_url + '/'
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+
+        started = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                status, content = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, content = e.code, e.read()
+        except (urllib.error.URLError, OSError):
+            status, content = 0, b''
+        self.stats.add(endpoint, (time.perf_counter() - started) * 1000, status in expect)
+        return status, content
+
+    def sign_in(self):
+        self.request('signin_page', '/')
+        status, _ = self.request(
+            'signin', '/', method='POST', expect=(302,),
+            data={'username': self.username, 'password': self.password,
+                  'csrfmiddlewaretoken': self.cookie('csrftoken')},
+        )
+        return status == 302
+
+    def run(self, iterations):
+        if not self.sign_in():
+            return
+        names, weights = zip(*JOURNEYS.items())
+        for _ in range(iterations):
+            getattr(self, f'journey_{self.rng.choices(names, weights)[0]}')()
+            if self.think_time:
+                time.sleep(self.think_time)
+
+    # Journeys
+
+    def journey_browse(self):
+        params = {'page': self.rng.randint(1, 3)}
+        if self.rng.random() < 0.5:
+            params['language'] = self.rng.choice(self.workload['languages'])
+        self.request('movie_list', '/movie_list/?' + urllib.parse.urlencode(params))
+
+    def journey_search(self):
+        term = self.rng.choice(self.workload['search_terms'])
+        self.request('search', '/api/movies/search/?' + urllib.parse.urlencode({'q': term}))
+
+    def journey_detail(self):
+        movie_id = self.rng.choice(self.workload['movie_ids'])
+        self.request('movie_detail', f'/api/movies/{movie_id}/')
+        self.request('progress', f'/api/movies/{movie_id}/progress/')
+
+    def journey_watch(self):
+        if not self.workload['streams']:
+            return
+        movie_id, size = self.rng.choice(self.workload['streams'])
+        # Play from the start, then seek around
+        offsets = [0] + sorted(self.rng.randrange(size) for _ in range(3))
+        position = 0
+        for offset in offsets:
+            last = min(offset + STREAM_CHUNK, size) - 1
+            self.request(
+                'stream', f'/stream/{movie_id}/', headers={'Range': f'bytes={offset}-{last}'}, expect=(206,)
+            )
+            position += 10
+            self.request(
+                'progress_heartbeat', f'/api/movies/{movie_id}/progress/', method='POST',
+                json_body={'position': position}, expect=(204,),
+            )
+
+    def journey_rate(self):
+        movie_id = self.rng.choice(self.workload['movie_ids'])
+        self.request(
+            'rate', f'/api/movies/{movie_id}/rate/', method='POST',
+            json_body={'rating': self.rng.randint(1, 10)},
+        )
+
+    def journey_watchlist(self):
+        movie_id = self.rng.choice(self.workload['movie_ids'])
+        self.request('watchlist_add', f'/api/movies/{movie_id}/add_to_watchlist/', method='POST', expect=(200, 201))
+        self.request('watchlist', '/api/users/watchlist/')
+        self.request(
+            'watchlist_remove', f'/api/movies/{movie_id}/remove_from_watchlist/', method='DELETE', expect=(200,)
+        )
+
+
+def run(base_url, credentials, workload, iterations, seed=1, think_time=0):
+    """
+    Run ``iterations`` journeys for each ``(username, password)`` in
+    ``credentials`` concurrently; returns ``(report, elapsed seconds)``.
+
+    ``workload`` has ``movie_ids``, ``search_terms``, ``languages`` and
+    ``streams`` (``(movie_id, file size)`` of movies with a video file).
+    """
+    stats = Stats()
+    users = [
+        VirtualUser(base_url, username, password, workload, stats, random.Random(seed + n), think_time)
+        for n, (username, password) in enumerate(credentials)
+    ]
+    threads = [threading.Thread(target=user.run, args=(iterations,)) for user in users]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return stats.report(elapsed), elapsed
+
+
+# Percentile -> (requests needed before it is compared, multiple of the tolerance
+# allowed); tails are noisier than the body of the distribution
+PERCENTILE_CHECKS = {'p95_ms': (20, 1), 'p99_ms': (100, 2)}
+# Report meta that must match the baseline's for latencies to be comparable
+ENVIRONMENT_KEYS = ('database', 'machine')
+
+
+def environment_changes(meta, baseline_meta):
+    """Messages for the ``ENVIRONMENT_KEYS`` where ``meta`` differs from ``baseline_meta``"""
+    return [
+        f'{key}: {meta.get(key)}, baseline {baseline_meta.get(key)}'
+        for key in ENVIRONMENT_KEYS if meta.get(key) != baseline_meta.get(key)
+    ]
+
+
+def compare(report, baseline, tolerance=0.25, max_error_increase=0.01):
+    """
+    Regressions of ``report`` against ``baseline`` (both ``Stats.report()``
+    shapes), as messages: throughput or p95 latency worse by more than
+    ``tolerance`` (p99: twice that), a higher error rate, or an endpoint that
+    stopped being hit.
+    """
+    regressions = []
+    for endpoint, expected in baseline.items():
+        found = report.get(endpoint)
+        if found is None:
+            regressions.append(f'{endpoint}: no requests (baseline had {expected["requests"]})')
+            continue
+        for key, (min_samples, factor) in PERCENTILE_CHECKS.items():
+            if min(found['requests'], expected['requests']) < min_samples:
+                continue
+            if found[key] > expected[key] * (1 + tolerance * factor):
+                regressions.append(f'{endpoint}: {key} {found[key]} ms, baseline {expected[key]} ms')
+        if found['rps'] < expected['rps'] * (1 - tolerance):
+            regressions.append(f'{endpoint}: {found["rps"]} req/s, baseline {expected["rps"]} req/s')
+        if found['error_rate'] > expected['error_rate'] + max_error_increase:
+            regressions.append(f'{endpoint}: error rate {found["error_rate"]:.2%}, baseline {expected["error_rate"]:.2%}')
+    return regressions
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from OTTAPP.query_audit import FILESORT, KNOWN_SCANS, audit, index_name
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the hot queries behind the views and flag full scans and filesorts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plans', action='store_true', help='Print the plan of every query')
+        parser.add_argument('--fail', action='store_true', help='Exit with an error if any query is flagged')
+
+    def handle(self, *args, **options):
+        try:
+            report = audit()
+        except NotImplementedError as e:
+            raise CommandError(str(e))
+
+        flagged = 0
+        for name, queryset, findings, index in report:
+            if not findings and name in KNOWN_SCANS:
+                self.stdout.write(f'KNOWN    {name}: full scan, {KNOWN_SCANS[name]}')
+            elif not findings:
+                self.stdout.write(f'OK       {name}')
+            else:
+                flagged += 1
+                problems = ', '.join(
+                    'filesort' if kind == FILESORT else f'{kind} of {table}'
+                    for kind, table in dict.fromkeys(findings)
+                )
+                self.stdout.write(self.style.WARNING(f'FLAGGED  {name}: {problems}'))
+                if index:
+                    model = queryset.model
+                    self.stdout.write(
+                        f"         proposed index on {model.__name__}: "
+                        f"models.Index(fields={index!r}, name='{index_name(model, index)}')"
+                    )
+            if options['plans'] or findings:
+                self.stdout.write(f'         SQL: {queryset.query}')
+                for line in queryset.explain().splitlines():
+                    self.stdout.write(f'         | {line}')
+
+        if flagged and options['fail']:
+            raise CommandError(f'{flagged} of {len(report)} hot queries scan or sort')
+        self.stdout.write(self.style.SUCCESS(f'Audited {len(report)} hot queries, {flagged} flagged'))
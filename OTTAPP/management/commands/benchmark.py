@@ -0,0 +1,252 @@
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from OTTAPP import feeds, views
+from OTTAPP.catalog_version import get_version
+from OTTAPP.fast_serializers import movie_fast, movie_list_fast
+from OTTAPP.load_test import percentile
+from OTTAPP.models import Movie
+from OTTAPP.renderers import CBORRenderer, FastJSONRenderer, MessagePackRenderer
+from OTTAPP.serializers import MovieDetailSerializer, MovieListSerializer, MovieSerializer
+from OTTAPP.views import MovieViewSet, UserViewSet, home_feed
+
+
+class Command(BaseCommand):
+    help = 'Run in-process performance benchmarks against the current database'
+
+    suites = ['home_feed', 'serializers', 'formats', 'async']
+
+    def add_arguments(self, parser):
+        parser.add_argument('--suite', choices=self.suites, action='append', help='Suite to run (default: all)')
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--username', help='User to run authenticated requests as (default: first user)')
+        parser.add_argument(
+            '--concurrency', type=int, default=50, help='async suite: clients sending requests at the same time'
+        )
+        parser.add_argument('--workers', type=int, default=8, help='async suite: sync worker threads')
+        parser.add_argument(
+            '--client-delay', type=float, default=0,
+            help='async suite: ms each client takes to read a response, which holds a sync worker'
+        )
+
+    def handle(self, *args, **options):
+        self.iterations = options['iterations']
+        self.concurrency = options['concurrency']
+        self.workers = options['workers']
+        self.client_delay = options['client_delay'] / 1000
+        self.user = self._get_user(options['username'])
+        self.factory = APIRequestFactory()
+        host = next((h for h in settings.ALLOWED_HOSTS if h and h != '*' and not h.startswith('.')), 'localhost')
+        self.request_kwargs = {'HTTP_HOST': host}
+
+        for suite in options['suite'] or self.suites:
+            self.stdout.write(self.style.MIGRATE_HEADING(f'== {suite} =='))
+            getattr(self, f'bench_{suite}')()
+
+    def _get_user(self, username):
+        users = User.objects.order_by('id')
+        user = users.filter(username=username).first() if username else users.first()
+        if user is None:
+            raise CommandError('No user to benchmark with; create one or run create_sample_data first')
+        return user
+
+    def _get(self, view, path, **params):
+        request = self.factory.get(path, params, **self.request_kwargs)
+        force_authenticate(request, user=self.user)
+        response = view(request)
+        response.render()
+        return response
+
+    def _get_page(self, view, path):
+        request = self.factory.get(path, **self.request_kwargs)
+        request.user = self.user
+        return view(request)
+
+    def measure(self, label, func, setup=None, target_ms=None):
+        """Time ``func`` and report p50/p95/max latency and the query count"""
+        samples = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(self.iterations):
+                if setup:
+                    setup()
+                started = time.perf_counter()
+                func()
+                samples.append((time.perf_counter() - started) * 1000)
+        p95 = percentile(samples, 95)
+        line = (
+            f'{label:<40} p50 {statistics.median(samples):8.2f} ms   p95 {p95:8.2f} ms   '
+            f'max {max(samples):8.2f} ms   {len(queries) / self.iterations:6.1f} queries'
+        )
+        if target_ms is not None:
+            verdict = self.style.SUCCESS('OK') if p95 <= target_ms else self.style.ERROR('OVER')
+            line += f'   target {target_ms} ms {verdict}'
+        self.stdout.write(line)
+        return samples
+
+    def bench_home_feed(self):
+        featured = MovieViewSet.as_view({'get': 'featured'})
+        trending = MovieViewSet.as_view({'get': 'trending'})
+        watchlist = UserViewSet.as_view({'get': 'watchlist'})
+
+        def separate_calls():
+            self._get(featured, '/api/movies/featured/')
+            self._get(trending, '/api/movies/trending/')
+            for language in feeds.HOME_LANGUAGES:
+                self._get_page(getattr(views, f'movie_{language.lower()}'), f'/movie_{language.lower()}/')
+            self._get(watchlist, '/api/users/watchlist/')
+
+        def one_call():
+            self._get(home_feed, '/api/home/')
+
+        def clear_shared_rows():
+            cache.delete(feeds.SHARED_ROWS_CACHE_KEY.format(get_version()))
+
+        self.measure('separate endpoint calls', separate_calls)
+        self.measure('home feed (cold shared rows)', one_call, setup=clear_shared_rows)
+        self.measure('home feed (cached shared rows)', one_call, target_ms=25)
+
+    def bench_serializers(self):
+        page_size = 1000
+        movies = Movie.objects.order_by('id')[:page_size]
+        if len(movies) < page_size:
+            self.stdout.write(self.style.WARNING(
+                f'Only {len(movies)} movies in the database; pages will be smaller than {page_size}'
+            ))
+        request = self.factory.get('/api/movies/', **self.request_kwargs)
+        context = {'request': request}
+
+        def drf(serializer_class):
+            def run():
+                queryset = Movie.objects.order_by('id').prefetch_related('genre')[:page_size]
+                JSONRenderer().render(serializer_class(queryset, many=True, context=context).data)
+            return run
+
+        def fast(serializer):
+            def run():
+                rows = serializer.values(Movie.objects.order_by('id')[:page_size])
+                FastJSONRenderer().render(serializer.serialize(rows, context))
+            return run
+
+        self.measure('MovieListSerializer + JSONRenderer', drf(MovieListSerializer))
+        self.measure('movie_list_fast + FastJSONRenderer', fast(movie_list_fast))
+        self.measure('MovieSerializer + JSONRenderer', drf(MovieSerializer))
+        self.measure('movie_fast + FastJSONRenderer', fast(movie_fast))
+
+    def bench_formats(self):
+        movie = Movie.objects.order_by('id').first()
+        if movie is None:
+            raise CommandError('No movies to benchmark with')
+        context = {'request': self.factory.get('/api/movies/', **self.request_kwargs)}
+        payloads = {
+            'list page': self._get(MovieViewSet.as_view({'get': 'list'}), '/api/movies/').data,
+            'list (1k)': movie_list_fast.serialize(movie_list_fast.values(Movie.objects.order_by('id')[:1000]), context),
+            'detail': MovieDetailSerializer(movie, context=context).data,
+            'featured': self._get(MovieViewSet.as_view({'get': 'featured'}), '/api/movies/featured/').data,
+            'trending': self._get(MovieViewSet.as_view({'get': 'trending'}), '/api/movies/trending/').data,
+            'activity': self._get(UserViewSet.as_view({'get': 'activity'}), '/api/users/activity/').data,
+        }
+        renderers = [('json', FastJSONRenderer())]
+        renderers += [
+            (renderer.format, renderer)
+            for renderer in (MessagePackRenderer(), CBORRenderer())
+            if renderer.available
+        ]
+
+        for name, data in payloads.items():
+            json_size = len(FastJSONRenderer().render(data))
+            for format_name, renderer in renderers:
+                size = len(renderer.render(data))
+                self.measure(f'{name} as {format_name}', lambda: renderer.render(data))
+                self.stdout.write(f'{"":<40} {size:>10} bytes   {size / json_size:6.1%} of JSON')
+
+    def report_load(self, label, results, elapsed):
+        """Report throughput, latency and errors of ``[(ms, status)]`` served in ``elapsed`` seconds"""
+        samples = [ms for ms, _ in results]
+        errors = sum(1 for _, status in results if status >= 400)
+        self.stdout.write(
+            f'{label:<40} {len(results) / elapsed:8.1f} req/s   p50 {statistics.median(samples):8.2f} ms   '
+            f'p95 {percentile(samples, 95):8.2f} ms   max {max(samples):8.2f} ms   {errors} errors'
+        )
+
+    def load_sync(self, path, cookies):
+        """``concurrency`` clients, each sending ``iterations`` requests to ``workers`` threads"""
+        workers = threading.BoundedSemaphore(self.workers)
+        local = threading.local()
+
+        def client_session():
+            if not hasattr(local, 'client'):
+                local.client = Client()
+                local.client.cookies = cookies
+            results = []
+            for _ in range(self.iterations):
+                started = time.perf_counter()
+                with workers:
+                    response = local.client.get(path)
+                    # A slow client keeps the worker until it has read the response
+                    time.sleep(self.client_delay)
+                results.append(((time.perf_counter() - started) * 1000, response.status_code))
+            return results
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as clients:
+            futures = [clients.submit(client_session) for _ in range(self.concurrency)]
+            return [result for future in futures for result in future.result()]
+
+    def load_async(self, path, cookies):
+        """``concurrency`` clients, each sending ``iterations`` requests to one event loop"""
+        async def run():
+            client = AsyncClient()
+            client.cookies = cookies
+
+            async def client_session():
+                results = []
+                for _ in range(self.iterations):
+                    started = time.perf_counter()
+                    response = await client.get(path)
+                    await asyncio.sleep(self.client_delay)
+                    results.append(((time.perf_counter() - started) * 1000, response.status_code))
+                return results
+
+            sessions = await asyncio.gather(*(client_session() for _ in range(self.concurrency)))
+            return [result for results in sessions for result in results]
+
+        return asyncio.run(run())
+
+    def bench_async(self):
+        movie = Movie.objects.order_by('id').first()
+        if movie is None:
+            raise CommandError('No movies to benchmark with')
+        endpoints = [
+            ('movie list', '/api/movies/'),
+            ('movie detail', f'/api/movies/{movie.pk}/'),
+            ('search', f'/api/movies/search/?q={movie.title.split()[0]}'),
+            ('featured', '/api/movies/featured/'),
+            ('trending', '/api/movies/trending/'),
+            ('statistics', '/api/statistics/'),
+        ]
+        self.stdout.write(
+            f'{self.concurrency} clients x {self.iterations} requests; sync on {self.workers} worker threads, '
+            f'async on one event loop; {self.client_delay * 1000:g} ms client delay'
+        )
+        # The test clients only send Host: testserver
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            login = Client()
+            login.force_login(self.user)
+            for label, path in endpoints:
+                async_path = path.replace('/api/', '/api/async/', 1)
+                for stack, load, url in (('sync', self.load_sync, path), ('async', self.load_async, async_path)):
+                    started = time.perf_counter()
+                    results = load(url, login.cookies)
+                    self.report_load(f'{label} ({stack})', results, time.perf_counter() - started)
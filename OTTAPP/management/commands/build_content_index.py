@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from OTTAPP.content_similarity import build_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the content-based "similar titles" index from movie metadata'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dims', type=int, default=settings.CONTENT_SIMILARITY_DIMS,
+            help='Number of hashed feature dimensions'
+        )
+        parser.add_argument(
+            '--output', default=settings.CONTENT_SIMILARITY_DIR,
+            help='Index directory'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Building content similarity index...')
+        count = build_index(directory=options['output'], dims=options['dims'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Indexed {count} movies in {options["output"]}')
+        )
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from OTTAPP.recommendations import build_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the item-to-item recommendation index ("because you watched")'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-k', type=int, default=settings.RECOMMENDATIONS_TOP_K,
+            help='Number of neighbours stored per movie'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Worker processes for the similarity blocks (default: CPU count, 0 = inline)'
+        )
+        parser.add_argument(
+            '--output', default=settings.RECOMMENDATIONS_INDEX_PATH,
+            help='Path of the index file'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Building recommendation index...')
+        count = build_index(
+            path=options['output'],
+            top_k=options['top_k'],
+            workers=options['workers'],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f'Indexed neighbours for {count} movies in {options["output"]}')
+        )
@@ -1,7 +1,8 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
+from django.utils import timezone
 from OTTAPP.models import Genre, Movie, UserProfile, Subscription
-from datetime import datetime, timedelta
+from datetime import timedelta
 import random
 
 
@@ -126,7 +127,7 @@ class Command(BaseCommand):
                     'certification': movie_data['certification'],
                     'is_featured': movie_data['is_featured'],
                     'is_trending': movie_data['is_trending'],
-                    'release_date': datetime.now().date() - timedelta(days=random.randint(30, 365)),
+                    'release_date': timezone.localdate() - timedelta(days=random.randint(30, 365)),
                     'view_count': random.randint(100, 10000)
                 }
             )
@@ -170,7 +171,7 @@ class Command(BaseCommand):
                         user=user,
                         subscription_plan=random.choice(['basic', 'standard', 'premium']),
                         status='active',
-                        end_date=datetime.now() + timedelta(days=30)
+                        end_date=timezone.now() + timedelta(days=30)
                     )
                 
                 self.stdout.write(f'Created user: {username}')
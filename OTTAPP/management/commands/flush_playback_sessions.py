@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from OTTAPP.playback import flush_sessions
+
+
+class Command(BaseCommand):
+    help = 'Finish playback sessions idle for longer than PLAYBACK_IDLE_SECONDS'
+
+    def handle(self, *args, **options):
+        flushed = flush_sessions()
+        self.stdout.write(self.style.SUCCESS(f'Finished {flushed} playback sessions'))
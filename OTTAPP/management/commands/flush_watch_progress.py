@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from OTTAPP.watch_progress import flush_progress
+
+
+class Command(BaseCommand):
+    help = 'Save the resume positions buffered in the cache'
+
+    def handle(self, *args, **options):
+        saved = flush_progress()
+        self.stdout.write(self.style.SUCCESS(f'Saved {saved} watch positions'))
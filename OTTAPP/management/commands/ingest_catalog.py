@@ -0,0 +1,60 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from OTTAPP import ingest
+
+
+class Command(BaseCommand):
+    help = (
+        'Add the movies of a CSV / JSON Lines / JSON manifest to the catalog, with their genres and '
+        'media files; movies already in the catalog are skipped, so it can be re-run'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('manifest')
+        parser.add_argument('--media-dir', help="Directory the media paths are relative to (default: the manifest's)")
+        parser.add_argument('--batch-size', type=int, default=500, help='Movies inserted per transaction')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Media processing processes')
+        parser.add_argument('--skip-invalid', action='store_true', help='Ingest the valid rows of an invalid manifest')
+        parser.add_argument('--dry-run', action='store_true', help='Only validate the manifest')
+        parser.add_argument('--max-errors', type=int, default=20, help='Problems listed')
+
+    def handle(self, *args, **options):
+        manifest = options['manifest']
+        media_dir = options['media_dir'] or os.path.dirname(os.path.abspath(manifest))
+        if not os.path.isfile(manifest):
+            raise CommandError(f'{manifest} not found')
+        if options['batch_size'] < 1 or options['workers'] < 1:
+            raise CommandError('--batch-size and --workers must be positive')
+
+        try:
+            valid, problems = ingest.validate(manifest, media_dir)
+        except ValueError as e:
+            raise CommandError(e)
+        self.print_problems(problems, options['max_errors'])
+        self.stdout.write(f'{valid} valid movies, {len({line for line, _ in problems})} invalid rows')
+        if problems and not options['skip_invalid']:
+            raise CommandError('The manifest has invalid rows; fix them or run with --skip-invalid')
+        if options['dry_run']:
+            return
+
+        counts, problems = ingest.ingest(
+            manifest, media_dir, batch_size=options['batch_size'], workers=options['workers'],
+            progress=lambda counts: self.stdout.write(
+                f'{counts["created"]} created, {counts["existing"]} already in the catalog'
+            ),
+        )
+        self.print_problems(problems, options['max_errors'])
+        if counts['failed']:
+            raise CommandError(f'{counts["failed"]} movies failed on their media; fix them and run again')
+        self.stdout.write(self.style.SUCCESS(
+            f'{counts["created"]} movies added, {counts["existing"]} already in the catalog; '
+            'run build_content_index to index them'
+        ))
+
+    def print_problems(self, problems, limit):
+        for line, problem in problems[:limit]:
+            self.stdout.write(self.style.ERROR(f'line {line}: {problem}'))
+        if len(problems) > limit:
+            self.stdout.write(self.style.ERROR(f'... and {len(problems) - limit} more'))
@@ -0,0 +1,74 @@
+import json
+import os
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+
+from OTTAPP.models import Movie
+from OTTAPP.query_inspector import inspect_requests, main_requests
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'query_baseline.json')
+
+
+class Command(BaseCommand):
+    help = (
+        'Request the main pages and API endpoints, flag N+1 (repeated query shapes) and slow queries '
+        'with the code that ran them, and compare with a baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='User to request as (default: first user)')
+        parser.add_argument('--path', action='append', dest='paths', help='Request this path instead (repeatable)')
+        parser.add_argument('--output', help='Write the ranked report to this JSON file')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Known offenders, as a report')
+        parser.add_argument('--save-baseline', action='store_true', help='Write this report as the baseline')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        user = users.filter(username=options['username']).first() if options['username'] else users.first()
+        if user is None:
+            raise CommandError('No such user; create one or pass --username')
+        movie = Movie.objects.order_by('id').first()
+        if movie is None and not options['paths']:
+            raise CommandError('No movies to request; run create_sample_data first')
+        paths = options['paths'] or main_requests(movie.pk, movie.title.split()[0])
+
+        # The test client only sends Host: testserver
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            # A view that fails is reported, not raised
+            client = Client(raise_request_exception=False)
+            client.force_login(user)
+            report, failed = inspect_requests(client, paths)
+        for path, status in failed:
+            self.stdout.write(self.style.WARNING(f'{path} answered {status}'))
+
+        ranked = report.ranked()
+        for view, offenders in ranked.items():
+            self.stdout.write(f'{view}: {sum(offender["ms"] for offender in offenders):.1f} ms')
+            for offender in offenders:
+                self.stdout.write(
+                    f'  {offender["kind"]:<9}{offender["max_count"]:>4} x  {offender["ms"]:>8.1f} ms  {offender["origin"]}'
+                )
+                self.stdout.write(f'           {offender["fingerprint"][:160]}')
+        if options['output']:
+            report.write(options['output'])
+        if options['save_baseline']:
+            report.write(options['baseline'])
+            self.stdout.write(self.style.SUCCESS(f'Saved the baseline to {options["baseline"]}'))
+            return
+
+        baseline = {}
+        if os.path.exists(options['baseline']):
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+        new = report.new_offenders(baseline)
+        if new:
+            for view, offender in new:
+                self.stdout.write(self.style.ERROR(f'New {offender["kind"]} query in {view} from {offender["origin"]}'))
+            raise CommandError(f'{len(new)} new offenders against {options["baseline"]}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Inspected {len(paths)} requests: {sum(map(len, ranked.values()))} offenders, none new'
+        ))
@@ -0,0 +1,157 @@
+import json
+import os
+import platform
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from OTTAPP import load_test
+from OTTAPP.models import Movie, Subscription
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'loadtest_baseline.json')
+USERNAME = 'loadtest_{}'
+PASSWORD = 'loadtest-password'
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the user journeys (sign in, browse, search, detail, stream with seeks, rate, watchlist) '
+        'against a running server and compare throughput, latency and errors with a baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Server to test')
+        parser.add_argument('--users', type=int, default=10, help='Concurrent virtual users')
+        parser.add_argument('--iterations', type=int, default=50, help='Journeys per user')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--think-time', type=float, default=0, help='ms between journeys')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON file')
+        parser.add_argument('--save-baseline', action='store_true', help='Write this run as the baseline')
+        parser.add_argument('--output', help='Also write the report to this JSON file')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help='Allowed relative drop in throughput or rise in p95 latency (p99: twice that) before failing'
+        )
+        parser.add_argument(
+            '--allow-other-environment', action='store_true',
+            help='Compare even if the baseline was recorded on another database engine or machine'
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['iterations'] < 1:
+            raise CommandError('--users and --iterations must be positive')
+
+        workload = self.workload()
+        credentials = self.prepare_users(options['users'])
+        self.stdout.write(
+            f'{options["users"]} users x {options["iterations"]} journeys against {options["url"]} '
+            f'({len(workload["movie_ids"])} movies, {len(workload["streams"])} with video)'
+        )
+        report, elapsed = load_test.run(
+            options['url'], credentials, workload, options['iterations'],
+            seed=options['seed'], think_time=options['think_time'] / 1000,
+        )
+        if not report:
+            raise CommandError(f'No requests completed; is the server running at {options["url"]}?')
+        self.print_report(report, elapsed)
+
+        result = {
+            'meta': {
+                'url': options['url'],
+                'users': options['users'],
+                'iterations': options['iterations'],
+                'seed': options['seed'],
+                'movies': len(workload['movie_ids']),
+                'database': settings.DATABASES['default']['ENGINE'].rsplit('.', 1)[-1],
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'machine': f'{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs',
+                'recorded_at': timezone.now().isoformat(timespec='seconds'),
+            },
+            'endpoints': report,
+        }
+        if options['output']:
+            self.write_json(options['output'], result)
+        if options['save_baseline']:
+            self.write_json(options['baseline'], result)
+            self.stdout.write(self.style.SUCCESS(f'Saved the baseline to {options["baseline"]}'))
+            return
+
+        if not os.path.exists(options['baseline']):
+            self.stdout.write(self.style.WARNING(f'No baseline at {options["baseline"]}; run with --save-baseline'))
+            return
+        with open(options['baseline']) as f:
+            baseline = json.load(f)
+        if {key: baseline['meta'][key] for key in ('users', 'iterations', 'seed')} != {
+            key: options[key] for key in ('users', 'iterations', 'seed')
+        }:
+            self.stdout.write(self.style.WARNING('The baseline was recorded with other --users/--iterations/--seed'))
+        changes = load_test.environment_changes(result['meta'], baseline['meta'])
+        if changes:
+            for change in changes:
+                self.stdout.write(self.style.WARNING(change))
+            if not options['allow_other_environment']:
+                raise CommandError(
+                    'The baseline was recorded on another database or machine; record one here with '
+                    '--save-baseline, or pass --allow-other-environment'
+                )
+        regressions = load_test.compare(report, baseline['endpoints'], options['tolerance'])
+        if regressions:
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(regression))
+            raise CommandError(f'{len(regressions)} regressions against {options["baseline"]}')
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    def workload(self):
+        """What the journeys pick from, read from the database the server uses"""
+        movies = list(Movie.objects.order_by('id').values_list('id', 'title', 'language', 'video'))
+        if not movies:
+            raise CommandError('No movies to test with; run create_sample_data first')
+        streams = []
+        storage = Movie._meta.get_field('video').storage
+        for movie_id, _, _, video in movies:
+            if video and storage.exists(video):
+                streams.append((movie_id, storage.size(video)))
+        return {
+            'movie_ids': [movie_id for movie_id, _, _, _ in movies],
+            'search_terms': sorted({title.split()[0] for _, title, _, _ in movies if title.split()}),
+            'languages': sorted({language for _, _, language, _ in movies}),
+            'streams': streams,
+        }
+
+    def prepare_users(self, count):
+        """Sign-in credentials of ``count`` test users with an active subscription, created on first use"""
+        credentials = []
+        for n in range(count):
+            user, created = User.objects.get_or_create(username=USERNAME.format(n))
+            if created:
+                user.set_password(PASSWORD)
+                user.save(update_fields=['password'])
+            Subscription.objects.update_or_create(user=user, defaults={
+                'subscription_plan': 'premium',
+                'status': 'active',
+                'end_date': timezone.now() + timedelta(days=365),
+            })
+            credentials.append((user.username, PASSWORD))
+        return credentials
+
+    def print_report(self, report, elapsed):
+        self.stdout.write(
+            f'{"endpoint":<22}{"requests":>9}{"req/s":>9}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"errors":>9}'
+        )
+        for endpoint, row in report.items():
+            line = (
+                f'{endpoint:<22}{row["requests"]:>9}{row["rps"]:>9.1f}{row["p50_ms"]:>10.1f}'
+                f'{row["p95_ms"]:>10.1f}{row["p99_ms"]:>10.1f}{row["error_rate"]:>9.1%}'
+            )
+            self.stdout.write(self.style.ERROR(line) if row['errors'] else line)
+        self.stdout.write(f'{elapsed:.1f} s')
+
+    def write_json(self, path, data):
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.write('\n')
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from OTTAPP.personalization import materialize_feeds
+
+
+class Command(BaseCommand):
+    help = 'Precompute personalised home feed rows for users with new activity and for stale rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Refresh every active user instead of only those changed since the last run'
+        )
+        parser.add_argument('--chunk-size', type=int, default=500, help='Users per chunk')
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Worker processes (default: CPU count, 0 = inline)'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Materialising personalised feeds...')
+        count = materialize_feeds(
+            full=options['full'],
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Refreshed feeds for {count} users'))
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from OTTAPP.datasets import explicit_timestamps
+from OTTAPP.models import PlaybackSession, UserActivity, UserActivityRollup
+
+EVENT_MODELS = (UserActivity, UserActivityRollup, PlaybackSession)
+
+
+class Command(BaseCommand):
+    help = (
+        'Move event rows left in the primary database into the events database. '
+        'Each chunk is copied and then deleted; if interrupted between the two, '
+        'that one chunk may end up in both databases.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows moved per transaction')
+
+    def handle(self, *args, **options):
+        events_db = settings.EVENTS_DATABASE
+        if events_db == DEFAULT_DB_ALIAS:
+            raise CommandError('EVENTS_DB_NAME is not set; event tables are in the primary database')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        for model in EVENT_MODELS:
+            moved = self.move(model, events_db, options['chunk_size'])
+            self.stdout.write(f'{model._meta.verbose_name_plural}: {moved} rows moved')
+        self.stdout.write(self.style.SUCCESS('Event data moved to the events database'))
+
+    def move(self, model, events_db, chunk_size):
+        moved = 0
+        # Keep the original timestamps rather than stamping the copies with now
+        with explicit_timestamps(model):
+            while True:
+                with transaction.atomic(using=DEFAULT_DB_ALIAS), transaction.atomic(using=events_db):
+                    rows = list(model.objects.using(DEFAULT_DB_ALIAS).order_by('pk')[:chunk_size])
+                    if not rows:
+                        break
+                    ids = [row.pk for row in rows]
+                    for row in rows:
+                        row.pk = None
+                    model.objects.using(events_db).bulk_create(rows, batch_size=1000)
+                    model.objects.using(DEFAULT_DB_ALIAS).filter(pk__in=ids).delete()
+                moved += len(ids)
+        return moved
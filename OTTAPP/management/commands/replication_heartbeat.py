@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from OTTAPP.models import ReplicationHeartbeat
+
+
+class Command(BaseCommand):
+    help = 'Touch the replication heartbeat on the primary, once or every --interval seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Keep beating every N seconds (run as a service); 0 beats once'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            ReplicationHeartbeat.objects.update_or_create(pk=1, defaults={'beat_at': timezone.now()})
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Heartbeat written'))
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from OTTAPP.activity import rollup_activity
+
+
+class Command(BaseCommand):
+    help = 'Roll user activity older than the retention period into daily counts and delete it'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.ACTIVITY_RETENTION_DAYS,
+            help='Keep raw activity from the last N days'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=settings.ACTIVITY_ROLLUP_CHUNK_SIZE,
+            help='Raw rows rolled up and deleted per transaction'
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--days and --chunk-size must be positive')
+        rolled = rollup_activity(options['days'], options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {rolled} activity rows older than {options["days"]} days'))
@@ -0,0 +1,593 @@
+"""
+Per-request performance instrumentation.
+
+``PerformanceMiddleware`` (in middleware.py) gives every request a
+``RequestTimings`` in a context variable, and the instrumented parts of the
+stack add to it:
+
+* database queries and their time, from an execute wrapper put on every
+  connection as it opens
+* cache hits and misses and their time, from the ``Instrumented*Cache``
+  backends in ``CACHES``
+* template rendering, from ``InstrumentedDjangoTemplates`` in ``TEMPLATES``
+* serializing, from ``TimedSerializerMixin`` and ``FastSerializer``; it
+  includes the queries serializers issue for relations
+
+Each response reports them in a ``Server-Timing`` header (``SERVER_TIMING``),
+and they are aggregated into per-route counters and histograms.
+
+Video streams get their own metrics, as the request's timing ends when
+streaming starts: ``instrument_stream`` wraps the chunks ``stream_video``
+serves and records, by movie and plan, the time to the first byte, the bytes
+served, how far into the file an aborted stream got, the sustained
+throughput, and how the stream's time split between reading the file (disk)
+and waiting for the client to take the bytes (network). playback.py adds the
+range pattern of each request and, per finished playback session, its range
+requests and how much of the file it reached. Only the
+``STREAM_METRICS_MOVIES`` most viewed movies get their own ``movie`` label;
+the others are counted as ``other``. The set is chosen once a day and kept in
+``METRICS_DIR/stream_movies.txt``, so every process on the host labels a
+movie the same way and the summed series stay whole.
+
+Every process keeps its own metrics and saves them to
+``METRICS_DIR/<pid>.json`` every ``METRICS_SAVE_SECONDS``; the metrics
+endpoint sums the files of all processes, so it reports for every gunicorn
+worker on the host whichever one serves the scrape. A new process with the
+pid of a dead one carries on from its counts, so the sums never go down.
+"""
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache.backends.base import BaseCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+MIB = 1024 * 1024
+BYTES_BUCKETS = (MIB // 16, MIB // 4, MIB, 4 * MIB, 16 * MIB, 64 * MIB, 256 * MIB, 1024 * MIB)
+THROUGHPUT_BUCKETS = (MIB // 8, MIB // 2, MIB, 2.5 * MIB, 5 * MIB, 10 * MIB, 25 * MIB, 50 * MIB, 100 * MIB)
+STREAM_SECONDS_BUCKETS = (0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 1800)
+RATIO_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 1)
+RANGE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# The movies with their own stream series are chosen again this often, and a
+# process checks the file for a new choice this often
+STREAM_MOVIES_FILE = 'stream_movies.txt'
+STREAM_MOVIES_REFRESH_SECONDS = 24 * 60 * 60
+STREAM_MOVIES_CHECK_SECONDS = 60
+# Throughput is only observed for streams long enough to sustain one
+SUSTAINED_BYTES = MIB
+
+# Name -> (help, buckets)
+HISTOGRAMS = {
+    'ott_http_request_duration_seconds': ('Time to produce the response', DURATION_BUCKETS),
+    'ott_http_request_db_seconds': ('Time spent in database queries per request', DURATION_BUCKETS),
+    'ott_http_request_db_queries': ('Database queries per request', QUERY_BUCKETS),
+    'ott_http_request_cache_seconds': ('Time spent in cache reads per request', DURATION_BUCKETS),
+    'ott_http_request_template_seconds': ('Time spent rendering templates per request', DURATION_BUCKETS),
+    'ott_http_request_serializer_seconds': ('Time spent in serializers per request', DURATION_BUCKETS),
+    'ott_stream_ttfb_seconds': ('Time from the request to the first byte of a stream', DURATION_BUCKETS),
+    'ott_stream_bytes': ('Bytes served per stream', BYTES_BUCKETS),
+    'ott_stream_abort_position_ratio': ('How far into the file aborted streams got', RATIO_BUCKETS),
+    'ott_stream_throughput_bytes_per_second': (
+        f'Throughput of streams of at least {SUSTAINED_BYTES} bytes, first byte to last', THROUGHPUT_BUCKETS
+    ),
+    'ott_stream_disk_seconds': ('Time spent reading the file per stream', STREAM_SECONDS_BUCKETS),
+    'ott_stream_send_seconds': ('Time spent waiting for the client to take the bytes per stream', STREAM_SECONDS_BUCKETS),
+    'ott_playback_session_range_requests': ('Range requests per playback session', RANGE_BUCKETS),
+    'ott_playback_session_reached_ratio': ('Furthest byte per playback session, as a share of the file', RATIO_BUCKETS),
+}
+COUNTERS = {
+    'ott_http_requests_total': 'Requests by route, method and status',
+    'ott_cache_reads_total': 'Cache reads by route and result',
+    'ott_streams_total': 'Streams by movie, plan and outcome (complete, aborted, failed)',
+    'ott_stream_ranges_total': 'Stream requests by plan and range pattern (start, sequential, seek, resume)',
+}
+
+_GROUP = re.compile(r'\(\?P<(\w+)>[^)]*\)')
+
+_current = ContextVar('request_timings', default=None)
+# Timers running in this context; nested timers of the same kind are not counted twice
+_running = ContextVar('running_timers', default=frozenset())
+
+
+class RequestTimings:
+    """What one request spent where; durations in seconds"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.durations = defaultdict(float)
+        self.db_queries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def add(self, name, seconds, queries=0, hits=0, misses=0):
+        # Queries of one request can run on several threads (async views)
+        with self.lock:
+            self.durations[name] += seconds
+            self.db_queries += queries
+            self.cache_hits += hits
+            self.cache_misses += misses
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        def metric(name, seconds, description=None):
+            value = f'{name};dur={seconds * 1000:.1f}'
+            return f'{value};desc="{description}"' if description else value
+
+        parts = [
+            metric('db', self.durations.get('db', 0.0), f'{self.db_queries} queries'),
+            metric('cache', self.durations.get('cache', 0.0), f'{self.cache_hits}/{self.cache_hits + self.cache_misses} hits'),
+        ]
+        parts.extend(metric(name, self.durations[name]) for name in ('template', 'serializer') if name in self.durations)
+        parts.append(metric('total', total))
+        return ', '.join(parts)
+
+
+def start():
+    """Start timing a request; returns its timings and the token for ``stop()``"""
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+@contextmanager
+def timed(name):
+    """Add the time of the block to the current request's ``name``, unless already inside such a block"""
+    timings = _current.get()
+    running = _running.get()
+    if timings is None or name in running:
+        yield
+        return
+    token = _running.set(running | {name})
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+        _running.reset(token)
+
+
+# Database
+
+def _time_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add('db', time.perf_counter() - started, queries=1)
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+# Cache
+
+_missing = object()
+
+
+class CacheMetricsMixin:
+    """Count the hits and misses of ``get()`` and ``get_many()`` (and what builds on them)"""
+
+    def get(self, key, default=None, version=None):
+        timings = _current.get()
+        if timings is None:
+            return super().get(key, default, version)
+        started = time.perf_counter()
+        value = super().get(key, _missing, version)
+        hit = value is not _missing
+        timings.add('cache', time.perf_counter() - started, hits=hit, misses=not hit)
+        return value if hit else default
+
+    def get_many(self, keys, version=None):
+        timings = _current.get()
+        # BaseCache.get_many() (LocMemCache's) calls get() per key, which counts them
+        if timings is None or super().get_many.__func__ is BaseCache.get_many:
+            return super().get_many(keys, version)
+        keys = list(keys)
+        started = time.perf_counter()
+        values = super().get_many(keys, version)
+        timings.add('cache', time.perf_counter() - started, hits=len(values), misses=len(keys) - len(values))
+        return values
+
+
+class InstrumentedLocMemCache(CacheMetricsMixin, LocMemCache):
+    pass
+
+
+class InstrumentedRedisCache(CacheMetricsMixin, RedisCache):
+    pass
+
+
+# Templates
+
+class _TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        with timed('template'):
+            return self.template.render(context, request)
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing ``render()``"""
+
+    def from_string(self, template_code):
+        return _TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name))
+
+
+# Serializers
+
+class TimedSerializerMixin:
+    """Serializer mixin adding ``to_representation()`` to the request's serializer time"""
+
+    def to_representation(self, instance):
+        with timed('serializer'):
+            return super().to_representation(instance)
+
+
+# Aggregation
+
+def _empty_histogram(name):
+    return {'buckets': [0] * (len(HISTOGRAMS[name][1]) + 1), 'sum': 0.0, 'count': 0}
+
+
+class MetricSet:
+    """Counters and histograms, keyed by ``(name, sorted label pairs)``"""
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def increment(self, name, labels, value=1):
+        self.counters[name, labels] += value
+
+    def observe(self, name, labels, value):
+        histogram = self.histograms.get((name, labels))
+        if histogram is None:
+            histogram = self.histograms[name, labels] = _empty_histogram(name)
+        buckets = HISTOGRAMS[name][1]
+        index = next((index for index, bound in enumerate(buckets) if value <= bound), len(buckets))
+        histogram['buckets'][index] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+    def rows(self):
+        """JSON-friendly ``[name, labels, value]`` rows"""
+        return [
+            [name, dict(labels), value]
+            for (name, labels), value in [*self.counters.items(), *self.histograms.items()]
+        ]
+
+    def merge(self, rows):
+        for name, labels, value in rows:
+            key = (name, tuple(sorted(labels.items())))
+            if name in HISTOGRAMS:
+                histogram = self.histograms.setdefault(key, _empty_histogram(name))
+                histogram['buckets'] = [a + b for a, b in zip(histogram['buckets'], value['buckets'])]
+                histogram['sum'] += value['sum']
+                histogram['count'] += value['count']
+            elif name in COUNTERS:
+                self.counters[key] += value
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def _read_stream_movies(path):
+    """The movies chosen in ``path``; ``None`` if there is no choice or it is due again"""
+    try:
+        if time.time() - os.path.getmtime(path) >= STREAM_MOVIES_REFRESH_SECONDS:
+            return None
+        with open(path) as f:
+            return frozenset(int(line) for line in f if line.strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _most_viewed_movies():
+    from .models import Movie
+
+    return frozenset(
+        Movie.objects.order_by('-view_count', 'id').values_list('id', flat=True)[:settings.STREAM_METRICS_MOVIES]
+    )
+
+
+def _choose_stream_movies(path):
+    """Choose the movies with their own stream series and write them to ``path`` for the other processes"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        lock = open(f'{path}.lock', 'w')
+    except OSError as e:
+        logger.warning(f"Could not save the stream metrics movies to {path}: {e}")
+        return _most_viewed_movies()
+    with lock:
+        # One process queries; the others wait for it and read its choice
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            movies = _read_stream_movies(path)
+            if movies is None:
+                movies = _most_viewed_movies()
+                try:
+                    temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+                    with open(temporary, 'w') as f:
+                        f.writelines(f'{movie_id}\n' for movie_id in sorted(movies))
+                    os.replace(temporary, path)
+                except OSError as e:
+                    logger.warning(f"Could not save the stream metrics movies to {path}: {e}")
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return movies
+
+
+class Registry:
+    """This process's metrics, saved to ``METRICS_DIR/<pid>.json``"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+
+    @property
+    def path(self):
+        return os.path.join(settings.METRICS_DIR, f'{self.pid}.json')
+
+    def _ensure_process(self):
+        # Also catches a fork: the child starts on its own file
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.metrics = MetricSet()
+        self.metrics.merge(_read(self.path))
+        self.saved_at = time.monotonic()
+        self.movies = frozenset()
+        self.movies_checked = None
+
+    def record(self, route, method, status, timings, total):
+        labels = (('method', method), ('route', route))
+        observations = [(name, labels, value) for name, value in {
+            'ott_http_request_duration_seconds': total,
+            'ott_http_request_db_seconds': timings.durations.get('db', 0.0),
+            'ott_http_request_db_queries': timings.db_queries,
+            'ott_http_request_cache_seconds': timings.durations.get('cache', 0.0),
+            'ott_http_request_template_seconds': timings.durations.get('template', 0.0),
+            'ott_http_request_serializer_seconds': timings.durations.get('serializer', 0.0),
+        }.items()]
+        increments = [('ott_http_requests_total', labels + (('status', str(status)),), 1)]
+        for result, count in (('hit', timings.cache_hits), ('miss', timings.cache_misses)):
+            if count:
+                increments.append(('ott_cache_reads_total', (('result', result), ('route', route)), count))
+        self.add(observations, increments)
+
+    def add(self, observations=(), increments=()):
+        """Observe ``(name, labels, value)`` histogram values and add them to counters; labels are sorted pairs"""
+        with self.lock:
+            self._ensure_process()
+            for name, labels, value in observations:
+                self.metrics.observe(name, labels, value)
+            for name, labels, value in increments:
+                self.metrics.increment(name, labels, value)
+            due = time.monotonic() - self.saved_at >= settings.METRICS_SAVE_SECONDS
+        if due:
+            self.save()
+
+    def movie_label(self, movie_id):
+        """``movie_id`` for the ``STREAM_METRICS_MOVIES`` most viewed movies, ``other`` for the rest"""
+        return str(movie_id) if movie_id in self._stream_movies() else 'other'
+
+    def _stream_movies(self):
+        now = time.monotonic()
+        with self.lock:
+            self._ensure_process()
+            if self.movies_checked is not None and now - self.movies_checked < STREAM_MOVIES_CHECK_SECONDS:
+                return self.movies
+            self.movies_checked = now
+        path = os.path.join(settings.METRICS_DIR, STREAM_MOVIES_FILE)
+        movies = _read_stream_movies(path)
+        if movies is None:
+            movies = _choose_stream_movies(path)
+        with self.lock:
+            self.movies = movies
+        return movies
+
+    def save(self):
+        """Write this process's metrics for the metrics endpoint of any process to read"""
+        with self.lock:
+            if self.pid != os.getpid():
+                # Nothing recorded in this process
+                return
+            rows = self.metrics.rows()
+            self.saved_at = time.monotonic()
+        try:
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            temporary = f'{self.path}.{threading.get_ident()}.tmp'
+            with open(temporary, 'w') as f:
+                json.dump(rows, f)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save metrics to {settings.METRICS_DIR}: {e}")
+
+
+registry = Registry()
+atexit.register(registry.save)
+
+
+def route_label(request):
+    """The URL pattern that matched, e.g. ``/api/movies/<pk>/``, so each route is one series"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    # Router patterns are regular expressions
+    route = _GROUP.sub(r'<\1>', match.route).replace('^', '').replace('$', '')
+    return '/' + route
+
+
+def record(request, response, timings):
+    """Add a finished request to the metrics and its ``Server-Timing`` header to the response"""
+    total = timings.total
+    route = route_label(request)
+    registry.record(route, request.method, response.status_code, timings, total)
+    if settings.SERVER_TIMING:
+        response['Server-Timing'] = timings.server_timing(total)
+    return response
+
+
+# Streams
+
+def label_pairs(**labels):
+    """Sorted label pairs for ``Registry.add``"""
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def current_timings():
+    """The running request's ``RequestTimings``, or ``None`` outside ``PerformanceMiddleware``"""
+    return _current.get()
+
+
+def instrument_stream(chunks, movie_id, plan, first_byte, file_size, started=None, on_end=None):
+    """
+    Yield ``chunks``, the bytes of a file from ``first_byte``, and record the
+    stream's delivery when it ends; ``started`` is when the request started
+    (``time.perf_counter()``, default now), and ``on_end`` is called with the
+    bytes sent once it has ended. The time spent getting the next
+    chunk is disk time, the time spent suspended at ``yield`` while the server
+    writes the chunk out is send time. A client that disconnects makes the
+    server close the iterator, which ends the stream as ``aborted``.
+    """
+    started = time.perf_counter() if started is None else started
+    iterator = iter(chunks)
+    sent, disk, send = 0, 0.0, 0.0
+    first_at = None
+    outcome = 'failed'
+    try:
+        while True:
+            read_started = time.perf_counter()
+            chunk = next(iterator, None)
+            ready = time.perf_counter()
+            disk += ready - read_started
+            if chunk is None:
+                break
+            if first_at is None:
+                first_at = ready
+            yield chunk
+            send += time.perf_counter() - ready
+            sent += len(chunk)
+        outcome = 'complete'
+    except GeneratorExit:
+        outcome = 'aborted'
+        raise
+    finally:
+        ended = time.perf_counter()
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
+        try:
+            _record_stream(
+                movie_id, plan, outcome, first_byte, file_size, sent, disk, send,
+                None if first_at is None else first_at - started, None if first_at is None else ended - first_at,
+            )
+        except Exception as e:
+            logger.warning(f"Could not record the stream of movie {movie_id}: {e}")
+        if on_end is not None:
+            on_end(sent)
+
+
+def _record_stream(movie_id, plan, outcome, first_byte, file_size, sent, disk, send, ttfb, streaming):
+    movie = registry.movie_label(movie_id)
+    by_plan = label_pairs(plan=plan)
+    by_movie = label_pairs(movie=movie, plan=plan)
+    observations = [
+        ('ott_stream_bytes', by_movie, sent),
+        ('ott_stream_disk_seconds', by_plan, disk),
+        ('ott_stream_send_seconds', by_plan, send),
+    ]
+    if ttfb is not None:
+        observations.append(('ott_stream_ttfb_seconds', by_movie, ttfb))
+    if outcome == 'aborted' and file_size:
+        observations.append(('ott_stream_abort_position_ratio', by_movie, (first_byte + sent) / file_size))
+    if sent >= SUSTAINED_BYTES and streaming:
+        observations.append(('ott_stream_throughput_bytes_per_second', by_plan, sent / streaming))
+    registry.add(observations, [('ott_streams_total', label_pairs(movie=movie, outcome=outcome, plan=plan), 1)])
+
+
+# Exposition
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    pairs = [*sorted(labels.items()), *extra.items()]
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render():
+    """The metrics of every process, summed, in the Prometheus text format"""
+    registry.save()
+    merged = MetricSet()
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+        merged.merge(_read(path))
+
+    lines = []
+    for name, help_text in COUNTERS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for (series, labels), value in sorted(merged.counters.items()):
+            if series == name:
+                lines.append(f'{name}{_labels(dict(labels))} {_number(value)}')
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for (series, labels), histogram in sorted(merged.histograms.items(), key=lambda item: item[0]):
+            if series != name:
+                continue
+            labels = dict(labels)
+            cumulative = 0
+            for bound, count in zip([*buckets, '+Inf'], histogram['buckets']):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels, le=bound)} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(histogram["sum"])}')
+            lines.append(f'{name}_count{_labels(labels)} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
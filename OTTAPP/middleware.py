@@ -0,0 +1,180 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import db_routers, metrics, profiling, query_inspector
+from .catalog_version import GLOBAL_SCOPE, MODIFIED_KEY
+
+STICKY_COOKIE = 'db_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class PrimaryStickinessMiddleware:
+    """
+    Decide per request whether catalog reads may use a replica (see
+    db_routers.py), and keep a client that wrote on the primary for
+    ``REPLICA_STICKY_SECONDS`` afterwards. Runs natively under ASGI too, so
+    async views are not pushed onto a thread by it.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.REPLICA_DATABASES:
+            return self.get_response(request)
+
+        modified = cache.get(MODIFIED_KEY.format(GLOBAL_SCOPE))
+        with db_routers.pinned(self.must_read_primary(request, modified)):
+            response = self.get_response(request)
+        return self.stick(request, response)
+
+    async def __acall__(self, request):
+        if not settings.REPLICA_DATABASES:
+            return await self.get_response(request)
+
+        modified = await cache.aget(MODIFIED_KEY.format(GLOBAL_SCOPE))
+        with db_routers.pinned(self.must_read_primary(request, modified)):
+            response = await self.get_response(request)
+        return self.stick(request, response)
+
+    def stick(self, request, response):
+        if request.method not in SAFE_METHODS:
+            until = int(time.time() + settings.REPLICA_STICKY_SECONDS)
+            response.set_cookie(
+                STICKY_COOKIE, str(until), max_age=settings.REPLICA_STICKY_SECONDS,
+                httponly=True, samesite='Lax', secure=settings.SESSION_COOKIE_SECURE,
+            )
+        return response
+
+    def must_read_primary(self, request, modified):
+        """``modified`` is when the catalog last changed (``MODIFIED_KEY``), or None"""
+        if request.method not in SAFE_METHODS:
+            return True
+        try:
+            if float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time():
+                return True
+        except ValueError:
+            pass
+        # The catalog just changed: its version has moved, replicas may not have
+        return modified is not None and time.time() - modified < settings.REPLICA_MAX_LAG_SECONDS
+
+
+class PerformanceMiddleware:
+    """
+    Time each request's database queries, cache reads, template rendering and
+    serializing (see metrics.py), report them in a ``Server-Timing`` header
+    and add them to the per-route metrics. Goes first in MIDDLEWARE so the
+    total covers the other middleware too. For streamed responses the total
+    stops when streaming starts.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings, token = metrics.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.stop(token)
+        return metrics.record(request, response, timings)
+
+    async def __acall__(self, request):
+        timings, token = metrics.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.stop(token)
+        return metrics.record(request, response, timings)
+
+
+class QueryInspectorMiddleware:
+    """
+    With ``QUERY_INSPECTOR`` on, inspect every request's queries (see
+    query_inspector.py): log its N+1 and slow queries with where they come
+    from, and keep the ranked per-view report in ``QUERY_INSPECTOR_REPORT``.
+    For development: recording where each query comes from walks the stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.QUERY_INSPECTOR:
+            return self.get_response(request)
+        with query_inspector.inspect() as inspection:
+            response = self.get_response(request)
+        self.report(request, inspection)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.QUERY_INSPECTOR:
+            return await self.get_response(request)
+        with query_inspector.inspect() as inspection:
+            response = await self.get_response(request)
+        self.report(request, inspection)
+        return response
+
+    def report(self, request, inspection):
+        offenders = inspection.offenders()
+        if not offenders:
+            return
+        view = query_inspector.view_name(request)
+        for offender in offenders:
+            query_inspector.logger.warning(
+                f"{offender['kind']} query in {view} ({request.path}): {offender['count']} x "
+                f"{offender['ms']:.1f} ms from {offender['origin']}: {offender['fingerprint'][:200]}"
+            )
+        query_inspector.report.add(view, offenders)
+        query_inspector.report.write(settings.QUERY_INSPECTOR_REPORT)
+
+
+class ProfilingMiddleware:
+    """
+    Let this worker join the CPU and heap profiling sessions staff start (see
+    profiling.py), and mark the requests a session profiles. Not loaded at all
+    with ``PROFILING`` off.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profiling.profiler.poll()
+        with profiling.profiler.request():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        profiling.profiler.poll()
+        with profiling.profiler.request():
+            return await self.get_response(request)
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('OTTAPP', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovieTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('movie_id', models.PositiveBigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Movie Tombstone',
+                'verbose_name_plural': 'Movie Tombstones',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['updated_at', 'id'], name='movie_updated_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movietombstone',
+            index=models.Index(fields=['deleted_at', 'movie_id'], name='tombstone_deleted_id_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('OTTAPP', '0002_movie_changes_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaybackSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('ended_at', models.DateTimeField()),
+                ('bytes_served', models.PositiveBigIntegerField(default=0)),
+                ('furthest_byte', models.PositiveBigIntegerField(default=0)),
+                ('file_size', models.PositiveBigIntegerField(default=0)),
+                ('range_requests', models.PositiveIntegerField(default=0)),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('user_agent', models.TextField(blank=True)),
+                ('movie', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='OTTAPP.movie')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Playback Session',
+                'verbose_name_plural': 'Playback Sessions',
+                'ordering': ['-started_at'],
+                'indexes': [models.Index(fields=['user', '-started_at'], name='playback_user_started_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('OTTAPP', '0003_playback_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WatchProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(default=0, help_text='Seconds into the movie')),
+                ('completed', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField()),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='OTTAPP.movie')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Watch Progress',
+                'verbose_name_plural': 'Watch Progress',
+                'ordering': ['-updated_at'],
+                'indexes': [models.Index(fields=['user', 'completed', '-updated_at'], name='progress_user_recent_idx')],
+                'unique_together': {('user', 'movie')},
+            },
+        ),
+    ]
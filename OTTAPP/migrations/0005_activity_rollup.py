@@ -0,0 +1,52 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:54
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('OTTAPP', '0004_watch_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserActivityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('activity_type', models.CharField(choices=[('login', 'Login'), ('logout', 'Logout'), ('movie_view', 'Movie View'), ('subscription', 'Subscription Change'), ('profile_update', 'Profile Update')], max_length=20)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'User Activity Rollup',
+                'verbose_name_plural': 'User Activity Rollups',
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['user', '-created_at'], name='activity_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['created_at'], name='activity_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='useractivityrollup',
+            name='movie',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='OTTAPP.movie'),
+        ),
+        migrations.AddField(
+            model_name='useractivityrollup',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='useractivityrollup',
+            index=models.Index(fields=['user', '-day'], name='rollup_user_day_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 19:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('OTTAPP', '0008_event_relations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterializedFeed',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='materialized_feed', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('rows', models.JSONField(default=dict, help_text='Ranked movie ids by row key')),
+                ('built_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Materialized Feed',
+                'verbose_name_plural': 'Materialized Feeds',
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-19 19:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('OTTAPP', '0009_materialized_feed'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='movietombstone',
+            name='tombstone_deleted_id_idx',
+        ),
+        migrations.AddIndex(
+            model_name='movietombstone',
+            index=models.Index(fields=['deleted_at', 'id'], name='tombstone_deleted_id_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 19:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('OTTAPP', '0010_tombstone_deleted_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playbacksession',
+            name='open_key',
+            field=models.CharField(blank=True, editable=False, max_length=41, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='playbacksession',
+            name='plan',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-19 20:00
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_rollups(apps, schema_editor):
+    """Concurrent rollup runs could create the same rollup twice; sum them into one"""
+    UserActivityRollup = apps.get_model('OTTAPP', 'UserActivityRollup')
+    rollups = UserActivityRollup.objects.using(schema_editor.connection.alias)
+    duplicates = (
+        rollups.filter(movie__isnull=False)
+        .values('user', 'day', 'activity_type', 'movie')
+        .annotate(rows=Count('id'), total=Sum('count'), keep=Min('id'))
+        .filter(rows__gt=1)
+        .order_by()
+    )
+    for key in list(duplicates):
+        rollups.filter(pk=key['keep']).update(count=key['total'])
+        rollups.filter(
+            user=key['user'], day=key['day'], activity_type=key['activity_type'], movie=key['movie']
+        ).exclude(pk=key['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('OTTAPP', '0011_playback_open_sessions'),
+    ]
+
+    operations = [
+        # The hint routes this to the database holding the rollups
+        migrations.RunPython(
+            merge_duplicate_rollups, migrations.RunPython.noop, hints={'model_name': 'useractivityrollup'}
+        ),
+        migrations.AddConstraint(
+            model_name='useractivityrollup',
+            constraint=models.UniqueConstraint(fields=('user', 'day', 'activity_type', 'movie'), name='rollup_unique_key'),
+        ),
+    ]
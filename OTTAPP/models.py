@@ -90,8 +90,46 @@ class Movie(models.Model):
         verbose_name = "Movie"
         verbose_name_plural = "Movies"
         ordering = ['-created_at']
+        indexes = [
+            # Cursor order of the changes feed
+            models.Index(fields=['updated_at', 'id'], name='movie_updated_id_idx'),
+            # Catalog lists: newest first, overall and per language / row
+            models.Index(fields=['-created_at'], name='movie_created_idx'),
+            models.Index(fields=['language', '-created_at'], name='movie_language_created_idx'),
+            models.Index(fields=['is_featured', '-created_at'], name='movie_featured_created_idx'),
+            models.Index(fields=['is_trending', '-created_at'], name='movie_trending_created_idx'),
+        ]
+
+
+class MovieTombstone(models.Model):
+    """A deleted movie, kept for the changes feed until clients have synced"""
+    movie_id = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Movie Tombstone"
+        verbose_name_plural = "Movie Tombstones"
+        indexes = [
+            # The changes feed reads tombstones in (deleted_at, id) order
+            models.Index(fields=['deleted_at', 'id'], name='tombstone_deleted_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"Movie {self.movie_id} deleted at {self.deleted_at}"
     
     
+class ReplicationHeartbeat(models.Model):
+    """A single row the primary keeps touching; its age on a replica is the replica's lag"""
+    beat_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Replication Heartbeat"
+        verbose_name_plural = "Replication Heartbeats"
+
+    def __str__(self):
+        return f"Heartbeat at {self.beat_at}"
+
+
 class Subscription(models.Model):
     SUBSCRIPTION_PLANS = [
         ('basic', 'Basic Plan'),
@@ -151,6 +189,10 @@ class Watchlist(models.Model):
         unique_together = ['user', 'movie']
         verbose_name = "Watchlist"
         verbose_name_plural = "Watchlists"
+        indexes = [
+            # The home feed's watchlist row, most recently added first
+            models.Index(fields=['user', '-added_at'], name='watchlist_user_added_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.movie.title}"
@@ -175,6 +217,11 @@ class MovieRating(models.Model):
         return f"{self.user.username} - {self.movie.title} - {self.rating}"
 
 
+# Event models (UserActivity, UserActivityRollup, PlaybackSession) may live in
+# the separate events database (see db_routers.EventRouter). Their relations
+# carry no database constraints or cascades; deleting a user or a movie is
+# propagated in code (see signals.py).
+
 class UserActivity(models.Model):
     ACTIVITY_TYPES = [
         ('login', 'Login'),
@@ -184,10 +231,10 @@ class UserActivity(models.Model):
         ('profile_update', 'Profile Update'),
     ]
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False)
     activity_type = models.CharField(max_length=20, choices=ACTIVITY_TYPES)
     description = models.TextField()
-    movie = models.ForeignKey(Movie, on_delete=models.SET_NULL, null=True, blank=True)
+    movie = models.ForeignKey(Movie, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     user_agent = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -196,8 +243,100 @@ class UserActivity(models.Model):
         verbose_name = "User Activity"
         verbose_name_plural = "User Activities"
         ordering = ['-created_at']
+        indexes = [
+            # A user's recent activity, newest first
+            models.Index(fields=['user', '-created_at'], name='activity_user_created_idx'),
+            # Retention: raw rows older than the cutoff, oldest first
+            models.Index(fields=['created_at'], name='activity_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.activity_type} - {self.created_at}"
 
 
+class UserActivityRollup(models.Model):
+    """Daily count of one user's activity of one type (and movie), for rows past retention"""
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False)
+    day = models.DateField()
+    activity_type = models.CharField(max_length=20, choices=UserActivity.ACTIVITY_TYPES)
+    movie = models.ForeignKey(Movie, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "User Activity Rollup"
+        verbose_name_plural = "User Activity Rollups"
+        ordering = ['-day']
+        indexes = [
+            models.Index(fields=['user', '-day'], name='rollup_user_day_idx'),
+        ]
+        constraints = [
+            # Rollups without a movie are NULL there, which never conflicts
+            models.UniqueConstraint(fields=['user', 'day', 'activity_type', 'movie'], name='rollup_unique_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.activity_type} x{self.count} on {self.day}"
+
+
+class PlaybackSession(models.Model):
+    """One viewing of a movie: the range requests of a player collapsed into a row"""
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False)
+    movie = models.ForeignKey(Movie, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True)
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField()
+    bytes_served = models.PositiveBigIntegerField(default=0)
+    furthest_byte = models.PositiveBigIntegerField(default=0)
+    file_size = models.PositiveBigIntegerField(default=0)
+    range_requests = models.PositiveIntegerField(default=0)
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    user_agent = models.TextField(blank=True)
+    plan = models.CharField(max_length=20, blank=True)
+    # "<user id>:<movie id>" while the session is open, NULL once it is finished
+    open_key = models.CharField(max_length=41, null=True, blank=True, unique=True, editable=False)
+
+    class Meta:
+        verbose_name = "Playback Session"
+        verbose_name_plural = "Playback Sessions"
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['user', '-started_at'], name='playback_user_started_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.movie} - {self.started_at}"
+
+
+class WatchProgress(models.Model):
+    """Where a user stopped watching a movie, for resuming and continue watching"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
+    position = models.PositiveIntegerField(default=0, help_text="Seconds into the movie")
+    completed = models.BooleanField(default=False)
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ['user', 'movie']
+        verbose_name = "Watch Progress"
+        verbose_name_plural = "Watch Progress"
+        ordering = ['-updated_at']
+        indexes = [
+            # Continue watching: a user's most recent movies, finished ones filtered out
+            models.Index(fields=['user', '-updated_at'], name='progress_user_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.movie.title} at {self.position}s"
+
+
+class MaterializedFeed(models.Model):
+    """A user's personal home rows, computed offline by ``manage.py materialize_feeds``"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='materialized_feed')
+    rows = models.JSONField(default=dict, help_text="Ranked movie ids by row key")
+    built_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = "Materialized Feed"
+        verbose_name_plural = "Materialized Feeds"
+
+    def __str__(self):
+        return f"{self.user.username} - {self.built_at}"
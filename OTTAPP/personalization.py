@@ -0,0 +1,247 @@
+"""
+Offline materialisation of personalised home rows.
+
+``manage.py materialize_feeds`` computes, for every active user, the ranked
+movie ids of their personal rows and stores them in one MaterializedFeed row
+per user:
+
+* ``because_you_saved`` - neighbours of the movies on the user's watchlist
+* ``favorite_genres`` - top titles of the genres the user rates highly
+* ``recent_languages`` - popular titles in the languages the user watched lately
+
+Users are processed in chunks across a process pool. Catalog-wide inputs
+(top titles per genre and per language) are computed once per run and handed
+to the workers. Incremental runs refresh users with watchlist, rating or
+activity changes since the previous run, plus every user whose rows were
+built before the latest movie change or more than ``FEED_MAX_AGE`` ago, so
+new titles and shifting popularity reach users who are not active.
+
+The request path reads one row per user (``get_personal_rows``) and the home
+feed hydrates the cards of all rows in bulk.
+"""
+import logging
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.db import connections
+from django.db.models import F, Max
+from django.utils import timezone
+
+from .models import MaterializedFeed, Movie, Watchlist, MovieRating, UserActivity
+from .recommendations import get_neighbour_index
+from .upserts import upsert
+
+logger = logging.getLogger(__name__)
+
+ROW_SIZE = 20
+ACTIVE_DAYS = 30
+FAVORITE_RATING = 7.0
+TOP_GENRES = 3
+RECENT_LANGUAGES = 2
+WATCHLIST_SEEDS = 10
+CANDIDATES_PER_GROUP = 200
+
+# Rows older than this are rebuilt even without user or catalog changes
+FEED_MAX_AGE = timedelta(hours=24)
+
+ROW_TITLES = {
+    'because_you_saved': 'Because You Saved',
+    'favorite_genres': 'From Your Favourite Genres',
+    'recent_languages': 'In Languages You Watch',
+}
+
+
+# Catalog-wide inputs
+
+def catalog_context():
+    """Top titles per genre and per language, shared by every chunk of a run"""
+    by_genre = defaultdict(list)
+    genre_rows = (
+        Movie.genre.through.objects
+        .order_by('genre_id', F('movie__rating').desc(), F('movie__view_count').desc())
+        .values_list('genre_id', 'movie_id')
+    )
+    for genre_id, movie_id in genre_rows.iterator(chunk_size=10000):
+        if len(by_genre[genre_id]) < CANDIDATES_PER_GROUP:
+            by_genre[genre_id].append(movie_id)
+
+    by_language = defaultdict(list)
+    language_rows = Movie.objects.order_by('language', '-view_count', '-rating').values_list('language', 'id')
+    for language, movie_id in language_rows.iterator(chunk_size=10000):
+        if len(by_language[language]) < CANDIDATES_PER_GROUP:
+            by_language[language].append(movie_id)
+
+    return {'by_genre': dict(by_genre), 'by_language': dict(by_language)}
+
+
+# Per-user rows
+
+def _top(candidates, exclude, size=ROW_SIZE):
+    row = []
+    for movie_id in candidates:
+        if movie_id not in exclude:
+            row.append(movie_id)
+            exclude.add(movie_id)
+            if len(row) == size:
+                break
+    return row
+
+
+def _interleave(groups):
+    """Round-robin merge so every group contributes to the top of the row"""
+    merged = []
+    for position in range(max((len(g) for g in groups), default=0)):
+        for group in groups:
+            if position < len(group):
+                merged.append(group[position])
+    return merged
+
+
+def materialize_chunk(user_ids, context):
+    """Return ``{user_id: {row key: movie ids}}`` for a chunk of users"""
+    since = timezone.now() - timedelta(days=ACTIVE_DAYS)
+
+    watchlists = defaultdict(list)
+    rows = Watchlist.objects.filter(user_id__in=user_ids).order_by('-added_at').values_list('user_id', 'movie_id')
+    for user_id, movie_id in rows:
+        watchlists[user_id].append(movie_id)
+
+    rated = defaultdict(set)
+    genre_scores = defaultdict(Counter)
+    rows = (
+        MovieRating.objects
+        .filter(user_id__in=user_ids)
+        .values_list('user_id', 'movie_id', 'rating', 'movie__genre')
+    )
+    for user_id, movie_id, rating, genre_id in rows:
+        rated[user_id].add(movie_id)
+        if genre_id is not None and rating >= FAVORITE_RATING:
+            genre_scores[user_id][genre_id] += rating
+
+    language_views = defaultdict(Counter)
+    # Activity may be in the events database, so movie languages are looked up separately
+    views = list(
+        UserActivity.objects
+        .filter(user_id__in=user_ids, activity_type='movie_view', movie__isnull=False, created_at__gte=since)
+        .values_list('user_id', 'movie_id')
+    )
+    languages = dict(
+        Movie.objects.filter(pk__in={movie_id for _, movie_id in views}).values_list('pk', 'language')
+    )
+    for user_id, movie_id in views:
+        if movie_id in languages:
+            language_views[user_id][languages[movie_id]] += 1
+
+    neighbour_index = get_neighbour_index()
+    entries = {}
+    for user_id in user_ids:
+        saved = watchlists.get(user_id, [])
+        seen = set(saved) | rated.get(user_id, set())
+
+        scores = Counter()
+        for movie_id in saved[:WATCHLIST_SEEDS]:
+            for neighbour_id, score in neighbour_index.neighbours(movie_id, ROW_SIZE) or []:
+                scores[neighbour_id] += score
+        because_you_saved = _top([movie_id for movie_id, _ in scores.most_common()], set(seen))
+
+        genres = [genre_id for genre_id, _ in genre_scores[user_id].most_common(TOP_GENRES)]
+        favorite_genres = _top(
+            _interleave([context['by_genre'].get(genre_id, []) for genre_id in genres]), set(seen)
+        )
+
+        languages = [language for language, _ in language_views[user_id].most_common(RECENT_LANGUAGES)]
+        recent_languages = _top(
+            _interleave([context['by_language'].get(language, []) for language in languages]), set(seen)
+        )
+
+        entries[user_id] = {
+            'because_you_saved': because_you_saved,
+            'favorite_genres': favorite_genres,
+            'recent_languages': recent_languages,
+        }
+    return entries
+
+
+# Runs
+
+def users_to_refresh(since):
+    """Ids of users with watchlist, rating or activity changes after ``since``"""
+    user_ids = set(Watchlist.objects.filter(added_at__gte=since).values_list('user_id', flat=True).distinct())
+    user_ids.update(MovieRating.objects.filter(updated_at__gte=since).values_list('user_id', flat=True).distinct())
+    user_ids.update(
+        UserActivity.objects.filter(created_at__gte=since).order_by().values_list('user_id', flat=True).distinct()
+    )
+    return user_ids
+
+
+def stale_feed_users(now):
+    """Ids of users whose rows predate the latest movie change or are older than FEED_MAX_AGE"""
+    cutoff = now - FEED_MAX_AGE
+    changed_at = Movie.objects.aggregate(changed_at=Max('updated_at'))['changed_at']
+    if changed_at is not None and changed_at > cutoff:
+        cutoff = changed_at
+    return set(MaterializedFeed.objects.filter(built_at__lt=cutoff).values_list('user_id', flat=True))
+
+
+_worker_context = None
+
+
+def _init_worker(context):
+    global _worker_context
+    _worker_context = context
+
+
+def _materialize_in_worker(user_ids):
+    return materialize_chunk(user_ids, _worker_context)
+
+
+def materialize_feeds(full=False, chunk_size=500, workers=None):
+    """
+    Refresh the personal rows of active users and of stale feeds. Returns the
+    number of users refreshed. A full run covers everyone active in the last
+    ACTIVE_DAYS.
+    """
+    workers = os.cpu_count() if workers is None else workers
+    started_at = timezone.now()
+
+    # Every feed of a run is stamped with its start, so the newest stamp is the last run
+    last_run = None if full else MaterializedFeed.objects.aggregate(last_run=Max('built_at'))['last_run']
+    since = last_run or started_at - timedelta(days=ACTIVE_DAYS)
+    user_ids = sorted(users_to_refresh(since) | stale_feed_users(started_at))
+    logger.info("Materialising feeds for %d users (changes since %s)", len(user_ids), since)
+
+    context = catalog_context()
+    chunks = [user_ids[i:i + chunk_size] for i in range(0, len(user_ids), chunk_size)]
+
+    refreshed = 0
+    if workers and workers > 1 and len(chunks) > 1:
+        # Forked workers open their own database connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(context,)) as pool:
+            for entries in pool.map(_materialize_in_worker, chunks):
+                refreshed += _store(entries, started_at)
+    else:
+        for chunk in chunks:
+            refreshed += _store(materialize_chunk(chunk, context), started_at)
+    return refreshed
+
+
+def _store(entries, built_at):
+    upsert(
+        MaterializedFeed,
+        [MaterializedFeed(user_id=user_id, rows=rows, built_at=built_at) for user_id, rows in entries.items()],
+        unique_fields=['user'],
+        update_fields=['rows', 'built_at'],
+    )
+    return len(entries)
+
+
+def get_personal_rows(user):
+    """The materialised rows of ``user`` as ``[(key, title, ids)]``; one query"""
+    rows = MaterializedFeed.objects.filter(user_id=user.pk).values_list('rows', flat=True).first()
+    if rows is None:
+        return []
+    # In ROW_TITLES order: JSON columns need not keep the key order
+    return [(key, title, rows[key]) for key, title in ROW_TITLES.items() if key in rows]
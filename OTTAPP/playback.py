@@ -0,0 +1,237 @@
+"""
+Playback sessions.
+
+A player fetches a video as many range requests (start, seeks, buffering).
+Instead of a view and an activity row per request, ``stream_video`` accounts
+every range to the user's open PlaybackSession of the movie once its stream
+ends, with the bytes actually sent:
+
+* the first range of a movie opens a session
+* later ranges within ``PLAYBACK_IDLE_SECONDS`` extend it: bytes sent, range
+  count, furthest byte sent and last activity
+* a session with no ranges for the idle window is finished: it is saved, one
+  ``movie_view`` UserActivity is written and the movie's view count is bumped
+  once for the viewing
+
+With a shared cache (Redis, see ``REDIS_URL``) an open session lives only in
+the cache, under ``playback:<user id>:<movie id>``, and its first range notes
+it in a journal; the database sees one row per viewing, when it is finished.
+Concurrent ranges of one player may race on the cached session, and the last
+write wins. With a per-process cache each process would keep its own copy,
+so the open session is a row instead: its ``open_key`` (``<user id>:<movie
+id>``) is unique and every range updates it under a row lock.
+
+Each range also counts towards the stream metrics by its pattern: ``start``
+(from byte 0), ``sequential`` (on from the session's furthest byte), ``seek``
+(elsewhere in an open session) or ``resume`` (a new session from elsewhere
+than the start, e.g. continue watching).
+
+An idle session is finished by the next range for the same movie, or by
+``manage.py flush_playback_sessions``, which finishes all idle sessions in
+bulk. Their range requests and the share of the file they reached go to the
+metrics.
+"""
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics
+from .buffers import CacheJournal, cache_is_shared
+from .models import Movie, PlaybackSession, UserActivity
+
+logger = logging.getLogger(__name__)
+
+FLUSH_CHUNK_SIZE = 500
+SESSION_TIMEOUT = 60 * 60 * 24
+SESSION_KEY = 'playback:{}:{}'
+
+journal = CacheJournal('playback_sessions', timeout=SESSION_TIMEOUT)
+
+
+def _idle_since():
+    return timezone.now() - timedelta(seconds=settings.PLAYBACK_IDLE_SECONDS)
+
+
+def _new(request, movie, plan, file_size, now):
+    return PlaybackSession(
+        user_id=request.user.pk,
+        movie_id=movie.pk,
+        plan=plan,
+        started_at=now,
+        ended_at=now,
+        file_size=file_size,
+        ip_address=request.META.get('REMOTE_ADDR'),
+        user_agent=request.META.get('HTTP_USER_AGENT', ''),
+    )
+
+
+def _extend(session, first_byte, sent, now):
+    """Account a range to ``session``; returns its furthest byte before, None if it had no range yet"""
+    position = session.furthest_byte if session.range_requests else None
+    session.bytes_served += sent
+    session.range_requests += 1
+    if sent:
+        session.furthest_byte = max(session.furthest_byte, first_byte + sent - 1)
+    session.ended_at = now
+    return position
+
+
+def _record_in_cache(request, movie, plan, file_size, first_byte, sent, now):
+    key = SESSION_KEY.format(request.user.pk, movie.pk)
+    session = cache.get(key)
+    if session is not None and session.ended_at < _idle_since():
+        # That viewing is over; whoever deletes the key finishes it
+        if cache.delete(key):
+            finish_sessions([session])
+        session = None
+    if session is None:
+        session = _new(request, movie, plan, file_size, now)
+        journal.append((request.user.pk, movie.pk))
+    position = _extend(session, first_byte, sent, now)
+    cache.set(key, session, SESSION_TIMEOUT)
+    return session, position
+
+
+def _record_in_database(request, movie, plan, file_size, first_byte, sent, now):
+    key = f'{request.user.pk}:{movie.pk}'
+    locked = PlaybackSession.objects.select_for_update()
+
+    with transaction.atomic(using=settings.EVENTS_DATABASE):
+        session = locked.filter(open_key=key).first()
+        if session is not None and session.ended_at < _idle_since():
+            # That viewing is over; this range starts the next one
+            finish_sessions([session])
+            session = None
+
+        if session is None:
+            session = _new(request, movie, plan, file_size, now)
+            session.open_key = key
+            position = _extend(session, first_byte, sent, now)
+            try:
+                # A savepoint, so the surrounding transaction survives a duplicate key
+                with transaction.atomic(using=settings.EVENTS_DATABASE):
+                    session.save(force_insert=True)
+                return session, position
+            except IntegrityError:
+                # Opened concurrently; account to that one
+                session = locked.get(open_key=key)
+        position = _extend(session, first_byte, sent, now)
+        session.save(update_fields=['bytes_served', 'range_requests', 'furthest_byte', 'ended_at'])
+    return session, position
+
+
+def record_range(request, movie, first_byte, sent, file_size, plan='unknown'):
+    """Account a finished stream of ``sent`` bytes from ``first_byte`` to the user's playback session of ``movie``"""
+    record = _record_in_cache if cache_is_shared() else _record_in_database
+    session, position = record(request, movie, plan, file_size, first_byte, sent, timezone.now())
+
+    if first_byte == 0:
+        pattern = 'start'
+    elif position is None:
+        pattern = 'resume'
+    else:
+        pattern = 'sequential' if first_byte == position + 1 else 'seek'
+    metrics.registry.add(increments=[('ott_stream_ranges_total', metrics.label_pairs(pattern=pattern, plan=plan), 1)])
+    return session
+
+
+def _session_observations(session):
+    # Sessions opened before plans were noted have none
+    by_plan = metrics.label_pairs(plan=session.plan or 'unknown')
+    observations = [('ott_playback_session_range_requests', by_plan, session.range_requests)]
+    if session.file_size:
+        observations.append(
+            ('ott_playback_session_reached_ratio', by_plan, (session.furthest_byte + 1) / session.file_size)
+        )
+    return observations
+
+
+def finish_sessions(sessions):
+    """
+    Close ``sessions``: insert the ones kept in the cache, clear the open keys
+    of the saved ones (locked by the caller), write one ``movie_view``
+    activity per viewing and bump the movies' view counts.
+    """
+    titles = dict(
+        Movie.objects.filter(pk__in={session.movie_id for session in sessions}).values_list('pk', 'title')
+    )
+    with transaction.atomic(using=settings.EVENTS_DATABASE):
+        PlaybackSession.objects.filter(
+            pk__in=[session.pk for session in sessions if session.pk is not None]
+        ).update(open_key=None)
+        for session in sessions:
+            session.open_key = None
+        PlaybackSession.objects.bulk_create([session for session in sessions if session.pk is None], batch_size=1000)
+        # Movies deleted while a session was open leave the activity unlinked
+        UserActivity.objects.bulk_create([
+            UserActivity(
+                user_id=session.user_id,
+                activity_type='movie_view',
+                description=f"Viewed movie: {titles.get(session.movie_id, 'deleted movie')}",
+                movie_id=session.movie_id if session.movie_id in titles else None,
+                ip_address=session.ip_address,
+                user_agent=session.user_agent,
+            )
+            for session in sessions
+        ], batch_size=1000)
+
+    views = Counter(session.movie_id for session in sessions if session.movie_id in titles)
+    # View counts live on the primary; update() rather than save(), so they do
+    # not invalidate catalog versions
+    with transaction.atomic():
+        for movie_id, count in views.items():
+            Movie.objects.filter(pk=movie_id).update(view_count=F('view_count') + count)
+
+    metrics.registry.add([observation for session in sessions for observation in _session_observations(session)])
+
+
+def _flush_cached(idle_since):
+    pairs = list(dict.fromkeys(tuple(pair) for pair in journal.drain()))
+    keys = [SESSION_KEY.format(*pair) for pair in pairs]
+    found = cache.get_many(keys)
+    idle = []
+    for pair, key in zip(pairs, keys):
+        session = found.get(key)
+        if session is None:
+            # Finished by its next range, or evicted
+            continue
+        if session.ended_at >= idle_since:
+            # Still playing; look again at the next flush
+            journal.append(pair)
+        elif cache.delete(key):
+            idle.append(session)
+    for start in range(0, len(idle), FLUSH_CHUNK_SIZE):
+        finish_sessions(idle[start:start + FLUSH_CHUNK_SIZE])
+    return len(idle)
+
+
+def _flush_database(idle_since):
+    finished = 0
+    while True:
+        with transaction.atomic(using=settings.EVENTS_DATABASE):
+            # Sessions locked by a request are in use; they are not idle
+            sessions = list(
+                PlaybackSession.objects
+                .select_for_update(skip_locked=True)
+                .filter(open_key__isnull=False, ended_at__lt=idle_since)
+                .order_by('pk')[:FLUSH_CHUNK_SIZE]
+            )
+            if not sessions:
+                break
+            finish_sessions(sessions)
+        finished += len(sessions)
+    return finished
+
+
+def flush_sessions():
+    """Finish the sessions idle for longer than the idle window, cached or saved; returns how many"""
+    idle_since = _idle_since()
+    finished = _flush_cached(idle_since) + _flush_database(idle_since)
+    logger.info("Finished %d playback sessions", finished)
+    return finished
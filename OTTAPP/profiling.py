@@ -0,0 +1,329 @@
+"""
+On-demand CPU profiles and heap growth of the live workers.
+
+With ``PROFILING`` on, a staff user starts a session with ``POST
+/api/profiling/`` (see ``views.profiling_sessions``). The session is written
+to ``PROFILING_DIR/session.json``, where every worker process on the host
+finds it on its next request (``Profiler.poll`` reads the file at most every
+``PROFILING_POLL_SECONDS``) and joins it:
+
+* ``cpu``: a sampling thread records the stack of the request threads every
+  ``interval_ms``, for the worker's next ``requests`` requests or, without
+  ``requests``, of every thread until the session ends. The stacks are written
+  in the folded format flamegraph.pl and speedscope read, one
+  ``root;caller;callee count`` line per distinct stack. Sampling is wall-clock:
+  a request waiting on the database shows in its cursor's ``execute``.
+* ``heap``: ``tracemalloc`` traces allocations from the worker's first
+  request in the session to its ``requests``-th or to the end of the session,
+  and the growth in between is written per allocation site.
+
+A session ends at ``seconds`` (at most ``PROFILING_MAX_SECONDS``) or when it is
+stopped with ``DELETE /api/profiling/``. Each worker writes
+``PROFILING_DIR/<session>/<pid>.cpu.folded`` or ``<pid>.heap.txt`` on its
+host. The session is a file rather than a cache entry because the local
+memory cache is per process; with ``PROFILING_DIR`` on shared storage, the
+workers of every host join. With ``PROFILING`` off, ``ProfilingMiddleware`` is
+not loaded at all; on but idle, a request costs a clock read and a file read
+every few seconds.
+"""
+import json
+import logging
+import os
+import re
+import sys
+import sysconfig
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SESSION_FILE = 'session.json'
+KINDS = ('cpu', 'heap')
+SESSION_ID = re.compile(r'^[0-9a-f]{32}$')
+PROFILE_NAME = re.compile(r'^\d+\.(?:cpu\.folded|heap\.txt)$')
+
+# Frames kept per allocation by tracemalloc, and sites listed in a heap report
+TRACEBACK_FRAMES = 25
+HEAP_SITES = 50
+HEAP_TRACEBACKS = 10
+
+
+@lru_cache(maxsize=4096)
+def _short_path(filename):
+    project = os.path.join(str(settings.BASE_DIR), '')
+    if filename.startswith(project):
+        return os.path.relpath(filename, project)
+    _, marker, rest = filename.rpartition(f'site-packages{os.sep}')
+    if marker:
+        return rest
+    stdlib = os.path.join(sysconfig.get_paths()['stdlib'], '')
+    return os.path.relpath(filename, stdlib) if filename.startswith(stdlib) else filename
+
+
+def _frame_label(code):
+    # ';' separates frames in the folded format
+    return f'{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})'.replace(';', ':')
+
+
+def fold(frame):
+    """The stack of ``frame`` as one folded line, outermost frame first"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class Sampler(threading.Thread):
+    """Counts the stacks of ``threads`` (idents; ``None`` for every other thread) every ``interval`` seconds"""
+
+    def __init__(self, interval, threads=None, exclude=()):
+        super().__init__(name='profiling-sampler', daemon=True)
+        self.interval = interval
+        self.threads = threads
+        self.exclude = set(exclude)
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            targets = None if self.threads is None else set(self.threads)
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident or ident in self.exclude:
+                    continue
+                if targets is None or ident in targets:
+                    self.stacks[fold(frame)] += 1
+            self.samples += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+def heap_report(baseline, snapshot, header):
+    """The growth from ``baseline`` to ``snapshot``: the top allocation sites, then the top tracebacks"""
+    ignored = (
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    )
+    baseline, snapshot = baseline.filter_traces(ignored), snapshot.filter_traces(ignored)
+    sites = snapshot.compare_to(baseline, 'lineno')
+    lines = [header, f'{sum(stat.size_diff for stat in sites) / 1024:+.1f} KiB in total', '']
+    for stat in sites[:HEAP_SITES]:
+        frame = stat.traceback[0]
+        lines.append(
+            f'{stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+8d} blocks  '
+            f'{stat.size / 1024:10.1f} KiB now  {_short_path(frame.filename)}:{frame.lineno}'
+        )
+    for stat in snapshot.compare_to(baseline, 'traceback')[:HEAP_TRACEBACKS]:
+        lines += ['', f'{stat.size_diff / 1024:+.1f} KiB in {stat.count_diff:+d} blocks allocated from:']
+        lines += [
+            f'  {_short_path(frame.filename)}:{frame.lineno}' for frame in reversed(stat.traceback)
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+def new_session(kind, requests=None, seconds=None, interval_ms=10):
+    """A session for ``start()``; raises ``ValueError`` on bad parameters"""
+    if kind not in KINDS:
+        raise ValueError(f'kind must be one of {", ".join(KINDS)}')
+    if requests is not None and requests < 1:
+        raise ValueError('requests must be positive')
+    if seconds is None:
+        seconds = settings.PROFILING_MAX_SECONDS if requests else 30
+    if not 0 < seconds <= settings.PROFILING_MAX_SECONDS:
+        raise ValueError(f'seconds must be between 0 and {settings.PROFILING_MAX_SECONDS}')
+    if not 1 <= interval_ms <= 1000:
+        raise ValueError('interval_ms must be between 1 and 1000')
+    return {
+        'id': uuid.uuid4().hex, 'kind': kind, 'requests': requests, 'seconds': seconds,
+        'interval_ms': interval_ms, 'ends': time.time() + seconds,
+    }
+
+
+def _session_path():
+    return os.path.join(settings.PROFILING_DIR, SESSION_FILE)
+
+
+def _read_session():
+    try:
+        with open(_session_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def start(session):
+    """Publish ``session`` to the workers; ``False`` if another one is running"""
+    path = _session_path()
+    running = _read_session()
+    if running is not None and running['ends'] <= time.time():
+        # An expired session nobody stopped
+        stop()
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    temporary = f'{path}.{session["id"]}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(session, f)
+    try:
+        # A hard link is created complete or not at all, and never over another session
+        os.link(temporary, path)
+    except FileExistsError:
+        return False
+    finally:
+        os.unlink(temporary)
+    return True
+
+
+def current():
+    """The running session, or ``None``"""
+    session = _read_session()
+    if session is None or session['ends'] <= time.time():
+        return None
+    return session
+
+
+def stop():
+    try:
+        os.unlink(_session_path())
+    except FileNotFoundError:
+        pass
+
+
+def profiles():
+    """``{session id: [file name, ...]}`` written on this host"""
+    if not os.path.isdir(settings.PROFILING_DIR):
+        return {}
+    return {
+        session: sorted(os.listdir(os.path.join(settings.PROFILING_DIR, session)))
+        for session in sorted(os.listdir(settings.PROFILING_DIR)) if SESSION_ID.match(session)
+    }
+
+
+def profile_path(session, name):
+    """The path of a profile, or ``None`` for names that are not ours"""
+    if not SESSION_ID.match(session) or not PROFILE_NAME.match(name):
+        return None
+    return os.path.join(settings.PROFILING_DIR, session, name)
+
+
+class Profiler:
+    """This worker's part in the current session"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def _ensure_process(self):
+        # After a fork the parent's sampler and timer threads are gone
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.checked = 0.0
+        self.seen = set()
+        self.active = None
+
+    def poll(self):
+        """Join a new session, or end one stopped; reads the session file every ``PROFILING_POLL_SECONDS``"""
+        now = time.monotonic()
+        if self.pid == os.getpid() and now - self.checked < settings.PROFILING_POLL_SECONDS:
+            return
+        with self.lock:
+            self._ensure_process()
+            self.checked = now
+        session = current()
+        with self.lock:
+            if self.active and (session is None or session['id'] != self.active['id']):
+                self._finish()
+            if session and session['id'] not in self.seen and session['ends'] > time.time():
+                self._begin(session)
+
+    def _begin(self, session):
+        self.seen.add(session['id'])
+        self.active = session
+        self.requests_left = session['requests']
+        self.handled = 0
+        self.started = time.monotonic()
+        self.timer = threading.Timer(max(session['ends'] - time.time(), 0), self._expire, args=(session['id'],))
+        self.timer.daemon = True
+        self.timer.start()
+        self.sampler = None
+        if session['kind'] == 'cpu':
+            self.sampler = Sampler(
+                session['interval_ms'] / 1000, threads=set() if session['requests'] else None,
+                exclude=(self.timer.ident,),
+            )
+            self.sampler.start()
+        else:
+            self.was_tracing = tracemalloc.is_tracing()
+            if not self.was_tracing:
+                tracemalloc.start(TRACEBACK_FRAMES)
+            self.baseline = tracemalloc.take_snapshot()
+        logger.info(f"Worker {self.pid} joined {session['kind']} profiling session {session['id']}")
+
+    def _expire(self, session_id):
+        with self.lock:
+            if self.active and self.active['id'] == session_id:
+                self._finish()
+
+    def _finish(self):
+        session, self.active = self.active, None
+        self.timer.cancel()
+        elapsed = time.monotonic() - self.started
+        directory = os.path.join(settings.PROFILING_DIR, session['id'])
+        if session['kind'] == 'cpu':
+            self.sampler.stop()
+            path, content = os.path.join(directory, f'{self.pid}.cpu.folded'), self.sampler.folded()
+        else:
+            snapshot = tracemalloc.take_snapshot()
+            if not self.was_tracing:
+                tracemalloc.stop()
+            header = f'Heap growth of worker {self.pid} over {elapsed:.1f} s and {self.handled} requests'
+            path, content = os.path.join(directory, f'{self.pid}.heap.txt'), heap_report(self.baseline, snapshot, header)
+            self.baseline = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(content)
+        except OSError as e:
+            logger.warning(f"Could not write the profile to {path}: {e}")
+            return
+        logger.info(f"Worker {self.pid} wrote {path} ({self.handled} requests in {elapsed:.1f} s)")
+
+    @contextmanager
+    def request(self):
+        """Around a request: profile it if the session is on the next requests"""
+        session = self.active
+        if session is None:
+            yield
+            return
+        ident = threading.get_ident()
+        sampler = self.sampler
+        if sampler is not None and sampler.threads is not None:
+            sampler.threads.add(ident)
+        try:
+            yield
+        finally:
+            if sampler is not None and sampler.threads is not None:
+                sampler.threads.discard(ident)
+            with self.lock:
+                if self.active is session:
+                    self.handled += 1
+                    if self.requests_left is not None:
+                        self.requests_left -= 1
+                        if self.requests_left == 0:
+                            self._finish()
+
+
+profiler = Profiler()
@@ -0,0 +1,189 @@
+"""
+Query plan audit for the hot queries behind the views.
+
+``hot_queries()`` lists the queries the catalog pages, the API and the feeds
+run on every request, built the same way the views build them. ``audit()``
+runs each through ``EXPLAIN`` on the default database and reports full table
+scans and sorts the database has to do itself (filesorts), with a composite
+index that would serve the query: its equality filters first, then its
+ordering. Queries no index can serve are listed in ``KNOWN_SCANS`` with the
+reason; their scans are expected and not flagged.
+
+``manage.py audit_queries`` prints the report; ``QueryPlanTests`` fails when
+a hot query regresses to a scan or a sort.
+"""
+import json
+import re
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import Count, Q
+from django.db.models.sql.where import AND, WhereNode
+from django.utils import timezone
+
+from .changes import _after
+from .models import Movie, MovieRating, MovieTombstone, Subscription, UserActivity, Watchlist, WatchProgress
+
+SCAN = 'full scan'
+FILESORT = 'filesort'
+
+# Hot queries that read every row whatever the indexes, and why
+KNOWN_SCANS = {
+    'api search': (
+        "substring matches (LIKE '%q%') over title, description, director and cast cannot use a "
+        "B-tree index; a FULLTEXT index or a search service would"
+    ),
+    'movie list page search': 'same substring matches as api search',
+    'movie statistics totals': 'counts, sums and averages over every movie, read in one pass',
+}
+
+
+def hot_queries():
+    """``{name: queryset}``, shaped like the queries the views run"""
+    user_id = movie_id = 1
+    now = timezone.now()
+    search = (
+        Q(title__icontains='dark') | Q(description__icontains='dark')
+        | Q(director__icontains='dark') | Q(cast__icontains='dark')
+    )
+    changes_since = (now - timedelta(hours=1), 0)
+    return {
+        'movie list page': Movie.objects.all(),
+        'movie list page by language': Movie.objects.filter(language='Tamil'),
+        'movie list page featured': Movie.objects.filter(is_featured=True),
+        'api movies': Movie.objects.all()[:20],
+        'api featured': Movie.objects.filter(is_featured=True),
+        'api trending': Movie.objects.filter(is_trending=True),
+        'movie list page search': Movie.objects.filter(search),
+        'api search': Movie.objects.filter(search),
+        'api changes': _after(Movie.objects.all(), 'updated_at', changes_since, now)[:501],
+        'api changes tombstones': _after(MovieTombstone.objects.all(), 'deleted_at', changes_since, now)[:501],
+        # The counts, Sum('view_count') and Avg('rating') read these columns of every row in one pass
+        'movie statistics totals': Movie.objects.order_by().values('is_featured', 'is_trending', 'view_count', 'rating'),
+        'movie statistics by language': Movie.objects.values('language').annotate(count=Count('id')).order_by(),
+        'api watchlist': Watchlist.objects.filter(user_id=user_id),
+        'api activity': UserActivity.objects.filter(user_id=user_id)[:50],
+        'api continue watching': WatchProgress.objects.filter(user_id=user_id, completed=False)[:20],
+        'home feed watchlist row': Watchlist.objects.filter(user_id=user_id).order_by('-added_at')[:20],
+        'subscription check': Subscription.objects.filter(user_id=user_id),
+        'movie detail ratings': MovieRating.objects.filter(movie_id=movie_id),
+    }
+
+
+# Plan parsing, per backend
+
+def _sqlite_findings(queryset):
+    findings = []
+    for line in queryset.explain().splitlines():
+        scan = re.search(r'\bSCAN (?:TABLE )?(\S+)(.*)', line)
+        if scan and 'USING' not in scan.group(2):
+            findings.append((SCAN, scan.group(1)))
+        if 'USE TEMP B-TREE FOR ORDER BY' in line:
+            findings.append((FILESORT, None))
+    return findings
+
+
+def _walk(node):
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk(value)
+
+
+def _mysql_findings(queryset):
+    findings = []
+    for node in _walk(json.loads(queryset.explain(format='json'))):
+        if node.get('access_type') == 'ALL':
+            findings.append((SCAN, node.get('table_name')))
+        if node.get('using_filesort'):
+            findings.append((FILESORT, node.get('table', {}).get('table_name')))
+    return findings
+
+
+def _postgresql_findings(queryset):
+    findings = []
+    for node in _walk(json.loads(queryset.explain(format='json'))):
+        if node.get('Node Type') == 'Seq Scan':
+            findings.append((SCAN, node.get('Relation Name')))
+        if node.get('Node Type') in ('Sort', 'Incremental Sort'):
+            findings.append((FILESORT, None))
+    return findings
+
+
+PLAN_PARSERS = {
+    'sqlite': _sqlite_findings,
+    'mysql': _mysql_findings,
+    'postgresql': _postgresql_findings,
+}
+
+
+def plan_findings(queryset):
+    """``[(SCAN or FILESORT, table or None)]`` from the query's EXPLAIN"""
+    try:
+        parser = PLAN_PARSERS[connection.vendor]
+    except KeyError:
+        raise NotImplementedError(f'No plan parser for {connection.vendor}')
+    return parser(queryset)
+
+
+# Index proposals
+
+def _lookups(where):
+    """The column lookups of an AND-only WHERE tree"""
+    if where.connector != AND or where.negated:
+        return
+    for child in where.children:
+        if isinstance(child, WhereNode):
+            yield from _lookups(child)
+        elif hasattr(child, 'lhs') and hasattr(child.lhs, 'target'):
+            yield child.lookup_name, child.lhs.target
+
+
+def suggest_index(queryset):
+    """
+    Field names of a composite index for ``queryset``: columns compared for
+    equality, then the ordering (or the first range-filtered column when the
+    query is unordered). ``None`` when there is nothing to index.
+    """
+    query = queryset.query
+    model = query.model
+    equal, ranged = [], []
+    for lookup_name, field in _lookups(query.where):
+        if field.model is not model:
+            continue
+        names = equal if lookup_name in ('exact', 'in', 'isnull') else ranged
+        if field.name not in equal + ranged:
+            names.append(field.name)
+
+    ordering = query.order_by or (query.default_ordering and model._meta.ordering) or ()
+    ordering = [name for name in ordering if isinstance(name, str) and '__' not in name and name != '?']
+
+    fields, seen = [], set()
+    for name in equal + (ordering or ranged[:1]):
+        column = name.lstrip('-')
+        if column not in seen and column != 'pk':
+            seen.add(column)
+            fields.append(name)
+    if not fields or fields == ['id']:
+        return None
+    return fields
+
+
+def index_name(model, fields):
+    """A name for an index on ``fields`` within the 30 character limit"""
+    columns = '_'.join(name.lstrip('-') for name in fields)
+    return f'{model._meta.model_name[:8]}_{columns}'[:26].rstrip('_') + '_idx'
+
+
+def audit(queries=None):
+    """``[(name, queryset, findings, proposed index fields)]`` for the hot queries"""
+    report = []
+    for name, queryset in (queries or hot_queries()).items():
+        findings = plan_findings(queryset)
+        if name in KNOWN_SCANS:
+            findings = [(kind, table) for kind, table in findings if kind != SCAN]
+        report.append((name, queryset, findings, suggest_index(queryset) if findings else None))
+    return report
@@ -0,0 +1,233 @@
+"""
+N+1 and slow query detection per request.
+
+While a request is inspected (``QueryInspectorMiddleware`` with
+``QUERY_INSPECTOR`` on, or ``inspect()`` directly), every query is recorded
+with its fingerprint, the SQL with literals and ``IN`` lists collapsed so
+that the queries of a loop over rows look the same, its time, and where it
+came from: the innermost line of our own code that ran it and, while a
+template renders, the template line.
+
+Afterwards two kinds of offenders are flagged:
+
+* ``repeated``: one fingerprint run ``QUERY_INSPECTOR_REPEAT`` times or more
+  in the request, the signature of an N+1 (a query per row of a list)
+* ``slow``: a query over ``QUERY_INSPECTOR_SLOW_MS``
+
+``Report`` ranks offenders per view by the time they cost. ``manage.py
+inspect_queries`` requests the main endpoints and compares the report with a
+baseline; ``QueryInspectorTests`` fails the test suite when an endpoint gains
+an offender.
+"""
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+REPEATED = 'repeated'
+SLOW = 'slow'
+
+_current = ContextVar('query_inspection', default=None)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\((?:\s*(?:%s|\?|\$\d+|NULL)\s*,?)+\)', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+
+# Our code, but not the machinery recording the query
+_PROJECT_DIR = os.path.join(str(settings.BASE_DIR), '')
+_SKIPPED_FILES = ('query_inspector.py', 'metrics.py', 'middleware.py', 'manage.py')
+
+
+def fingerprint(sql):
+    """``sql`` with literals replaced by ``?`` and ``IN`` lists collapsed, for grouping queries by shape"""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def _origin():
+    """Where the running query comes from: ``file:line in function``, and the template line rendering"""
+    code = template = None
+    frame = sys._getframe(2)
+    while frame is not None and not (code and template):
+        filename = frame.f_code.co_filename
+        if template is None and frame.f_code.co_name == 'render_annotated' and filename.endswith(
+            os.path.join('django', 'template', 'base.py')
+        ):
+            node = frame.f_locals.get('self')
+            origin, token = getattr(node, 'origin', None), getattr(node, 'token', None)
+            if origin is not None and token is not None:
+                template = f'{origin.template_name}:{token.lineno}'
+        if (
+            code is None and filename.startswith(_PROJECT_DIR) and 'site-packages' not in filename
+            and not filename.endswith(_SKIPPED_FILES)
+        ):
+            code = f'{os.path.relpath(filename, _PROJECT_DIR)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    location = code or 'unknown'
+    return f'{location} (template {template})' if template else location
+
+
+class Inspection:
+    """The queries of one request: ``(fingerprint, sql, ms, origin)``"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = []
+
+    def add(self, sql, ms, origin):
+        with self.lock:
+            self.queries.append((fingerprint(sql), sql, ms, origin))
+
+    def offenders(self, repeat=None, slow_ms=None):
+        """``[{kind, fingerprint, count, ms, origin, sql}]``; ``ms`` is the time of all the matching queries"""
+        repeat = settings.QUERY_INSPECTOR_REPEAT if repeat is None else repeat
+        slow_ms = settings.QUERY_INSPECTOR_SLOW_MS if slow_ms is None else slow_ms
+        groups = defaultdict(list)
+        for query in self.queries:
+            groups[query[0]].append(query)
+
+        offenders = []
+        for shape, queries in groups.items():
+            if len(queries) >= repeat:
+                # The most frequent origin is the loop
+                origins = defaultdict(int)
+                for _, _, _, origin in queries:
+                    origins[origin] += 1
+                offenders.append({
+                    'kind': REPEATED, 'fingerprint': shape, 'count': len(queries),
+                    'ms': round(sum(ms for _, _, ms, _ in queries), 2),
+                    'origin': max(origins, key=origins.get), 'sql': queries[0][1],
+                })
+            slow = [query for query in queries if query[2] >= slow_ms]
+            if slow:
+                offenders.append({
+                    'kind': SLOW, 'fingerprint': shape, 'count': len(slow),
+                    'ms': round(sum(ms for _, _, ms, _ in slow), 2),
+                    'origin': slow[0][3], 'sql': slow[0][1],
+                })
+        return offenders
+
+
+@contextmanager
+def inspect():
+    """Record the queries run inside the block; yields the ``Inspection``"""
+    inspection = Inspection()
+    token = _current.set(inspection)
+    try:
+        yield inspection
+    finally:
+        _current.reset(token)
+
+
+def _record_query(execute, sql, params, many, context):
+    inspection = _current.get()
+    if inspection is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        inspection.add(sql, (time.perf_counter() - started) * 1000, _origin())
+
+
+@receiver(connection_created)
+def inspect_connection(sender, connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class Report:
+    """Offenders across requests, per view"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # view -> (kind, fingerprint) -> totals
+        self.views = defaultdict(dict)
+
+    def add(self, view, offenders):
+        with self.lock:
+            for offender in offenders:
+                entry = self.views[view].setdefault((offender['kind'], offender['fingerprint']), {
+                    'kind': offender['kind'], 'fingerprint': offender['fingerprint'], 'origin': offender['origin'],
+                    'sql': offender['sql'], 'requests': 0, 'max_count': 0, 'ms': 0.0,
+                })
+                entry['requests'] += 1
+                entry['max_count'] = max(entry['max_count'], offender['count'])
+                entry['ms'] = round(entry['ms'] + offender['ms'], 2)
+
+    def ranked(self):
+        """``{view: [offender, ...]}``, the costliest views and offenders first"""
+        views = {view: sorted(entries.values(), key=lambda entry: -entry['ms']) for view, entries in self.views.items()}
+        return dict(sorted(views.items(), key=lambda item: -sum(entry['ms'] for entry in item[1])))
+
+    def new_offenders(self, baseline):
+        """``(view, offender)`` pairs not in ``baseline`` (a ``ranked()`` result), matched by kind and fingerprint"""
+        known = {
+            (view, entry['kind'], entry['fingerprint']) for view, entries in baseline.items() for entry in entries
+        }
+        return [
+            (view, entry) for view, entries in self.ranked().items() for entry in entries
+            if (view, entry['kind'], entry['fingerprint']) not in known
+        ]
+
+    def write(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.ranked(), f, indent=2)
+            f.write('\n')
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unmatched'
+
+
+report = Report()
+
+
+def main_requests(movie_id, term):
+    """The GET requests behind the main pages and the API, for ``inspect_requests()``"""
+    return [
+        '/movie_list/', '/movie_tamil/', '/movie_english/', '/view/', f'/search2/?data={term}',
+        '/api/movies/', '/api/movies/?page=2', f'/api/movies/{movie_id}/', f'/api/movies/search/?q={term}',
+        '/api/movies/featured/', '/api/movies/trending/', '/api/movies/changes/',
+        f'/api/movies/{movie_id}/progress/', '/api/users/me/', '/api/users/watchlist/',
+        '/api/users/continue_watching/', '/api/users/activity/', '/api/users/activity/summary/',
+        '/api/home/', '/api/statistics/', '/api/async/movies/', f'/api/async/movies/{movie_id}/',
+    ]
+
+
+def inspect_requests(client, paths, repeat=None, slow_ms=None):
+    """
+    Request each of ``paths`` with a test ``client`` under inspection; returns
+    the ``Report`` and the paths that did not answer 2xx/3xx. A failed request
+    is left out of the report, its queries include the error page's.
+    ``repeat`` and ``slow_ms`` default to the settings, as in ``offenders()``.
+    """
+    run = Report()
+    failed = []
+    for path in paths:
+        with inspect() as inspection:
+            response = client.get(path)
+        if response.status_code >= 400:
+            failed.append((path, response.status_code))
+            continue
+        run.add(view_name(response.wsgi_request), inspection.offenders(repeat, slow_ms))
+    return run, failed
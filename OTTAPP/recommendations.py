@@ -0,0 +1,307 @@
+"""
+Item-to-item recommendations ("because you watched").
+
+The offline job (``manage.py build_recommendations``) turns watchlist entries,
+ratings and movie views into a sparse user x movie matrix, computes cosine
+similarities between movies in blocks across a process pool and writes the
+top-K neighbours of every movie into a single ``.npy`` file.
+
+Web workers open that file with ``mmap_mode='r'`` so every gunicorn worker
+shares the same pages from the OS page cache instead of holding its own copy.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.db import connections
+
+from .activity import movie_view_counts
+from .models import Movie, Watchlist, MovieRating
+
+logger = logging.getLogger(__name__)
+
+# Interaction weights
+WATCHLIST_WEIGHT = 1.0
+VIEW_WEIGHT = 0.5
+RATING_WEIGHT = 0.2  # per rating point, so a 10/10 counts as 2.0
+
+# Only the strongest interactions of very active users are kept, otherwise a
+# handful of heavy users dominate the co-occurrence counts (and the memory).
+MAX_ITEMS_PER_USER = 200
+
+# Size of the dense similarity block (rows x movies) computed at once
+BLOCK_CELLS = 4_000_000
+# Upper bound on the number of co-occurrence pairs expanded at once
+MAX_PAIRS = 8_000_000
+
+# How often readers check whether the index file has been rebuilt
+INDEX_RELOAD_INTERVAL = 5.0
+
+
+def index_dtype(top_k):
+    """Record layout of the neighbour index file"""
+    return np.dtype([
+        ('movie_id', '<i8'),
+        ('neighbours', '<i8', (top_k,)),
+        ('scores', '<f4', (top_k,)),
+    ])
+
+
+# Building the index
+
+def load_interactions():
+    """Return (user_ids, movie_ids, weights) arrays for every interaction"""
+    users, movies, weights = [], [], []
+
+    for user_id, movie_id in Watchlist.objects.values_list('user_id', 'movie_id').iterator(chunk_size=10000):
+        users.append(user_id)
+        movies.append(movie_id)
+        weights.append(WATCHLIST_WEIGHT)
+
+    ratings = MovieRating.objects.values_list('user_id', 'movie_id', 'rating')
+    for user_id, movie_id, rating in ratings.iterator(chunk_size=10000):
+        users.append(user_id)
+        movies.append(movie_id)
+        weights.append(RATING_WEIGHT * rating)
+
+    for user_id, movie_id, count in movie_view_counts():
+        users.append(user_id)
+        movies.append(movie_id)
+        weights.append(VIEW_WEIGHT * np.log1p(count))
+
+    return (
+        np.asarray(users, dtype=np.int64),
+        np.asarray(movies, dtype=np.int64),
+        np.asarray(weights, dtype=np.float32),
+    )
+
+
+def build_matrix(user_ids, movie_ids, weights, catalog_ids):
+    """
+    Build the sparse user x movie matrix in CSR form (rows are users) plus the
+    same entries grouped by movie. ``catalog_ids`` must be sorted.
+    """
+    n_items = len(catalog_ids)
+
+    # Map movie ids onto column numbers, dropping movies that no longer exist
+    if n_items:
+        cols = np.minimum(np.searchsorted(catalog_ids, movie_ids), n_items - 1)
+        known = catalog_ids[cols] == movie_ids
+    else:
+        cols = np.zeros(len(movie_ids), dtype=np.int64)
+        known = np.zeros(len(movie_ids), dtype=bool)
+    user_ids, cols, weights = user_ids[known], cols[known], weights[known]
+
+    _, rows = np.unique(user_ids, return_inverse=True)
+    n_users = int(rows.max()) + 1 if len(rows) else 0
+
+    # Sum duplicate (user, movie) cells
+    cells, inverse = np.unique(rows * n_items + cols, return_inverse=True)
+    data = np.bincount(inverse, weights=weights).astype(np.float32)
+    rows, cols = cells // n_items, cells % n_items
+
+    # Keep each user's strongest interactions only
+    order = np.lexsort((-data, rows))
+    rows, cols, data = rows[order], cols[order], data[order]
+    row_starts = np.searchsorted(rows, np.arange(n_users))
+    rank = np.arange(len(rows)) - row_starts[rows]
+    keep = rank < MAX_ITEMS_PER_USER
+    rows, cols, data = rows[keep], cols[keep], data[keep]
+
+    user_indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=n_users))))
+
+    by_item = np.argsort(cols, kind='stable')
+    item_indptr = np.concatenate(([0], np.cumsum(np.bincount(cols, minlength=n_items))))
+
+    norms = np.sqrt(np.bincount(cols, weights=data.astype(np.float64) ** 2, minlength=n_items))
+
+    return {
+        'n_items': n_items,
+        'user_indptr': user_indptr,
+        'user_cols': cols,
+        'user_data': data,
+        'item_indptr': item_indptr,
+        'item_rows': rows[by_item],
+        'item_data': data[by_item],
+        'norms': norms,
+    }
+
+
+_worker_matrix = None
+
+
+def _init_worker(matrix):
+    global _worker_matrix
+    _worker_matrix = matrix
+
+
+def similarity_block(matrix, start, stop, top_k):
+    """
+    Cosine similarities of movies ``start:stop`` against the whole catalog.
+
+    Returns ``(neighbours, scores)`` where neighbours are column numbers
+    (-1 for padding) ordered by descending score.
+    """
+    n_items = matrix['n_items']
+    size = stop - start
+    acc = np.zeros(size * n_items, dtype=np.float64)
+
+    lo, hi = matrix['item_indptr'][start], matrix['item_indptr'][stop]
+    users = matrix['item_rows'][lo:hi]
+    item_weights = matrix['item_data'][lo:hi]
+    items = np.repeat(
+        np.arange(size), np.diff(matrix['item_indptr'][start:stop + 1])
+    )
+
+    user_indptr = matrix['user_indptr']
+    lengths = user_indptr[users + 1] - user_indptr[users]
+    ends = np.cumsum(lengths)
+
+    # Expand every (movie, user) entry against that user's whole history,
+    # in slices so that very popular movies do not blow up memory.
+    first = 0
+    while first < len(users):
+        base = ends[first - 1] if first else 0
+        last = max(int(np.searchsorted(ends, base + MAX_PAIRS, side='right')), first + 1)
+
+        lens = lengths[first:last]
+        total = int(lens.sum())
+        if total:
+            owner = np.repeat(np.arange(first, last), lens)
+            offsets = np.arange(total) - np.repeat(np.cumsum(lens) - lens, lens)
+            positions = user_indptr[users[owner]] + offsets
+            cols = matrix['user_cols'][positions]
+            values = item_weights[owner] * matrix['user_data'][positions]
+            acc += np.bincount(items[owner] * n_items + cols, weights=values, minlength=size * n_items)
+        first = last
+
+    sims = acc.reshape(size, n_items)
+    norms = matrix['norms']
+    denom = np.outer(norms[start:stop], norms)
+    np.divide(sims, denom, out=sims, where=denom > 0)
+    sims[np.arange(size), np.arange(start, stop)] = 0.0
+
+    k = min(top_k, n_items - 1) if n_items > 1 else 0
+    neighbours = np.full((size, top_k), -1, dtype=np.int64)
+    scores = np.zeros((size, top_k), dtype=np.float32)
+    if k:
+        best = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(sims, best, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best = np.take_along_axis(best, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best[best_scores <= 0] = -1
+        neighbours[:, :k] = best
+        scores[:, :k] = np.maximum(best_scores, 0)
+    return neighbours, scores
+
+
+def _compute_block(args):
+    start, stop, top_k = args
+    neighbours, scores = similarity_block(_worker_matrix, start, stop, top_k)
+    return start, neighbours, scores
+
+
+def build_index(path=None, top_k=None, workers=None):
+    """Rebuild the neighbour index file and return the number of movies in it"""
+    path = path or settings.RECOMMENDATIONS_INDEX_PATH
+    top_k = top_k or settings.RECOMMENDATIONS_TOP_K
+    workers = os.cpu_count() if workers is None else workers
+
+    started = time.monotonic()
+    catalog_ids = np.fromiter(
+        Movie.objects.order_by('id').values_list('id', flat=True).iterator(), dtype=np.int64
+    )
+    matrix = build_matrix(*load_interactions(), catalog_ids)
+    n_items = matrix['n_items']
+    logger.info(
+        "Built %d x %d interaction matrix with %d entries",
+        len(matrix['user_indptr']) - 1, n_items, len(matrix['user_data'])
+    )
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    index = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=index_dtype(top_k), shape=(n_items,))
+    index['movie_id'] = catalog_ids
+
+    def store(start, neighbours, scores):
+        padded = neighbours < 0
+        ids = catalog_ids[np.where(padded, 0, neighbours)] if n_items else neighbours
+        index['neighbours'][start:start + len(neighbours)] = np.where(padded, -1, ids)
+        index['scores'][start:start + len(neighbours)] = scores
+
+    block = max(1, BLOCK_CELLS // max(n_items, 1))
+    tasks = [(start, min(start + block, n_items), top_k) for start in range(0, n_items, block)]
+
+    if workers and workers > 1 and len(tasks) > 1:
+        # Forked workers must not share the parent's database sockets
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(matrix,)) as pool:
+            for start, neighbours, scores in pool.map(_compute_block, tasks):
+                store(start, neighbours, scores)
+    else:
+        for start, stop, k in tasks:
+            store(start, *similarity_block(matrix, start, stop, k))
+
+    index.flush()
+    del index
+    os.replace(tmp_path, path)
+    logger.info("Wrote %d movie neighbour lists to %s in %.1fs", n_items, path, time.monotonic() - started)
+    return n_items
+
+
+# Serving the index
+
+class NeighbourIndex:
+    """Read-only view over the memory-mapped neighbour index"""
+
+    def __init__(self, path):
+        self.path = path
+        self._rows = None
+        self._ids = None
+        self._stamp = None
+        self._checked_at = 0.0
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._rows is not None and now - self._checked_at < INDEX_RELOAD_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._rows = self._ids = self._stamp = None
+            return
+        stamp = (stat.st_ino, stat.st_mtime_ns)
+        if stamp != self._stamp:
+            rows = np.load(self.path, mmap_mode='r')
+            # The id column is small; keep a contiguous copy for fast lookups
+            self._ids = np.ascontiguousarray(rows['movie_id'])
+            self._rows = rows
+            self._stamp = stamp
+
+    def neighbours(self, movie_id, limit=None):
+        """Return ``[(movie_id, score), ...]`` or None if the movie is not indexed"""
+        self._refresh()
+        if self._rows is None:
+            return None
+        pos = int(np.searchsorted(self._ids, movie_id))
+        if pos >= len(self._ids) or self._ids[pos] != movie_id:
+            return None
+        row = self._rows[pos]
+        ids, scores = row['neighbours'][:limit], row['scores'][:limit]
+        return [(int(i), float(s)) for i, s in zip(ids.tolist(), scores.tolist()) if i >= 0]
+
+
+_indexes = {}
+
+
+def get_neighbour_index(path=None):
+    """Process-wide NeighbourIndex for ``path`` (defaults to the configured index)"""
+    path = path or settings.RECOMMENDATIONS_INDEX_PATH
+    if path not in _indexes:
+        _indexes[path] = NeighbourIndex(path)
+    return _indexes[path]
@@ -0,0 +1,118 @@
+import datetime
+import decimal
+import re
+import uuid
+
+from django.utils.cache import patch_vary_headers
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # optional, falls back to the standard library encoder
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional, MessagePack is not offered without it
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # optional, CBOR is not offered without it
+    cbor2 = None
+
+
+# orjson writes exponent floats differently from json.dumps ("1e16" vs
+# "1e+16", "0.00001" vs "1e-05"). Such rare outputs are re-rendered with the
+# standard encoder so the bytes always match JSONRenderer. Only number tokens
+# (after ':', ',' or '[') are checked, so text like "Se7en" stays on the fast path.
+_EXPONENT_FLOAT = re.compile(rb'[:,\[]-?(?:\d+(?:\.\d+)?e|0\.0000)')
+
+
+def _vary_on_accept(renderer_context):
+    # The same URL can be rendered as JSON, MessagePack or CBOR
+    response = (renderer_context or {}).get('response')
+    if response is not None:
+        patch_vary_headers(response, ['Accept'])
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it is installed. Compact output
+    is byte-identical to JSONRenderer; indented output uses JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        _vary_on_accept(renderer_context)
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS,
+            )
+        except (orjson.JSONEncodeError, TypeError):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        if _EXPONENT_FLOAT.search(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class BinaryRenderer(BaseRenderer):
+    """
+    Base for binary formats carrying the same data as the JSON API. Values
+    without a native representation (datetimes outside serializers, Decimal,
+    UUID, lazy strings...) are converted exactly as JSONRenderer converts them.
+    """
+    charset = None
+    render_style = 'binary'
+    available = False
+
+    def default(self, obj):
+        return JSONEncoder().default(obj)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        _vary_on_accept(renderer_context)
+        if data is None:
+            return b''
+        return self.encode(data)
+
+
+class MessagePackRenderer(BinaryRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    available = msgpack is not None
+
+    def encode(self, data):
+        return msgpack.packb(data, default=self.default, use_bin_type=True)
+
+
+class CBORRenderer(BinaryRenderer):
+    media_type = 'application/cbor'
+    format = 'cbor'
+    available = cbor2 is not None
+
+    # Types CBOR has tags for, converted like JSON instead so both formats match
+    converted_types = (datetime.datetime, datetime.date, datetime.time, datetime.timedelta, decimal.Decimal, uuid.UUID)
+
+    def encode(self, data):
+        encoders = dict.fromkeys(self.converted_types, self._encode_as_json)
+        return cbor2.dumps(data, default=self._encode_as_json, encoders=encoders)
+
+    def _encode_as_json(self, encoder, value):
+        encoder.encode(self.default(value))
+
+
+class AvailableRendererNegotiation(DefaultContentNegotiation):
+    """Content negotiation that skips renderers whose encoder is not installed"""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        renderers = [renderer for renderer in renderers if getattr(renderer, 'available', True)]
+        return super().select_renderer(request, renderers, format_suffix)
@@ -1,15 +1,141 @@
+from datetime import datetime, time
+
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import UserProfile, Movie, Genre, Subscription, Watchlist, MovieRating, UserActivity
+from django.utils import timezone
+from django.db.models import Prefetch
+from .metrics import TimedSerializerMixin
+from .models import (
+    UserProfile, Movie, Genre, Subscription, Watchlist, MovieRating, UserActivity, UserActivityRollup, WatchProgress
+)
+
+
+def parse_fields(value):
+    """
+    Parse a ``?fields=`` / ``?expand=`` value into a tree:
+    ``'id,title,genre.name'`` -> ``{'id': None, 'title': None, 'genre': {'name': None}}``
+    """
+    tree = {}
+    for path in value.split(','):
+        names = [name.strip() for name in path.split('.')]
+        if not all(names):
+            continue
+        node = tree
+        for name in names[:-1]:
+            if node.get(name) is None:
+                node[name] = {}
+            node = node[name]
+        node.setdefault(names[-1], None)
+    return tree
+
+
+class SparseFieldsMixin:
+    """
+    Serializer mixin for sparse fieldsets and expansion.
+
+    ``fields`` limits the output to the given fields (and nested fields).
+    ``expand`` chooses which relations of ``Meta.expandable_fields`` are
+    nested objects; the others are returned as primary keys. Without
+    ``expand`` the relations in ``Meta.default_expand`` are nested, which is
+    the serializer's normal output.
+
+    ``optimize()`` prunes a queryset to the columns, joins and prefetches the
+    remaining fields need.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        expandable = getattr(self.Meta, 'expandable_fields', {})
+        if expand is None:
+            expand = dict.fromkeys(getattr(self.Meta, 'default_expand', ()))
+
+        for name, (serializer_class, options) in expandable.items():
+            wanted = name in fields if fields is not None else (name in self.fields or name in expand)
+            if not wanted:
+                continue
+            if name in expand:
+                self.fields[name] = serializer_class(
+                    read_only=True,
+                    fields=(fields or {}).get(name),
+                    expand=expand[name],
+                    **options
+                )
+            else:
+                self.fields[name] = serializers.PrimaryKeyRelatedField(read_only=True, **options)
+
+        if fields is not None:
+            for name in list(self.fields):
+                if name not in fields:
+                    self.fields.pop(name)
 
+    def _query_plan(self, prefix=''):
+        """``(columns or None for all, select_related, prefetches)`` for the current fields"""
+        opts = self.Meta.model._meta
+        columns, select, prefetch = [prefix + opts.pk.name], [], []
+        for field in self.fields.values():
+            if field.write_only:
+                continue
+            source = field.source
+            model_field = opts.get_field(source) if source in _field_names(opts) else None
+            if model_field is None:
+                # Method fields and properties may read anything on the row
+                columns = None
+                continue
 
-class GenreSerializer(serializers.ModelSerializer):
+            if isinstance(field, serializers.ListSerializer) and isinstance(field.child, SparseFieldsMixin):
+                prefetch.append(Prefetch(prefix + source, queryset=field.child.optimize(
+                    field.child.Meta.model.objects.all()
+                )))
+            elif isinstance(field, serializers.ListSerializer):
+                prefetch.append(prefix + source)
+            elif isinstance(field, serializers.ManyRelatedField):
+                if isinstance(field.child_relation, serializers.PrimaryKeyRelatedField):
+                    related = model_field.related_model
+                    prefetch.append(Prefetch(prefix + source, queryset=related.objects.only(related._meta.pk.name)))
+                else:
+                    prefetch.append(prefix + source)
+            elif isinstance(field, SparseFieldsMixin):
+                nested_columns, nested_select, nested_prefetch = field._query_plan(f'{prefix}{source}__')
+                select.append(prefix + source)
+                select.extend(nested_select)
+                prefetch.extend(nested_prefetch)
+                if columns is not None:
+                    if model_field.concrete:
+                        columns.append(prefix + source)
+                    columns = None if nested_columns is None else columns + nested_columns
+            elif model_field.concrete:
+                if columns is not None:
+                    columns.append(prefix + source)
+            else:
+                # Reverse one-to-one as a primary key
+                select.append(prefix + source)
+                if columns is not None:
+                    columns.append(f'{prefix}{source}__{model_field.related_model._meta.pk.name}')
+        return columns, select, prefetch
+
+    def optimize(self, queryset):
+        """Limit ``queryset`` to what the current fields read"""
+        columns, select, prefetch = self._query_plan()
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        if columns is not None:
+            queryset = queryset.only(*columns)
+        return queryset
+
+
+def _field_names(opts):
+    return {field.name for field in opts.get_fields()}
+
+
+class GenreSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Genre
         fields = ['id', 'name', 'description', 'created_at']
 
 
-class MovieSerializer(serializers.ModelSerializer):
+class MovieSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     genre = GenreSerializer(many=True, read_only=True)
     genre_ids = serializers.PrimaryKeyRelatedField(
         queryset=Genre.objects.all(),
@@ -27,9 +153,11 @@ class MovieSerializer(serializers.ModelSerializer):
             'view_count', 'created_at', 'updated_at'
         ]
         read_only_fields = ['view_count', 'created_at', 'updated_at']
+        expandable_fields = {'genre': (GenreSerializer, {'many': True})}
+        default_expand = ['genre']
 
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = UserProfile
         fields = [
@@ -39,16 +167,18 @@ class UserProfileSerializer(serializers.ModelSerializer):
         read_only_fields = ['is_verified', 'created_at', 'updated_at']
 
 
-class UserSerializer(serializers.ModelSerializer):
-    profile = UserProfileSerializer(read_only=True)
+class UserSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    profile = UserProfileSerializer(source='userprofile', read_only=True)
     
     class Meta:
         model = User
         fields = ['id', 'username', 'first_name', 'last_name', 'email', 'profile']
         read_only_fields = ['id', 'username']
+        expandable_fields = {'profile': (UserProfileSerializer, {'source': 'userprofile'})}
+        default_expand = ['profile']
 
 
-class SubscriptionSerializer(serializers.ModelSerializer):
+class SubscriptionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     is_subscription_active = serializers.ReadOnlyField()
     
     class Meta:
@@ -61,7 +191,7 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'start_date', 'created_at', 'updated_at']
 
 
-class WatchlistSerializer(serializers.ModelSerializer):
+class WatchlistSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     movie = MovieSerializer(read_only=True)
     movie_id = serializers.IntegerField(write_only=True)
     
@@ -69,9 +199,27 @@ class WatchlistSerializer(serializers.ModelSerializer):
         model = Watchlist
         fields = ['id', 'movie', 'movie_id', 'added_at']
         read_only_fields = ['id', 'added_at']
+        expandable_fields = {'movie': (MovieSerializer, {})}
+        default_expand = ['movie']
+
+
+class ResumeMovieSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Movie card for resuming; no relations, so a progress list is a single query"""
+    
+    class Meta:
+        model = Movie
+        fields = ['id', 'title', 'thumbnail', 'language', 'duration', 'certification']
+
+
+class WatchProgressSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    movie = ResumeMovieSerializer(read_only=True)
+    
+    class Meta:
+        model = WatchProgress
+        fields = ['movie', 'position', 'updated_at']
 
 
-class MovieRatingSerializer(serializers.ModelSerializer):
+class MovieRatingSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     movie = MovieSerializer(read_only=True)
     
@@ -81,7 +229,7 @@ class MovieRatingSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'user', 'created_at', 'updated_at']
 
 
-class UserActivitySerializer(serializers.ModelSerializer):
+class UserActivitySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     movie = MovieSerializer(read_only=True)
     
@@ -94,7 +242,42 @@ class UserActivitySerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'user', 'created_at']
 
 
-class MovieListSerializer(serializers.ModelSerializer):
+class UserActivityRollupSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """A day of activity past retention, shaped like UserActivitySerializer plus its count"""
+    user = UserSerializer(read_only=True)
+    movie = MovieSerializer(read_only=True)
+    id = serializers.SerializerMethodField()
+    description = serializers.SerializerMethodField()
+    ip_address = serializers.SerializerMethodField()
+    user_agent = serializers.SerializerMethodField()
+    created_at = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UserActivityRollup
+        fields = [
+            'id', 'user', 'activity_type', 'description', 'movie',
+            'ip_address', 'user_agent', 'created_at', 'count'
+        ]
+
+    def get_id(self, obj):
+        return None
+
+    def get_description(self, obj):
+        return f"{obj.get_activity_type_display()} x{obj.count} (rolled up)"
+
+    def get_ip_address(self, obj):
+        return None
+
+    def get_user_agent(self, obj):
+        return ''
+
+    def get_created_at(self, obj):
+        # The start of the local day the events happened on
+        day_start = timezone.make_aware(datetime.combine(obj.day, time.min))
+        return serializers.DateTimeField().to_representation(day_start)
+
+
+class MovieListSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Simplified serializer for movie lists"""
     genre_names = serializers.StringRelatedField(source='genre', many=True, read_only=True)
     
@@ -104,9 +287,10 @@ class MovieListSerializer(serializers.ModelSerializer):
             'id', 'title', 'thumbnail', 'language', 'genre_names',
             'rating', 'certification', 'is_featured', 'is_trending'
         ]
+        expandable_fields = {'genre': (GenreSerializer, {'many': True})}
 
 
-class MovieDetailSerializer(serializers.ModelSerializer):
+class MovieDetailSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Detailed serializer for individual movie pages"""
     genre = GenreSerializer(many=True, read_only=True)
     average_rating = serializers.SerializerMethodField()
@@ -120,6 +304,8 @@ class MovieDetailSerializer(serializers.ModelSerializer):
             'director', 'cast', 'trailer_url', 'is_featured', 'is_trending',
             'view_count', 'average_rating', 'total_ratings', 'created_at', 'updated_at'
         ]
+        expandable_fields = {'genre': (GenreSerializer, {'many': True})}
+        default_expand = ['genre']
     
     def get_average_rating(self, obj):
         ratings = MovieRating.objects.filter(movie=obj)
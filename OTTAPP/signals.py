@@ -0,0 +1,102 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import catalog_version
+from .models import Genre, Movie, MovieTombstone, PlaybackSession, UserActivity, UserActivityRollup
+
+
+# Catalog versions (see catalog_version.py)
+
+@receiver(pre_save, sender=Movie)
+def remember_movie_scopes(sender, instance, raw=False, **kwargs):
+    """A movie leaving a list changes that list too, so keep the old scopes"""
+    instance._previous_scopes = set()
+    if instance.pk and not raw:
+        previous = (
+            Movie.objects
+            .filter(pk=instance.pk)
+            .values('language', 'is_featured', 'is_trending')
+            .first()
+        )
+        if previous:
+            instance._previous_scopes = catalog_version.movie_scopes(**previous)
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+def movie_changed(sender, instance, **kwargs):
+    scopes = catalog_version.movie_scopes(instance.language, instance.is_featured, instance.is_trending)
+    catalog_version.bump(*scopes, *getattr(instance, '_previous_scopes', ()))
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def genre_changed(sender, instance, **kwargs):
+    catalog_version.bump('genres')
+
+
+@receiver(m2m_changed, sender=Movie.genre.through)
+def movie_genres_changed(sender, instance, action, reverse, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # genre.movies.add(...) - any movie list may be affected
+        catalog_version.bump('movies', 'featured', 'trending', *(
+            f'language:{language}' for language, _ in Movie.LANGUAGE_CHOICES
+        ))
+    else:
+        catalog_version.bump(*catalog_version.movie_scopes(
+            instance.language, instance.is_featured, instance.is_trending
+        ))
+
+
+# Changes feed (see changes.py)
+
+@receiver(post_delete, sender=Movie)
+def record_movie_tombstone(sender, instance, **kwargs):
+    MovieTombstone.objects.create(movie_id=instance.pk)
+
+
+@receiver(post_save, sender=Genre)
+@receiver(pre_delete, sender=Genre)
+def touch_genre_movies(sender, instance, raw=False, created=False, **kwargs):
+    """Genre names are part of each movie in the feed"""
+    if not raw and not created:
+        Movie.objects.filter(genre=instance).update(updated_at=timezone.now())
+
+
+@receiver(m2m_changed, sender=Movie.genre.through)
+def touch_movies_on_genre_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Adding or removing genres does not save the movie, so bump updated_at here"""
+    if reverse:
+        if action == 'pre_clear':
+            movies = Movie.objects.filter(genre=instance)
+        elif action in ('post_add', 'post_remove'):
+            movies = Movie.objects.filter(pk__in=pk_set)
+        else:
+            return
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        movies = Movie.objects.filter(pk=instance.pk)
+    else:
+        return
+    movies.update(updated_at=timezone.now())
+
+
+# Event tables (see db_routers.py): no database cascades, so deletes are
+# propagated here
+
+EVENT_MODELS = (UserActivity, UserActivityRollup, PlaybackSession)
+
+
+@receiver(post_delete, sender=User)
+def delete_user_events(sender, instance, **kwargs):
+    for model in EVENT_MODELS:
+        model.objects.filter(user_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=Movie)
+def unlink_movie_events(sender, instance, **kwargs):
+    for model in EVENT_MODELS:
+        model.objects.filter(movie_id=instance.pk).update(movie=None)
@@ -1,3 +1,1536 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+from unittest import mock
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+
+from . import db_routers, signals
+from .activity import activity_summary, movie_view_counts, rollup_activity
+from .changes import encode_cursor
+from .datasets import generate
+from .fast_serializers import genre_fast, movie_fast, movie_list_fast, watchlist_fast
+from .feeds import build_shared_rows
+from .ingest import ingest, validate
+from .load_test import compare as compare_load, environment_changes
+from . import content_similarity, metrics, playback, profiling, recommendations, watch_progress, watchlist_cache
+from .models import (
+    Genre, MaterializedFeed, Movie, MovieRating, MovieTombstone, PlaybackSession, ReplicationHeartbeat, Subscription,
+    UserActivity,
+    UserActivityRollup, UserProfile, Watchlist, WatchProgress,
+)
+from .personalization import FEED_MAX_AGE, get_personal_rows, materialize_feeds, stale_feed_users
+from .query_audit import audit, suggest_index
+from .query_inspector import fingerprint, inspect, inspect_requests, main_requests
+from .renderers import CBORRenderer, FastJSONRenderer, MessagePackRenderer, cbor2, msgpack
+from .serializers import (
+    GenreSerializer, MovieDetailSerializer, MovieListSerializer, MovieSerializer, WatchlistSerializer, parse_fields,
+)
+from .views import MAX_BULK_IDS
+
+
+def create_catalog():
+    action = Genre.objects.create(name='Action', description='Fights and chases')
+    drama = Genre.objects.create(name='Drama')
+    crime = Genre.objects.create(name='Crime')
+    movies = [
+        Movie.objects.create(
+            title='The Dark Knight', description='Gotham — “chaos” reigns',
+            release_date=date(2008, 7, 18), thumbnail='thumbnails/dark knight.jpg',
+            video='videos/dark_knight.mp4', language='English', duration=timedelta(hours=2, minutes=32),
+            rating=9.0, certification='A', director='Christopher Nolan',
+            cast='Christian Bale, Heath Ledger', is_featured=True, is_trending=True,
+        ),
+        Movie.objects.create(
+            title='ജയിലർ', description='', release_date=date(2023, 8, 10),
+            language='Tamil', rating=7.5, certification='U/A', is_trending=True,
+        ),
+        Movie.objects.create(
+            title='Dangal', description='Wrestling', release_date=date(2016, 12, 23),
+            thumbnail='thumbnails/dangal.jpg', language='Hindi', rating=8.4,
+        ),
+    ]
+    movies[0].genre.set([crime, action, drama])
+    movies[1].genre.set([action])
+    return movies
+
+
+class RecommendationIndexTests(TestCase):
+    """The neighbour index is built from interactions and reloaded when rebuilt"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = create_catalog()
+        knight, jailer, dangal = cls.movies
+        for index in range(3):
+            fan = User.objects.create_user(f'fan{index}')
+            Watchlist.objects.create(user=fan, movie=knight)
+            Watchlist.objects.create(user=fan, movie=dangal)
+        MovieRating.objects.create(user=fan, movie=jailer, rating=9)
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'neighbours.npy')
+
+    def test_build_and_lookup(self):
+        self.assertEqual(recommendations.build_index(self.path, top_k=2, workers=1), 3)
+        knight, jailer, dangal = self.movies
+        index = recommendations.NeighbourIndex(self.path)
+
+        neighbours = index.neighbours(knight.pk)
+        self.assertEqual([movie_id for movie_id, _ in neighbours], [dangal.pk, jailer.pk])
+        self.assertAlmostEqual(neighbours[0][1], 1.0, places=5)
+        self.assertGreater(neighbours[0][1], neighbours[1][1])
+        self.assertEqual(index.neighbours(knight.pk, limit=1), neighbours[:1])
+        self.assertIsNone(index.neighbours(0))
+
+    def test_reloads_rebuilt_index(self):
+        recommendations.build_index(self.path, top_k=2, workers=1)
+        index = recommendations.NeighbourIndex(self.path)
+        movie = Movie.objects.create(title='New', description='', release_date=date(2024, 1, 1))
+        self.assertIsNone(index.neighbours(movie.pk))
+
+        Watchlist.objects.create(user=User.objects.get(username='fan0'), movie=movie)
+        recommendations.build_index(self.path, top_k=2, workers=1)
+        # Readers look at the file at most every INDEX_RELOAD_INTERVAL seconds
+        self.assertIsNone(index.neighbours(movie.pk))
+        index._checked_at -= recommendations.INDEX_RELOAD_INTERVAL
+        self.assertEqual(len(index.neighbours(movie.pk)), 2)
+
+
+class ContentSimilarityTests(TestCase):
+    """Single-movie updates land in the built index, and the neighbours API falls back to it"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = create_catalog()
+        cls.user = User.objects.create_user('viewer', password='secret')
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        override = override_settings(
+            CONTENT_SIMILARITY_DIR=os.path.join(directory, 'content'),
+            RECOMMENDATIONS_INDEX_PATH=os.path.join(directory, 'neighbours.npy'),
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def similar_ids(self, movie):
+        index = content_similarity.get_content_index()
+        index._checked_at -= content_similarity.INDEX_RELOAD_INTERVAL
+        similar = index.similar(movie.pk)
+        return None if similar is None else [movie_id for movie_id, _ in similar]
+
+    def test_update_and_remove_movie(self):
+        knight, jailer, dangal = self.movies
+        self.assertFalse(content_similarity.update_movie(knight))
+        self.assertEqual(content_similarity.build_index(), 3)
+        self.assertEqual(self.similar_ids(knight)[0], jailer.pk)
+
+        sequel = Movie.objects.create(
+            title='The Dark Knight Rises', description='Gotham chaos returns', release_date=date(2012, 7, 20),
+            language='English', director='Christopher Nolan', cast='Christian Bale, Tom Hardy',
+        )
+        sequel.genre.set(knight.genre.all())
+        self.assertTrue(content_similarity.update_movie(sequel))
+        self.assertEqual(self.similar_ids(knight)[0], sequel.pk)
+
+        sequel.director, sequel.cast, sequel.description = '', '', ''
+        sequel.save()
+        sequel.genre.clear()
+        content_similarity.update_movie(sequel)
+        self.assertEqual(self.similar_ids(knight)[0], jailer.pk)
+
+        content_similarity.remove_movie(sequel.pk)
+        self.assertIsNone(self.similar_ids(sequel))
+        self.assertNotIn(sequel.pk, self.similar_ids(knight))
+
+    def test_neighbours_fallback(self):
+        knight, jailer, dangal = self.movies
+        url = f'/api/movies/{knight.pk}/neighbours/'
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        # Indexed without any interactions: an empty list, as before the content fallback
+        recommendations.build_index(top_k=2, workers=1)
+        response = self.client.get(url)
+        self.assertEqual(response.json(), {'movie_id': knight.pk, 'source': 'interactions', 'neighbours': []})
+
+        content_similarity.build_index()
+        response = self.client.get(url)
+        self.assertEqual(response.json()['source'], 'content')
+        self.assertEqual(response.json()['neighbours'][0]['id'], jailer.pk)
+
+
+class HomeFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = create_catalog()
+        cls.user = User.objects.create_user('viewer', password='secret')
+        Watchlist.objects.create(user=cls.user, movie=cls.movies[2])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_shared_rows(self):
+        knight, jailer, dangal = self.movies
+        with self.assertNumQueries(2):
+            shared = build_shared_rows()
+        rows = {row['key']: row['movie_ids'] for row in shared['rows']}
+        self.assertEqual(rows, {
+            'featured': [knight.pk], 'trending': [jailer.pk, knight.pk], 'English': [knight.pk],
+            'Hindi': [dangal.pk], 'Tamil': [jailer.pk], 'Telugu': [], 'Malayalam': [],
+        })
+        self.assertEqual(set(shared['movies']), {knight.pk, jailer.pk, dangal.pk})
+        self.assertEqual(shared['movies'][knight.pk]['genre_names'], ['Action', 'Drama', 'Crime'])
+
+    def test_home_feed(self):
+        knight, jailer, dangal = self.movies
+        feed = self.client.get('/api/home/', HTTP_HOST='localhost').json()
+        self.assertEqual(
+            [(row['key'], row['title']) for row in feed['rows']],
+            [('watchlist', 'My Watchlist'), ('featured', 'Featured'), ('trending', 'Trending Now'),
+             ('English', 'English Movies'), ('Hindi', 'Hindi Movies'), ('Tamil', 'Tamil Movies')],
+        )
+        self.assertEqual(feed['rows'][0]['movie_ids'], [dangal.pk])
+        self.assertEqual(set(feed['movies']), {str(movie.pk) for movie in self.movies})
+        self.assertEqual(feed['movies'][str(dangal.pk)]['thumbnail'], 'http://localhost/media/thumbnails/dangal.jpg')
+        self.assertIsNone(feed['movies'][str(jailer.pk)]['thumbnail'])
+
+        # With the shared rows cached only the user's own rows are read
+        with self.assertNumQueries(2):
+            self.client.get('/api/home/', HTTP_HOST='localhost')
+
+
+class PersonalizedFeedTests(TestCase):
+    """Materialised rows are stored per user and rebuilt when the user or the catalog changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = create_catalog()
+        cls.user = User.objects.create_user('viewer', password='secret')
+        MovieRating.objects.create(user=cls.user, movie=cls.movies[0], rating=9)
+
+    def rows(self):
+        return {key: ids for key, _, ids in get_personal_rows(self.user)}
+
+    def test_incremental_runs(self):
+        knight, jailer, dangal = self.movies
+        self.assertEqual(get_personal_rows(self.user), [])
+        self.assertEqual(materialize_feeds(full=True, workers=0), 1)
+        self.assertEqual(self.rows(), {'because_you_saved': [], 'favorite_genres': [jailer.pk], 'recent_languages': []})
+
+        # Nothing changed since the last run
+        self.assertEqual(materialize_feeds(workers=0), 0)
+
+        movie = Movie.objects.create(title='New', description='', release_date=date(2024, 1, 1), rating=9.5)
+        movie.genre.set([Genre.objects.get(name='Action')])
+        self.assertEqual(materialize_feeds(workers=0), 1)
+        self.assertEqual(self.rows()['favorite_genres'], [movie.pk, jailer.pk])
+
+        later = timezone.now() + FEED_MAX_AGE + timedelta(minutes=1)
+        self.assertEqual(stale_feed_users(later), {self.user.pk})
+
+    def test_home_feed_rows(self):
+        MaterializedFeed.objects.create(
+            user=self.user, rows={'recent_languages': [self.movies[2].pk], 'favorite_genres': [self.movies[1].pk, 0]},
+            built_at=timezone.now(),
+        )
+        client = APIClient()
+        client.force_authenticate(self.user)
+        rows = client.get('/api/home/', HTTP_HOST='localhost').json()['rows']
+        # Deleted movies are dropped from the rows
+        self.assertEqual(
+            [(row['key'], row['movie_ids']) for row in rows[:2]],
+            [('favorite_genres', [self.movies[1].pk]), ('recent_languages', [self.movies[2].pk])],
+        )
+
+
+class ConditionalGetTests(TestCase):
+    """Catalog pages answer 304 until their part of the catalog or the user's watchlist changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = create_catalog()
+        Movie.objects.update(thumbnail='thumbnails/poster.jpg', video='videos/movie.mp4')
+        cls.user = User.objects.create_user('viewer', password='secret')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def get(self, path, etag=None, since=None):
+        headers = {'If-None-Match': etag} if etag else {}
+        if since:
+            headers['If-Modified-Since'] = since
+        return self.client.get(path, HTTP_HOST='localhost', headers=headers)
+
+    def assertRevalidates(self, path, change):
+        response = self.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get(path, response['ETag']).status_code, 304)
+        change()
+        changed = self.get(path, response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertEqual(self.get(path, changed['ETag']).status_code, 304)
+
+    def edit(self, movie):
+        def change():
+            movie.rating += 0.1
+            movie.save()
+        return change
+
+    def test_html_pages(self):
+        knight, jailer, dangal = self.movies
+        for path in ('/movie_list/', '/movie_list/?language=English&page=1', '/movie_english/'):
+            with self.subTest(path=path):
+                self.assertRevalidates(path, self.edit(knight))
+
+    def test_api(self):
+        knight, jailer, dangal = self.movies
+        for path in ('/api/movies/', '/api/movies/?fields=id,title', '/api/movies/featured/', '/api/movies/trending/'):
+            with self.subTest(path=path):
+                self.assertRevalidates(path, self.edit(knight))
+        self.assertRevalidates('/api/movies/', lambda: Genre.objects.create(name='Comedy'))
+
+    def test_watchlist_changes_user_pages(self):
+        self.assertRevalidates('/movie_list/', lambda: self.client.post(
+            '/api/users/watchlist/add/', {'movie_ids': [self.movies[2].pk]},
+            content_type='application/json', HTTP_HOST='localhost',
+        ))
+
+    def test_other_scopes_keep_validators(self):
+        tamil = self.get('/movie_tamil/')
+        featured = self.get('/api/movies/featured/')
+        self.edit(self.movies[2])()
+        self.assertEqual(self.get('/movie_tamil/', tamil['ETag']).status_code, 304)
+        self.assertEqual(self.get('/api/movies/featured/', featured['ETag']).status_code, 304)
+
+    def test_if_modified_since_only(self):
+        path = '/movie_list/'
+        with mock.patch('OTTAPP.catalog_version.time.time') as now:
+            now.return_value = 1_000_000.2
+            # Another change in this second would not move a whole-second Last-Modified
+            self.assertFalse(self.get(path).has_header('Last-Modified'))
+
+            now.return_value = 1_000_001.5
+            since = self.get(path)['Last-Modified']
+            self.assertEqual(since, http_date(1_000_001))
+            self.assertEqual(self.get(path, since=since).status_code, 304)
+            self.edit(self.movies[0])()
+            self.assertEqual(self.get(path, since=since).status_code, 200)
+
+            now.return_value = 1_000_003.5
+            since = self.get(path)['Last-Modified']
+            self.assertEqual(self.get(path, since=since).status_code, 304)
+            self.client.post(
+                '/api/users/watchlist/add/', {'movie_ids': [self.movies[2].pk]},
+                content_type='application/json', HTTP_HOST='localhost',
+            )
+            self.assertEqual(self.get(path, since=since).status_code, 200)
+
+
+class FastSerializerTests(TestCase):
+    """The fast list path must render exactly the bytes the DRF serializers do"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = create_catalog()
+        cls.user = User.objects.create_user('viewer', password='secret')
+        for movie in cls.movies[:2]:
+            Watchlist.objects.create(user=cls.user, movie=movie)
+
+    def setUp(self):
+        cache.clear()
+        request = APIRequestFactory().get('/api/movies/', HTTP_HOST='localhost')
+        self.context = {'request': request}
+
+    def assertSameBytes(self, serializer_class, fast, queryset, context=None):
+        context = context or {}
+        expected = JSONRenderer().render(serializer_class(queryset, many=True, context=context).data)
+        self.assertEqual(FastJSONRenderer().render(fast.serialize(fast.values(queryset), context)), expected)
+        self.assertEqual(JSONRenderer().render(fast.serialize(fast.values(queryset), context)), expected)
+
+    def test_movie_list_shape(self):
+        self.assertSameBytes(MovieListSerializer, movie_list_fast, Movie.objects.all(), self.context)
+
+    def test_movie_shape_with_nested_genres(self):
+        self.assertSameBytes(MovieSerializer, movie_fast, Movie.objects.all(), self.context)
+        self.assertSameBytes(MovieSerializer, movie_fast, Movie.objects.filter(is_featured=True), self.context)
+
+    def test_genre_shape(self):
+        self.assertSameBytes(GenreSerializer, genre_fast, Genre.objects.all())
+
+    def test_watchlist_shape(self):
+        queryset = Watchlist.objects.filter(user=self.user).order_by('id')
+        self.assertSameBytes(WatchlistSerializer, watchlist_fast, queryset)
+
+    def test_empty_queryset(self):
+        self.assertSameBytes(MovieSerializer, movie_fast, Movie.objects.none(), self.context)
+
+    def test_list_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/movies/', HTTP_HOST='localhost')
+        request = APIRequestFactory().get('/api/movies/', HTTP_HOST='localhost')
+        results = MovieListSerializer(Movie.objects.all(), many=True, context={'request': request}).data
+        saved = {movie.pk for movie in self.movies[:2]}
+        for movie in results:
+            movie['in_watchlist'] = movie['id'] in saved
+        expected = JSONRenderer().render({'count': 3, 'next': None, 'previous': None, 'results': results})
+        self.assertEqual(response.content, expected)
+
+
+class SparseFieldsTests(TestCase):
+    """?fields= and ?expand= shape the output and prune the queries to match"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = create_catalog()
+        cls.user = User.objects.create_user('viewer', password='secret')
+        Watchlist.objects.create(user=cls.user, movie=cls.movies[0])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def plan(self, serializer_class, fields=None, expand=None):
+        options = {'fields': parse_fields(fields)} if fields is not None else {}
+        if expand is not None:
+            options['expand'] = parse_fields(expand)
+        queryset = serializer_class(**options).optimize(Movie.objects.all())
+        prefetches = {
+            lookup.prefetch_through: set(lookup.queryset.query.deferred_loading[0])
+            for lookup in queryset._prefetch_related_lookups
+        }
+        return queryset.query.deferred_loading, prefetches
+
+    def test_optimize(self):
+        self.assertEqual(self.plan(MovieSerializer, 'id,title'), (({'id', 'title'}, False), {}))
+        self.assertEqual(self.plan(MovieSerializer, 'id,genre', ''), (({'id'}, False), {'genre': {'id'}}))
+        self.assertEqual(self.plan(MovieSerializer, 'id,genre.name', 'genre'), (({'id'}, False), {'genre': {'id', 'name'}}))
+        # Method fields may read any column, but unused relations are still dropped
+        self.assertEqual(self.plan(MovieDetailSerializer, 'id,average_rating'), ((frozenset(), True), {}))
+        columns, prefetches = self.plan(MovieSerializer)
+        self.assertIn('description', columns[0])
+        self.assertEqual(prefetches, {'genre': {'id', 'name', 'description', 'created_at'}})
+
+    def get(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        return response.json(), [query['sql'] for query in queries]
+
+    def test_list_fields(self):
+        data, queries = self.get('/api/movies/?fields=id,title')
+        self.assertEqual(data['results'][0], {'id': self.movies[2].pk, 'title': 'Dangal'})
+        movie_queries = [sql for sql in queries if 'FROM "OTTAPP_movie"' in sql and 'COUNT' not in sql]
+        self.assertEqual(len(movie_queries), 1)
+        self.assertNotIn('description', movie_queries[0])
+        self.assertFalse([sql for sql in queries if 'OTTAPP_genre' in sql])
+
+        data, _ = self.get('/api/movies/?fields=id,in_watchlist')
+        self.assertEqual([movie['in_watchlist'] for movie in data['results']], [False, False, True])
+
+    def test_detail_expand(self):
+        knight = self.movies[0]
+        genre_ids = sorted(genre.pk for genre in knight.genre.all())
+
+        data, queries = self.get(f'/api/movies/{knight.pk}/?fields=id,genre&expand=')
+        self.assertEqual(sorted(data['genre']), genre_ids)
+        genre_queries = [sql for sql in queries if 'FROM "OTTAPP_genre"' in sql]
+        self.assertEqual(len(genre_queries), 1)
+        self.assertNotIn('"OTTAPP_genre"."name"', genre_queries[0])
+
+        data, queries = self.get(f'/api/movies/{knight.pk}/?fields=id,genre.name')
+        self.assertEqual(data, {'id': knight.pk, 'genre': [{'name': 'Action'}, {'name': 'Drama'}, {'name': 'Crime'}]})
+        genre_queries = [sql for sql in queries if 'FROM "OTTAPP_genre"' in sql]
+        self.assertEqual(len(genre_queries), 1)
+        self.assertNotIn('description', genre_queries[0])
+
+        data, queries = self.get(f'/api/movies/{knight.pk}/?fields=id,title')
+        self.assertEqual(data, {'id': knight.pk, 'title': knight.title})
+        self.assertFalse([sql for sql in queries if 'OTTAPP_genre' in sql or 'OTTAPP_movierating' in sql])
+
+    def test_nested_fields(self):
+        data, _ = self.get('/api/users/watchlist/?fields=id,movie.title')
+        self.assertEqual(data, [{'id': Watchlist.objects.get().pk, 'movie': {'title': 'The Dark Knight'}}])
+        data, _ = self.get('/api/users/me/?fields=id,profile&expand=')
+        self.assertEqual(data, {'id': self.user.pk, 'profile': None})
+
+
+class BulkEndpointTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = create_catalog()
+        cls.user = User.objects.create_user('viewer', password='secret')
+        Watchlist.objects.create(user=cls.user, movie=cls.movies[0])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, path, movie_ids):
+        return self.client.post(path, {'movie_ids': movie_ids}, format='json', HTTP_HOST='localhost')
+
+    def test_bulk_get(self):
+        knight, jailer, dangal = self.movies
+        response = self.client.get(f'/api/movies/bulk/?ids={dangal.pk}, x,0,{knight.pk},{dangal.pk}', HTTP_HOST='localhost')
+        results = response.json()['results']
+        self.assertEqual(
+            [(result['id'], result['status']) for result in results],
+            [(dangal.pk, 'ok'), ('x', 'invalid'), (0, 'not_found'), (knight.pk, 'ok'), (dangal.pk, 'ok')],
+        )
+        self.assertEqual(results[0]['movie']['title'], 'Dangal')
+        self.assertEqual([result['movie']['in_watchlist'] for result in results if result['movie']], [False, True, False])
+
+        self.assertEqual(self.client.get('/api/movies/bulk/?ids=', HTTP_HOST='localhost').status_code, 400)
+        ids = ','.join(['1'] * (MAX_BULK_IDS + 1))
+        self.assertEqual(self.client.get(f'/api/movies/bulk/?ids={ids}', HTTP_HOST='localhost').status_code, 400)
+
+    def test_bulk_watchlist(self):
+        knight, jailer, dangal = self.movies
+        response = self.post('/api/users/watchlist/add/', [dangal.pk, knight.pk, 0, dangal.pk])
+        self.assertEqual(response.json(), {'added': 1, 'results': [
+            {'movie_id': dangal.pk, 'status': 'added'}, {'movie_id': knight.pk, 'status': 'exists'},
+            {'movie_id': 0, 'status': 'not_found'}, {'movie_id': dangal.pk, 'status': 'added'},
+        ]})
+        self.assertEqual(set(Watchlist.objects.values_list('movie_id', flat=True)), {knight.pk, dangal.pk})
+
+        response = self.post('/api/users/watchlist/remove/', f'{jailer.pk},{knight.pk}')
+        self.assertEqual(response.json(), {'removed': 1, 'results': [
+            {'movie_id': jailer.pk, 'status': 'not_in_watchlist'}, {'movie_id': knight.pk, 'status': 'removed'},
+        ]})
+        self.assertEqual(list(Watchlist.objects.values_list('movie_id', flat=True)), [dangal.pk])
+
+    def test_bulk_watchlist_rejects(self):
+        for movie_ids in ([], [1, 'x'], {'1': 1}, 1, None, [1] * (MAX_BULK_IDS + 1)):
+            with self.subTest(movie_ids=movie_ids):
+                self.assertEqual(self.post('/api/users/watchlist/add/', movie_ids).status_code, 400)
+                self.assertEqual(self.post('/api/users/watchlist/remove/', movie_ids).status_code, 400)
+
+
+class ChangesFeedTests(TestCase):
+    """Paging through the changes feed sees every change once, whatever the page size"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = create_catalog()
+        cls.user = User.objects.create_user('viewer', password='secret')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.start = timezone.now() - timedelta(hours=1)
+
+    def at(self, minutes):
+        return self.start + timedelta(minutes=minutes)
+
+    def sync(self, cursor=None, limit=1):
+        """Every page from ``cursor`` as ``[(upsert ids, deleted ids)]``, and the last cursor"""
+        pages = []
+        while True:
+            params = {'limit': limit, **({'cursor': cursor} if cursor else {})}
+            data = self.client.get('/api/movies/changes/', params, HTTP_HOST='localhost').json()
+            pages.append(([movie['id'] for movie in data['upserts']], data['deletes']))
+            cursor = data['cursor']
+            if not data['has_more']:
+                return pages, cursor
+
+    def test_equal_timestamps(self):
+        Movie.objects.update(updated_at=self.at(0))
+        pages, _ = self.sync()
+        self.assertEqual(pages, [([movie.pk], []) for movie in self.movies])
+
+    def test_tombstones_between_updates(self):
+        knight, jailer, dangal = [movie.pk for movie in self.movies]
+        Movie.objects.update(updated_at=self.at(-10))
+        Movie.objects.filter(pk=jailer).update(updated_at=self.at(10))
+        for movie_id in (knight, dangal):
+            Movie.objects.get(pk=movie_id).delete()
+        MovieTombstone.objects.update(deleted_at=self.at(20))
+        extra = Movie.objects.create(title='Extra', description='', release_date=date(2024, 1, 1))
+        Movie.objects.filter(pk=extra.pk).update(updated_at=self.at(30))
+
+        # A client that synced an hour ago
+        pages, cursor = self.sync(encode_cursor((self.start, 0), (self.start, 0)))
+        self.assertEqual(pages, [([jailer], []), ([], [knight]), ([], [dangal]), ([extra.pk], [])])
+        self.assertEqual(self.sync(cursor)[0], [([], [])])
+
+        pages, _ = self.sync(encode_cursor((self.start, 0), (self.start, 0)), limit=10)
+        self.assertEqual(pages, [([jailer, extra.pk], [knight, dangal])])
+
+    def test_bad_cursors(self):
+        def status_for(cursor):
+            return self.client.get('/api/movies/changes/', {'cursor': cursor}, HTTP_HOST='localhost').status_code
+
+        expired = timezone.now() - timedelta(days=settings.CHANGES_TOMBSTONE_DAYS + 1)
+        self.assertEqual(status_for(encode_cursor((expired, 0), (expired, 0))), 410)
+        self.assertEqual(status_for('not a cursor'), 400)
+        self.assertEqual(status_for(encode_cursor((self.start, 0), (self.start, 0)).replace('djE', 'djI', 1)), 400)
+        self.assertEqual(
+            self.client.get('/api/movies/changes/', {'limit': 'x'}, HTTP_HOST='localhost').status_code, 400
+        )
+
+
+class WatchlistCacheTests(TestCase):
+    def test_invalidate_reloads(self):
+        movie = create_catalog()[0]
+        user = User.objects.create_user('viewer', password='secret')
+        cache.clear()
+        first = watchlist_cache.load(user.pk)
+        self.assertNotIn(movie.pk, first)
+
+        Watchlist.objects.create(user=user, movie=movie)
+        watchlist_cache.invalidate(user.pk)
+        with self.assertNumQueries(1):
+            second = watchlist_cache.load(user.pk)
+        self.assertIn(movie.pk, second)
+        self.assertGreater(second.version, first.version)
+        with self.assertNumQueries(0):
+            self.assertIn(movie.pk, watchlist_cache.load(user.pk))
+
+        # An entry written for an older version (a slow reader) is not used
+        cache.set(watchlist_cache.CACHE_KEY.format(user.pk), (first.version, b''))
+        self.assertIn(movie.pk, watchlist_cache.load(user.pk))
+
+        # An evicted version starts again above the versions handed out
+        cache.delete(watchlist_cache.VERSION_KEY.format(user.pk))
+        self.assertGreater(watchlist_cache.load(user.pk).version, second.version)
+
+
+class FastJSONRendererTests(TestCase):
+    def test_matches_json_renderer(self):
+        payloads = [
+            {'rating': 8.1, 'score': 0.5712125301361084, 'count': 10 ** 12},
+            {'tiny': 3.9e-05, 'huge': 1e16, 'title': 'Se7en'},
+            {'text': 'line sep  "quoted" \\ \x00\x1f\x7f é 😀'},
+            {'when': timezone.now(), 'day': date(2024, 1, 1), 'price': Decimal('9.99')},
+            {1: 'int key', 'nested': [{'a': None, 'b': True}], 'empty': {}},
+            [],
+        ]
+        for data in payloads:
+            with self.subTest(data=data):
+                self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_indent_falls_back(self):
+        data = {'a': [1, 2]}
+        rendered = FastJSONRenderer().render(data, 'application/json; indent=2')
+        self.assertEqual(rendered, JSONRenderer().render(data, 'application/json; indent=2'))
+
+
+class BinaryFormatTests(TestCase):
+    """MessagePack and CBOR responses carry the same data as the JSON ones"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = create_catalog()
+        cls.user = User.objects.create_user('viewer', password='secret')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertSameData(self, path, media_type, decode):
+        as_json = self.client.get(path, HTTP_HOST='localhost', HTTP_ACCEPT='application/json')
+        response = self.client.get(path, HTTP_HOST='localhost', HTTP_ACCEPT=media_type)
+        self.assertEqual(response.status_code, as_json.status_code)
+        self.assertEqual(response['Content-Type'], media_type)
+        self.assertIn('Accept', response['Vary'])
+        self.assertEqual(decode(response.content), json.loads(as_json.content))
+        if as_json.has_header('ETag'):
+            self.assertNotEqual(response['ETag'], as_json['ETag'])
+
+    def paths(self):
+        return [
+            '/api/movies/',
+            f'/api/movies/{self.movies[0].pk}/',
+            '/api/movies/search/?q=knight',
+            '/api/movies/featured/',
+            '/api/movies/trending/',
+        ]
+
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        for path in self.paths():
+            with self.subTest(path=path):
+                self.assertSameData(path, 'application/msgpack', msgpack.unpackb)
+
+    @unittest.skipIf(cbor2 is None, 'cbor2 is not installed')
+    def test_cbor(self):
+        for path in self.paths():
+            with self.subTest(path=path):
+                self.assertSameData(path, 'application/cbor', cbor2.loads)
+
+    def test_values_converted_like_json(self):
+        data = {'when': timezone.now(), 'day': date(2024, 1, 1), 'length': timedelta(minutes=90), 'price': Decimal('9.99')}
+        expected = json.loads(FastJSONRenderer().render(data))
+        if msgpack is not None:
+            self.assertEqual(msgpack.unpackb(MessagePackRenderer().render(data)), expected)
+        if cbor2 is not None:
+            self.assertEqual(cbor2.loads(CBORRenderer().render(data)), expected)
+
+
+class AsyncCatalogTests(TestCase):
+    """The async catalog endpoints return the bytes the sync ones do"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = create_catalog()
+        cls.user = User.objects.create_user('viewer', password='secret')
+        Watchlist.objects.create(user=cls.user, movie=cls.movies[1])
+        for index, rating in enumerate((7, 8, 10)):
+            rater = User.objects.create_user(f'rater{index}')
+            MovieRating.objects.create(user=rater, movie=cls.movies[0], rating=rating)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+
+    async def test_same_responses(self):
+        movie_id = self.movies[0].pk
+        paths = [
+            '/api/movies/',
+            '/api/movies/?page=2',
+            '/api/movies/?fields=id,title,genre_names',
+            f'/api/movies/{movie_id}/',
+            f'/api/movies/{movie_id}/?fields=id,average_rating,genre.name',
+            '/api/movies/0/',
+            '/api/movies/search/?q=knight',
+            '/api/movies/featured/',
+            '/api/movies/trending/?expand=',
+            '/api/statistics/',
+        ]
+        for path in paths:
+            with self.subTest(path=path):
+                expected = await sync_to_async(self.client.get)(path)
+                response = await self.async_client.get(path.replace('/api/', '/api/async/', 1))
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response.content, expected.content)
+
+    async def test_conditional_get(self):
+        response = await self.async_client.get('/api/async/movies/featured/')
+        again = await self.async_client.get('/api/async/movies/featured/', headers={'If-None-Match': response['ETag']})
+        self.assertEqual(again.status_code, 304)
+
+    async def test_requires_login(self):
+        await sync_to_async(self.async_client.logout)()
+        response = await self.async_client.get('/api/async/movies/')
+        self.assertEqual(response.status_code, 403)
+
+    async def test_negotiates_format(self):
+        accepts = ['application/json', 'text/csv']
+        accepts += [media_type for media_type, encoder in [
+            ('application/msgpack', msgpack), ('application/cbor', cbor2)
+        ] if encoder is not None]
+        for accept in accepts:
+            with self.subTest(accept=accept):
+                expected = await sync_to_async(self.client.get)('/api/movies/featured/', HTTP_ACCEPT=accept)
+                response = await self.async_client.get('/api/async/movies/featured/', headers={'Accept': accept})
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response['Content-Type'], expected['Content-Type'])
+                self.assertEqual(response.content, expected.content)
+                self.assertIn('Accept', response['Vary'])
+
+    @override_settings(REST_FRAMEWORK={
+        **settings.REST_FRAMEWORK,
+        'DEFAULT_AUTHENTICATION_CLASSES': ['rest_framework.authentication.BasicAuthentication'],
+    })
+    async def test_header_authentication(self):
+        """The configured authentication classes apply, not just the session"""
+        await sync_to_async(self.async_client.logout)()
+        credentials = base64.b64encode(b'viewer:secret').decode()
+        response = await self.async_client.get('/api/async/movies/', headers={'Authorization': f'Basic {credentials}'})
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get('/api/async/movies/', headers={'Authorization': 'Basic bm9wZTpub3Bl'})
+        self.assertEqual((response.status_code, response.json()), (403, {'detail': 'Invalid username/password.'}))
+
+
+class PerformanceMetricsTests(TestCase):
+    def setUp(self):
+        create_catalog()
+        self.user = User.objects.create_user('viewer', password='secret')
+        self.client.force_login(self.user)
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+        override = override_settings(METRICS_DIR=metrics_dir, METRICS_TOKEN='scrape')
+        override.enable()
+        self.addCleanup(override.disable)
+        metrics.registry.pid = None
+
+    def test_server_timing(self):
+        response = self.client.get('/api/movies/', HTTP_HOST='localhost')
+        timing = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+        self.assertRegex(timing['db'], r'dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertIn('serializer', timing)
+        self.assertNotIn('template', timing)
+
+    def test_metrics_endpoint(self):
+        self.client.get('/api/movies/1/', HTTP_HOST='localhost')
+        self.client.get('/api/movies/1/', HTTP_HOST='localhost')
+        self.assertEqual(self.client.get('/metrics/', HTTP_HOST='localhost').status_code, 401)
+
+        response = self.client.get('/metrics/', HTTP_HOST='localhost', HTTP_AUTHORIZATION='Bearer scrape')
+        text = response.content.decode()
+        self.assertIn('ott_http_requests_total{method="GET",route="/api/movies/<pk>/",status="200"} 2', text)
+        self.assertIn('ott_http_request_duration_seconds_count{method="GET",route="/api/movies/<pk>/"} 2', text)
+        self.assertIn('ott_http_request_db_queries_bucket{method="GET",route="/api/movies/<pk>/",le="+Inf"} 2', text)
+
+    def test_cache_reads_counted_once(self):
+        backend = metrics.InstrumentedLocMemCache('cache-metrics-test', {})
+        backend.set_many({'a': 1, 'b': 2})
+        timings, token = metrics.start()
+        try:
+            self.assertEqual(backend.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+            backend.get('a')
+        finally:
+            metrics.stop(token)
+        self.assertEqual((timings.cache_hits, timings.cache_misses), (3, 1))
+
+
+class StreamTelemetryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        media_root, metrics_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+        for directory in (media_root, metrics_dir):
+            self.addCleanup(shutil.rmtree, directory)
+        override = override_settings(MEDIA_ROOT=media_root, METRICS_DIR=metrics_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        metrics.registry.pid = None
+
+        os.makedirs(os.path.join(media_root, 'videos'))
+        self.size = 3 * 1024 * 1024
+        with open(os.path.join(media_root, 'videos', 'dark_knight.mp4'), 'wb') as f:
+            f.write(os.urandom(self.size))
+        self.movie = create_catalog()[0]
+        user = User.objects.create_user('viewer', password='secret')
+        Subscription.objects.create(user=user, subscription_plan='premium', status='active', is_active=True)
+        self.client.force_login(user)
+
+    def stream(self, byte_range):
+        response = self.client.get(f'/stream/{self.movie.pk}/', HTTP_HOST='localhost', HTTP_RANGE=byte_range)
+        return response, b''.join(response.streaming_content)
+
+    def test_streams_by_movie_and_plan(self):
+        _, content = self.stream('bytes=0-1048575')
+        self.assertEqual(len(content), 1048576)
+        self.assertEqual(len(self.stream('bytes=1048576-')[1]), self.size - 1048576)
+        self.stream('bytes=10-20')
+
+        text = metrics.render()
+        labels = f'movie="{self.movie.pk}",plan="premium"'
+        self.assertIn(f'ott_streams_total{{movie="{self.movie.pk}",outcome="complete",plan="premium"}} 3', text)
+        self.assertIn(f'ott_stream_bytes_sum{{{labels}}} {self.size + 11}', text)
+        self.assertIn(f'ott_stream_ttfb_seconds_count{{{labels}}} 3', text)
+        self.assertIn('ott_stream_throughput_bytes_per_second_count{plan="premium"} 2', text)
+        for pattern in ('start', 'sequential', 'seek'):
+            self.assertIn(f'ott_stream_ranges_total{{pattern="{pattern}",plan="premium"}} 1', text)
+
+    def test_client_abort(self):
+        response = self.client.get(f'/stream/{self.movie.pk}/', HTTP_HOST='localhost', HTTP_RANGE='bytes=1048576-')
+        chunks = iter(response.streaming_content)
+        next(chunks)
+        next(chunks)
+        response.close()
+
+        text = metrics.render()
+        labels = f'movie="{self.movie.pk}",plan="premium"'
+        self.assertIn(f'ott_streams_total{{movie="{self.movie.pk}",outcome="aborted",plan="premium"}} 1', text)
+        # The chunk taken before the close counts once the next one is asked for
+        self.assertIn(f'ott_stream_abort_position_ratio_sum{{{labels}}} {(1048576 + 8192) / self.size!r}', text)
+        # The session only counts the bytes that went out
+        session = PlaybackSession.objects.get()
+        self.assertEqual((session.bytes_served, session.furthest_byte), (8192, 1048576 + 8191))
+
+    def test_less_viewed_movies_labelled_other(self):
+        Movie.objects.exclude(pk=self.movie.pk).update(view_count=10)
+        with override_settings(STREAM_METRICS_MOVIES=1):
+            self.stream('bytes=0-9')
+            # A new process reads the same choice, even after the views change
+            metrics.registry.save()
+            metrics.registry.pid = None
+            Movie.objects.filter(pk=self.movie.pk).update(view_count=100)
+            self.stream('bytes=0-9')
+
+        text = metrics.render()
+        self.assertIn('ott_streams_total{movie="other",outcome="complete",plan="premium"} 2', text)
+        self.assertNotIn(f'movie="{self.movie.pk}"', text)
+
+    def test_stream_movies_chosen_once(self):
+        path = os.path.join(settings.METRICS_DIR, metrics.STREAM_MOVIES_FILE)
+        with self.assertNumQueries(1):
+            chosen = metrics._choose_stream_movies(path)
+        # A process that found the file due waits on the lock, then reads the new choice
+        with self.assertNumQueries(0):
+            self.assertEqual(metrics._choose_stream_movies(path), chosen)
+
+
+class PlaybackSessionTests(TestCase):
+    def setUp(self):
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+        override = override_settings(METRICS_DIR=metrics_dir, PLAYBACK_IDLE_SECONDS=600)
+        override.enable()
+        self.addCleanup(override.disable)
+        metrics.registry.pid = None
+        self.movie = create_catalog()[0]
+        self.user = User.objects.create_user('viewer', password='secret')
+
+    def record(self, first_byte, last_byte):
+        request = APIRequestFactory().get('/', REMOTE_ADDR='10.0.0.1', HTTP_USER_AGENT='player')
+        request.user = self.user
+        return playback.record_range(request, self.movie, first_byte, last_byte - first_byte + 1, 1000, plan='premium')
+
+    def idle(self):
+        PlaybackSession.objects.update(ended_at=timezone.now() - timedelta(seconds=601))
+
+    def test_ranges_collapse_into_one_session(self):
+        self.record(0, 99)
+        self.record(100, 499)
+        self.record(800, 849)
+
+        session = PlaybackSession.objects.get()
+        self.assertEqual(session.open_key, f'{self.user.pk}:{self.movie.pk}')
+        self.assertEqual((session.range_requests, session.bytes_served, session.furthest_byte), (3, 550, 849))
+        self.assertEqual((session.plan, session.ip_address, session.user_agent), ('premium', '10.0.0.1', 'player'))
+        # Nothing is written for the viewing until it is finished
+        self.assertFalse(UserActivity.objects.exists())
+        self.assertEqual(playback.flush_sessions(), 0)
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.view_count, 0)
+
+        text = metrics.render()
+        for pattern in ('start', 'sequential', 'seek'):
+            self.assertIn(f'ott_stream_ranges_total{{pattern="{pattern}",plan="premium"}} 1', text)
+
+    def test_flush_finishes_idle_sessions(self):
+        self.record(0, 99)
+        self.record(100, 999)
+        self.idle()
+
+        self.assertEqual(playback.flush_sessions(), 1)
+        self.assertEqual(playback.flush_sessions(), 0)
+        session = PlaybackSession.objects.get()
+        self.assertIsNone(session.open_key)
+        activity = UserActivity.objects.get()
+        self.assertEqual((activity.activity_type, activity.movie_id), ('movie_view', self.movie.pk))
+        self.assertEqual(activity.description, 'Viewed movie: The Dark Knight')
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.view_count, 1)
+
+        text = metrics.render()
+        self.assertIn('ott_playback_session_range_requests_sum{plan="premium"} 2', text)
+        self.assertIn('ott_playback_session_reached_ratio_sum{plan="premium"} 1', text)
+
+    def test_idle_session_finished_by_next_request(self):
+        self.record(0, 99)
+        self.idle()
+        self.record(500, 599)
+
+        finished, open_session = PlaybackSession.objects.order_by('pk')
+        self.assertIsNone(finished.open_key)
+        self.assertEqual((open_session.range_requests, open_session.furthest_byte), (1, 599))
+        self.assertEqual(UserActivity.objects.filter(activity_type='movie_view').count(), 1)
+        self.assertIn('ott_stream_ranges_total{pattern="resume",plan="premium"} 1', metrics.render())
+
+    @mock.patch.object(playback, 'cache_is_shared', return_value=True)
+    def test_shared_cache_writes_only_the_finished_session(self, _):
+        cache.clear()
+        self.record(0, 99)
+        self.record(100, 499)
+        self.record(800, 849)
+        self.assertFalse(PlaybackSession.objects.exists())
+
+        later = time.time() + 180
+        with override_settings(PLAYBACK_IDLE_SECONDS=0), mock.patch('OTTAPP.buffers.time.time', return_value=later):
+            self.assertEqual(playback.flush_sessions(), 1)
+            self.assertEqual(playback.flush_sessions(), 0)
+        session = PlaybackSession.objects.get()
+        self.assertIsNone(session.open_key)
+        self.assertEqual((session.range_requests, session.bytes_served, session.furthest_byte), (3, 550, 849))
+        self.assertEqual((session.plan, session.ip_address, session.user_agent), ('premium', '10.0.0.1', 'player'))
+        self.assertEqual(UserActivity.objects.filter(activity_type='movie_view').count(), 1)
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.view_count, 1)
+
+    @mock.patch.object(playback, 'cache_is_shared', return_value=True)
+    def test_open_session_kept_until_idle(self, _):
+        cache.clear()
+        self.record(0, 99)
+        later = time.time() + 180
+        with mock.patch('OTTAPP.buffers.time.time', return_value=later):
+            self.assertEqual(playback.flush_sessions(), 0)
+        self.record(100, 199)
+        later += 180
+        with override_settings(PLAYBACK_IDLE_SECONDS=0), mock.patch('OTTAPP.buffers.time.time', return_value=later):
+            self.assertEqual(playback.flush_sessions(), 1)
+        self.assertEqual(PlaybackSession.objects.get().range_requests, 2)
+
+
+class WatchProgressTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movies = create_catalog()
+        self.user = User.objects.create_user('viewer', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def heartbeat(self, movie, position):
+        response = self.client.post(
+            f'/api/movies/{movie.pk}/progress/', {'position': position}, format='json', HTTP_HOST='localhost'
+        )
+        self.assertEqual(response.status_code, 204)
+
+    def position(self, movie):
+        return self.client.get(f'/api/movies/{movie.pk}/progress/', HTTP_HOST='localhost').json()['position']
+
+    def continue_watching(self):
+        response = self.client.get('/api/users/continue_watching/', HTTP_HOST='localhost')
+        return [(entry['movie']['id'], entry['position']) for entry in response.json()]
+
+    def test_per_process_cache_writes_through(self):
+        dark_knight = self.movies[0]
+        self.heartbeat(dark_knight, 60)
+        self.heartbeat(dark_knight, 65)
+        # Past COMPLETED_RATIO of the running time
+        finished = self.movies[1]
+        Movie.objects.filter(pk=finished.pk).update(duration=timedelta(minutes=100))
+        self.heartbeat(finished, 99 * 60)
+
+        self.assertEqual(self.position(dark_knight), 65)
+        self.assertEqual(self.continue_watching(), [(dark_knight.pk, 65)])
+        self.assertEqual(watch_progress.flush_progress(), 0)
+
+    def test_shared_cache_buffers_until_flushed(self):
+        dark_knight = self.movies[0]
+        with mock.patch.object(watch_progress, 'cache_is_shared', return_value=True):
+            with self.assertNumQueries(0):
+                self.heartbeat(dark_knight, 60)
+                self.heartbeat(dark_knight, 65)
+            self.assertEqual(self.position(dark_knight), 65)
+            self.assertEqual(self.continue_watching(), [])
+
+            # The journal only hands over buckets that closed an interval ago
+            with mock.patch('OTTAPP.buffers.time.time', return_value=time.time() + 180):
+                self.assertEqual(watch_progress.flush_progress(), 1)
+            self.assertEqual(watch_progress.flush_progress(), 0)
+
+        self.assertEqual(WatchProgress.objects.get().position, 65)
+        self.assertEqual(self.continue_watching(), [(dark_knight.pk, 65)])
+        cache.clear()
+        self.assertEqual(self.position(dark_knight), 65)
+
+
+class QueryInspectorTests(TestCase):
+    """The main endpoints must not gain N+1 queries over query_baseline.json"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = create_catalog()
+        drama = Genre.objects.get(name='Drama')
+        # Enough for a second API page
+        for index in range(20):
+            movie = Movie.objects.create(
+                title=f'Drama {index}', description='', release_date=date(2000 + index, 1, 1),
+                language='Tamil' if index % 2 else 'English', rating=6 + index / 2, is_trending=True,
+            )
+            movie.genre.set([drama])
+            cls.movies.append(movie)
+        # The pages link every movie's media
+        Movie.objects.update(thumbnail='thumbnails/poster.jpg', video='videos/movie.mp4')
+        cls.user = User.objects.create_user('viewer', password='secret')
+        UserProfile.objects.create(user=cls.user, email='viewer@example.com', phone_number='5550100')
+        for movie in cls.movies[:6]:
+            Watchlist.objects.create(user=cls.user, movie=movie)
+            WatchProgress.objects.create(user=cls.user, movie=movie, position=60, updated_at=timezone.now())
+            UserActivity.objects.create(user=cls.user, activity_type='movie_view', description='', movie=movie)
+            for index, rating in enumerate((6, 9)):
+                rater, _ = User.objects.get_or_create(username=f'rater{index}')
+                MovieRating.objects.create(user=rater, movie=movie, rating=rating)
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'O''Brien' AND rating > 7.5"),
+            fingerprint("SELECT *  FROM t WHERE id IN (%s) AND name = 'x' AND rating > 1"),
+        )
+
+    def test_flags_n_plus_one(self):
+        with inspect() as inspection:
+            for movie in Movie.objects.all():
+                list(movie.genre.all())
+        [offender] = inspection.offenders(repeat=5, slow_ms=1000)
+        self.assertEqual(offender['kind'], 'repeated')
+        self.assertEqual(offender['count'], len(self.movies))
+        self.assertRegex(offender['origin'], r'^OTTAPP/tests\.py:\d+ in test_flags_n_plus_one$')
+
+    def test_no_new_offenders(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        # Query times depend on the machine running the tests; only repeated queries are checked
+        report, failed = inspect_requests(
+            self.client, main_requests(self.movies[0].pk, 'Drama'), slow_ms=float('inf')
+        )
+        self.assertEqual(failed, [])
+        with open(os.path.join(settings.BASE_DIR, 'query_baseline.json')) as f:
+            baseline = json.load(f)
+        self.assertEqual([(view, offender['origin']) for view, offender in report.new_offenders(baseline)], [])
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        profiles_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profiles_dir)
+        override = override_settings(PROFILING=True, PROFILING_DIR=profiles_dir, PROFILING_POLL_SECONDS=0)
+        override.enable()
+        self.addCleanup(override.disable)
+        profiling.profiler.pid = None
+        create_catalog()
+        self.staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        self.client.force_login(self.staff)
+
+    def start(self, **data):
+        response = self.client.post('/api/profiling/', data, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def download(self, session, suffix):
+        [name] = self.client.get('/api/profiling/', HTTP_HOST='localhost').json()['profiles'][session]
+        self.assertTrue(name.endswith(suffix))
+        response = self.client.get(f'/api/profiling/{session}/{name}', HTTP_HOST='localhost')
+        return b''.join(response.streaming_content).decode()
+
+    def test_staff_only(self):
+        viewer = User.objects.create_user('viewer')
+        self.client.force_login(viewer)
+        self.assertEqual(self.client.get('/api/profiling/', HTTP_HOST='localhost').status_code, 403)
+        with override_settings(PROFILING=False):
+            self.client.force_login(self.staff)
+            self.assertEqual(self.client.get('/api/profiling/', HTTP_HOST='localhost').status_code, 404)
+
+    def test_sampler_folds_stacks(self):
+        def spin(seconds):
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                pass
+
+        sampler = profiling.Sampler(0.001, threads={threading.get_ident()})
+        sampler.start()
+        spin(0.2)
+        sampler.stop()
+        stack, count = sampler.folded().splitlines()[0].rsplit(' ', 1)
+        self.assertRegex(stack, r';test_sampler_folds_stacks \(OTTAPP/tests\.py:\d+\);spin \(OTTAPP/tests\.py:\d+\)$')
+        self.assertGreater(int(count), 0)
+
+    def test_cpu_profile_of_next_requests(self):
+        session = self.start(kind='cpu', requests=2, interval_ms=1)
+        response = self.client.post('/api/profiling/', {'kind': 'heap'}, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 409)
+        self.client.get('/api/movies/', HTTP_HOST='localhost')
+        for line in self.download(session, '.cpu.folded').splitlines():
+            self.assertRegex(line, r'^[^ ].* \d+$')
+
+    def test_heap_diff(self):
+        session = self.start(kind='heap', requests=2)
+        self.client.get('/api/movies/', HTTP_HOST='localhost')
+        self.client.get('/api/movies/', HTTP_HOST='localhost')
+        self.assertRegex(self.download(session, '.heap.txt'), r'^Heap growth of worker \d+ over [\d.]+ s and 2 requests\n')
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_stop(self):
+        session = self.start(kind='cpu', seconds=60)
+        self.client.get('/api/movies/', HTTP_HOST='localhost')
+        self.assertEqual(self.client.delete('/api/profiling/', HTTP_HOST='localhost').status_code, 204)
+        self.client.get('/api/movies/', HTTP_HOST='localhost')
+        self.assertIsNone(profiling.profiler.active)
+        self.download(session, '.cpu.folded')
+
+    def test_session_shared_through_file(self):
+        session = self.start(kind='cpu', seconds=60)
+        # Another worker: its own profiler, and no cache shared with this one
+        cache.clear()
+        worker = profiling.Profiler()
+        worker.poll()
+        self.assertEqual(worker.active['id'], session)
+        worker._expire(session)
+
+        path = os.path.join(settings.PROFILING_DIR, 'session.json')
+        expired = {**profiling.current(), 'ends': time.time() - 1}
+        with open(path, 'w') as f:
+            json.dump(expired, f)
+        self.assertIsNone(profiling.current())
+        # An expired session does not block the next one
+        self.assertNotEqual(self.start(kind='cpu', seconds=1), session)
+        self.client.delete('/api/profiling/', HTTP_HOST='localhost')
+        self.assertFalse(os.path.exists(path))
+
+
+class LoadTestBaselineTests(unittest.TestCase):
+    def row(self, requests=200, errors=0, rps=50.0, p95=100.0, p99=150.0):
+        return {
+            'requests': requests, 'errors': errors, 'error_rate': errors / requests,
+            'rps': rps, 'p50_ms': 50.0, 'p95_ms': p95, 'p99_ms': p99,
+        }
+
+    def test_within_tolerance(self):
+        baseline = {'search': self.row()}
+        self.assertEqual(compare_load({'search': self.row(rps=45.0, p95=120.0, p99=210.0)}, baseline), [])
+
+    def test_regressions(self):
+        baseline = {'search': self.row(), 'rate': self.row()}
+        regressions = compare_load({'search': self.row(errors=10, rps=30.0, p95=140.0)}, baseline)
+        self.assertEqual(len(regressions), 4)
+        self.assertTrue(all(message.startswith(('search:', 'rate:')) for message in regressions))
+        self.assertIn('rate: no requests (baseline had 200)', regressions)
+
+    def test_small_samples_skip_percentiles(self):
+        baseline = {'signin': self.row(requests=10)}
+        self.assertEqual(compare_load({'signin': self.row(requests=10, p95=500.0, p99=900.0)}, baseline), [])
+
+    def test_environment_changes(self):
+        baseline = {'database': 'mysql', 'machine': 'Linux x86_64, 8 CPUs', 'python': '3.11.4'}
+        self.assertEqual(environment_changes({**baseline, 'python': '3.12.1'}, baseline), [])
+        self.assertEqual(
+            environment_changes({**baseline, 'database': 'sqlite3'}, baseline), ['database: sqlite3, baseline mysql']
+        )
+
+
+class DatasetTests(TestCase):
+    def test_generate(self):
+        # Small chunks so every table spans several
+        written = generate(movies=60, users=30, ratings=400, activity=500, seed=3, chunk_size=25)
+        self.assertEqual(written, {'movies': 60, 'users': 30, 'ratings': 400, 'activity': 500})
+        self.assertEqual(Movie.objects.filter(genre=None).count(), 0)
+        self.assertEqual(Movie.objects.filter(view_count=5_000_000).count(), 1)
+        self.assertEqual(MovieRating.objects.values('user', 'movie').distinct().count(), 400)
+        self.assertEqual(UserActivity.objects.filter(movie=None, activity_type='movie_view').count(), 0)
+        self.assertTrue(self.client.login(username=User.objects.first().username, password='password123'))
+
+    def test_too_many_ratings(self):
+        with self.assertRaises(ValueError):
+            generate(movies=10, users=10, ratings=60, activity=0)
+
+
+class CatalogIngestTests(TestCase):
+    def setUp(self):
+        self.media_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_dir)
+        self.storage_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.storage_dir)
+        media_root = override_settings(MEDIA_ROOT=self.storage_dir)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+        Genre.objects.create(name='Drama')
+        Image.new('RGB', (4, 6)).save(os.path.join(self.media_dir, 'poster.png'))
+        with open(os.path.join(self.media_dir, 'movie.mp4'), 'wb') as f:
+            f.write(b'\0' * 100)
+        rows = [
+            {'title': f'Partner {n}', 'description': 'Imported', 'release_date': '2020-01-02', 'language': 'tamil',
+             'genres': ['drama', 'Folk'], 'duration': '1:30:00', 'thumbnail': 'poster.png', 'video': 'movie.mp4'}
+            for n in range(3)
+        ]
+        rows.append({'title': 'Broken', 'release_date': '2020-02-30', 'thumbnail': 'poster.png', 'video': 'movie.mp4'})
+        self.manifest = os.path.join(self.media_dir, 'manifest.jsonl')
+        with open(self.manifest, 'w') as f:
+            f.writelines(json.dumps(row) + '\n' for row in rows)
+
+    def test_ingest_is_idempotent(self):
+        valid, problems = validate(self.manifest, self.media_dir)
+        self.assertEqual(valid, 3)
+        self.assertEqual({line for line, _ in problems}, {4})
+
+        counts, failures = ingest(self.manifest, self.media_dir, batch_size=2)
+        self.assertEqual(counts, {'created': 3, 'existing': 0, 'invalid': 1, 'failed': 0})
+        self.assertEqual(failures, [])
+        movie = Movie.objects.get(title='Partner 0')
+        self.assertEqual(movie.language, 'Tamil')
+        self.assertEqual(movie.duration, timedelta(minutes=90))
+        self.assertEqual(sorted(movie.genre.values_list('name', flat=True)), ['Drama', 'Folk'])
+        self.assertTrue(movie.video.name.startswith('videos/'))
+        self.assertEqual(len(os.listdir(os.path.join(self.storage_dir, 'videos'))), 1)
+
+        counts, _ = ingest(self.manifest, self.media_dir)
+        self.assertEqual(counts['existing'], 3)
+        self.assertEqual(Movie.objects.count(), 3)
+        self.assertEqual(Genre.objects.count(), 2)
+
+
+class ActivityRetentionTests(TestCase):
+    """Rolling up old activity must not change what readers see"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = create_catalog()
+        cls.user = User.objects.create_user('viewer', password='secret')
+        now = timezone.now()
+        for days_ago, activity_type, movie in [
+            (200, 'movie_view', 0), (200, 'movie_view', 0), (200, 'login', None), (150, 'movie_view', 1),
+            (120, 'movie_view', 0), (10, 'movie_view', 0), (10, 'logout', None), (0, 'login', None),
+        ]:
+            activity = UserActivity.objects.create(
+                user=cls.user, activity_type=activity_type, description='',
+                movie=None if movie is None else cls.movies[movie],
+            )
+            UserActivity.objects.filter(pk=activity.pk).update(created_at=now - timedelta(days=days_ago))
+
+    def test_rollup_keeps_summary_and_view_counts(self):
+        summary = activity_summary(self.user.pk, 366)
+        views = sorted(movie_view_counts())
+
+        # Small chunks so a day's rows are split across transactions
+        self.assertEqual(rollup_activity(90, chunk_size=2), 5)
+        rollup_activity(90, chunk_size=2)
+
+        self.assertEqual(UserActivity.objects.count(), 3)
+        self.assertEqual(UserActivityRollup.objects.count(), 4)
+        self.assertEqual(activity_summary(self.user.pk, 366), summary)
+        self.assertEqual(sorted(movie_view_counts()), views)
+
+    def test_rollup_adds_to_existing_rollups(self):
+        rollup_activity(90)
+        # A late straggler for a day that was already rolled up
+        activity = UserActivity.objects.create(
+            user=self.user, activity_type='movie_view', description='', movie=self.movies[0]
+        )
+        UserActivity.objects.filter(pk=activity.pk).update(created_at=timezone.now() - timedelta(days=200))
+        self.assertEqual(rollup_activity(90), 1)
+
+        rollup = UserActivityRollup.objects.get(
+            activity_type='movie_view', movie=self.movies[0], day=timezone.localdate() - timedelta(days=200)
+        )
+        self.assertEqual(rollup.count, 3)
+        self.assertEqual(UserActivityRollup.objects.count(), 4)
+
+    def test_activity_lists_rollups_after_raw_rows(self):
+        rollup_activity(90)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        activity = client.get('/api/users/activity/', HTTP_HOST='localhost').json()
+
+        self.assertEqual(sorted(entry['activity_type'] for entry in activity[:3]), ['login', 'logout', 'movie_view'])
+        self.assertTrue(all(entry['id'] for entry in activity[:3]))
+        rolled_up = [(entry['activity_type'], entry['count'], entry['id']) for entry in activity[3:]]
+        self.assertEqual(
+            rolled_up, [('movie_view', 1, None), ('movie_view', 1, None), ('login', 1, None), ('movie_view', 2, None)]
+        )
+        self.assertEqual(activity[-1]['movie']['id'], self.movies[0].pk)
+        self.assertEqual(activity[-1]['description'], 'Movie View x2 (rolled up)')
+
+
+class QueryPlanTests(TestCase):
+    """The hot queries must be served by indexes"""
+
+    def test_no_hot_query_scans_or_sorts(self):
+        for name, queryset, findings, index in audit():
+            with self.subTest(query=name):
+                self.assertEqual(findings, [], f'{name}: add an index like {index}\n{queryset.explain()}')
+
+    def test_suggest_index(self):
+        queryset = Movie.objects.filter(director='Nolan', rating__gte=8)
+        self.assertEqual(suggest_index(queryset), ['director', '-created_at'])
+        self.assertEqual(suggest_index(queryset.order_by()), ['director', 'rating'])
+        self.assertIsNone(suggest_index(Movie.objects.filter(id=1).order_by()))
+
+
+@override_settings(REPLICA_DATABASES=['replica'])
+class ReplicaRoutingTests(TestCase):
+    """Catalog reads go to a replica (a second SQLite database) unless they must not"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Added after the test case set up its databases: the replica is not a
+        # test database, it is created here and removed in tearDownClass
+        cls.replica_dir = tempfile.mkdtemp()
+        connections.settings['replica'] = connections.configure_settings({
+            'default': connections.settings['default'],
+            'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(cls.replica_dir, 'replica.db')},
+        })['replica']
+        with connections['replica'].schema_editor() as editor:
+            for model in (Genre, Movie, ReplicationHeartbeat):
+                editor.create_model(model)
+        # Different rows on each side show where a read went
+        Movie.objects.using('replica').create(title='On replica', description='', release_date=date(2024, 1, 1))
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        shutil.rmtree(cls.replica_dir)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('viewer', password='secret')
+        Movie.objects.using('default').create(title='On primary', description='', release_date=date(2024, 1, 1))
+
+    def setUp(self):
+        cache.clear()
+        db_routers._replica_health.clear()
+        self.enterContext(db_routers.pinned(False))
+
+    def titles(self):
+        return list(Movie.objects.values_list('title', flat=True))
+
+    def test_catalog_reads_use_replica(self):
+        self.assertEqual(self.titles(), ['On replica'])
+        self.assertEqual(User.objects.get().username, 'viewer')
+
+    def test_reads_after_a_write_use_primary(self):
+        Watchlist.objects.create(user=self.user, movie=Movie.objects.using('default').get())
+        self.assertEqual(self.titles(), ['On primary'])
+        with db_routers.pinned(False):
+            self.assertEqual(self.titles(), ['On replica'])
+            with db_routers.primary():
+                self.assertEqual(self.titles(), ['On primary'])
+
+    def test_lagging_replica_is_skipped(self):
+        now = timezone.now()
+        ReplicationHeartbeat.objects.using('default').create(pk=1, beat_at=now)
+        ReplicationHeartbeat.objects.using('replica').create(pk=1, beat_at=now - timedelta(seconds=60))
+        self.addCleanup(ReplicationHeartbeat.objects.using('replica').all().delete)
+        with self.assertLogs('OTTAPP.db_routers', 'WARNING'):
+            self.assertEqual(self.titles(), ['On primary'])
+
+        ReplicationHeartbeat.objects.using('replica').filter(pk=1).update(beat_at=now)
+        db_routers._replica_health.clear()
+        self.assertEqual(self.titles(), ['On replica'])
+
+    def test_client_sticks_to_primary_after_writing(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        def listed():
+            response = client.get('/api/movies/', HTTP_HOST='localhost')
+            return [movie['title'] for movie in response.json()['results']]
+
+        self.assertEqual(listed(), ['On replica'])
+        movie_id = Movie.objects.using('default').get().pk
+        response = client.post(f'/api/movies/{movie_id}/progress/', {'position': 5}, format='json', HTTP_HOST='localhost')
+        self.assertIn('db_primary_until', response.cookies)
+        self.assertEqual(listed(), ['On primary'])
+
+
+@override_settings(EVENTS_DATABASE='events')
+class EventDatabaseTests(TestCase):
+    """Event tables in their own database (a second SQLite database), migrated and routed there"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Like the replica above, not a test database: migrated here, removed in tearDownClass
+        cls.events_dir = tempfile.mkdtemp()
+        connections.settings['events'] = connections.configure_settings({
+            'default': connections.settings['default'],
+            'events': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(cls.events_dir, 'events.db')},
+        })['events']
+        call_command('migrate', database='events', verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['events'].close()
+        del connections['events']
+        del connections.settings['events']
+        shutil.rmtree(cls.events_dir)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('viewer', password='secret')
+        cls.movie = create_catalog()[0]
+
+    def setUp(self):
+        for model in signals.EVENT_MODELS:
+            self.addCleanup(model.objects.using('events').all().delete)
+
+    def test_migrate_creates_only_event_tables(self):
+        introspection = connections['events'].introspection
+        with connections['events'].cursor() as cursor:
+            tables = set(introspection.table_names(cursor)) - {'django_migrations'}
+            constraints = {table: introspection.get_constraints(cursor, table) for table in tables}
+        self.assertEqual(tables, {model._meta.db_table for model in signals.EVENT_MODELS})
+        for table, table_constraints in constraints.items():
+            with self.subTest(table=table):
+                self.assertFalse([name for name, info in table_constraints.items() if info['foreign_key']])
+        self.assertIn('rollup_unique_key', constraints[UserActivityRollup._meta.db_table])
+
+    def test_routing(self):
+        router = db_routers.EventRouter()
+        self.assertEqual(router.db_for_read(UserActivity), 'events')
+        self.assertEqual(router.db_for_write(PlaybackSession), 'events')
+        self.assertIsNone(router.db_for_read(Movie))
+        self.assertTrue(router.allow_migrate('events', 'OTTAPP', model_name='useractivity'))
+        self.assertFalse(router.allow_migrate('events', 'OTTAPP', model_name='movie'))
+        self.assertFalse(router.allow_migrate('default', 'OTTAPP', model_name='useractivity'))
+        self.assertIsNone(router.allow_migrate('default', 'OTTAPP', model_name='movie'))
+        self.assertTrue(router.allow_migrate('events', 'OTTAPP', events_schema=True))
+        self.assertFalse(router.allow_migrate('default', 'OTTAPP', events_schema=True))
+        # Before the events schema exists, the early event migrations are skipped there
+        with mock.patch.object(db_routers, 'events_schema_created', return_value=False):
+            self.assertFalse(router.allow_migrate('events', 'OTTAPP', model_name='useractivity'))
+
+    def test_deletes_propagate_to_events(self):
+        other = User.objects.create_user('other', password='secret')
+        for user in (self.user, other):
+            UserActivity.objects.create(user=user, activity_type='movie_view', description='', movie=self.movie)
+        self.assertEqual(UserActivity.objects.using('events').count(), 2)
+        self.assertFalse(UserActivity.objects.using('default').exists())
+
+        self.movie.delete()
+        self.assertEqual(UserActivity.objects.filter(movie__isnull=False).count(), 0)
+        other.delete()
+        self.assertEqual(list(UserActivity.objects.values_list('user_id', flat=True)), [self.user.pk])
+
+    def test_migrate_event_data(self):
+        viewed_at = timezone.now() - timedelta(days=3)
+        for _ in range(3):
+            UserActivity.objects.using('default').create(
+                user=self.user, activity_type='movie_view', description='', movie=self.movie
+            )
+        UserActivity.objects.using('default').update(created_at=viewed_at)
+        UserActivityRollup.objects.using('default').create(
+            user=self.user, day=date(2024, 1, 1), activity_type='login', count=4
+        )
+
+        call_command('migrate_event_data', chunk_size=2, stdout=StringIO())
+        self.assertFalse(UserActivity.objects.using('default').exists())
+        self.assertFalse(UserActivityRollup.objects.using('default').exists())
+        self.assertEqual(
+            list(UserActivity.objects.values_list('created_at', flat=True)), [viewed_at] * 3
+        )
+        self.assertEqual(UserActivityRollup.objects.get().count, 4)
 
-# Create your tests here.
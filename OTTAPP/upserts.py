@@ -0,0 +1,21 @@
+"""
+Bulk upserts that run on every supported database.
+
+``bulk_create(update_conflicts=True)`` needs the conflict target
+(``unique_fields``) on PostgreSQL and SQLite. MySQL upserts on any unique key
+and takes no conflict target, so it is only passed where the backend accepts
+one; there, a row that collides with any unique key of the table is updated.
+"""
+from django.db import connections, router
+
+
+def upsert(model, objs, unique_fields, update_fields, batch_size=1000):
+    """Insert ``objs``, updating ``update_fields`` of the rows that already exist with the same ``unique_fields``"""
+    features = connections[router.db_for_write(model)].features
+    model.objects.bulk_create(
+        objs,
+        batch_size=batch_size,
+        update_conflicts=True,
+        update_fields=update_fields,
+        unique_fields=unique_fields if features.supports_update_conflicts_with_target else None,
+    )
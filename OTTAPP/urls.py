@@ -1,10 +1,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views 
+from . import async_views, views 
 from .views import (
     SignupView, SigninView, SignoutView, IndexView, MovieListView, 
     SearchView2, MovieViewSet, UserViewSet, movie_statistics,
-    stream_video
+    home_feed, stream_video
 )
 
 # API Router
@@ -42,8 +42,20 @@ urlpatterns = [
     # Video streaming
     path('stream/<int:movie_id>/', stream_video, name='stream_video'),
     
+    # Async catalog API, for ASGI (see async_views.py)
+    path('api/async/movies/', async_views.movie_list, name='async_movie_list'),
+    path('api/async/movies/search/', async_views.movie_search, name='async_movie_search'),
+    path('api/async/movies/featured/', async_views.featured_movies, name='async_featured_movies'),
+    path('api/async/movies/trending/', async_views.trending_movies, name='async_trending_movies'),
+    path('api/async/movies/<int:pk>/', async_views.movie_detail, name='async_movie_detail'),
+    path('api/async/statistics/', async_views.movie_statistics, name='async_movie_statistics'),
+
     # API URLs
     path('api/', include(router.urls)),
     path('api/statistics/', movie_statistics, name='movie_statistics'),
+    path('api/home/', home_feed, name='home_feed'),
+    path('metrics/', views.prometheus_metrics, name='metrics'),
+    path('api/profiling/', views.profiling_sessions, name='profiling_sessions'),
+    path('api/profiling/<str:session>/<str:name>', views.profiling_download, name='profiling_download'),
     path('api-auth/', include('rest_framework.urls')),
 ]
\ No newline at end of file
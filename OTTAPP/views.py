@@ -1,5 +1,5 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, JsonResponse, StreamingHttpResponse, Http404
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse, Http404
 from django.views import View
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.forms import AuthenticationForm, PasswordChangeForm
@@ -12,13 +12,18 @@ from django.core.paginator import Paginator
 from django.utils import timezone
 from django.views.decorators.cache import cache_page
 from django.views.decorators.vary import vary_on_headers
+from django.views.decorators.http import require_GET
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
 from rest_framework import viewsets, status
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
 from rest_framework.views import APIView
 import logging
 import os
+import re
+import time
 import mimetypes
 from django.views.decorators.cache import cache_page
 from django.utils.decorators import method_decorator
@@ -29,12 +34,22 @@ from .forms import (
 )
 from .models import (
     UserProfile, Movie, Subscription, Genre, Watchlist, 
-    MovieRating, UserActivity
+    MovieRating, UserActivity, UserActivityRollup, WatchProgress
 )
+from .activity import activity_summary
+from .catalog_version import catalog_condition, get_version
+from .changes import ExpiredCursor, InvalidCursor, get_changes
+from .content_similarity import get_content_index
+from .fast_serializers import FastSerializer, movie_fast, movie_list_fast, watch_progress_fast, watchlist_fast
+from .feeds import build_home_feed
+from .recommendations import get_neighbour_index
+from . import db_routers, metrics, playback, profiling, watch_progress, watchlist_cache
+from .watchlist_cache import get_request_watchlist
 from .serializers import (
     MovieSerializer, MovieListSerializer, MovieDetailSerializer,
     UserSerializer, UserProfileSerializer, SubscriptionSerializer,
-    WatchlistSerializer, MovieRatingSerializer, UserActivitySerializer
+    WatchlistSerializer, MovieRatingSerializer, UserActivitySerializer, UserActivityRollupSerializer,
+    SparseFieldsMixin, parse_fields
 )
 
 logger = logging.getLogger(__name__)
@@ -152,8 +167,14 @@ class MovieListView(LoginRequiredMixin, View):
     template_name = 'movies_list.html'
     login_url = '/signin/'  
 
-    @method_decorator(cache_page(60 * 15))  # cache GET requests for 15 min
+    @method_decorator(catalog_condition('movies', 'genres', per_user=True))
     def get(self, request, *args, **kwargs):
+        # Cache GET requests for 15 min, keyed on the catalog and watchlist versions
+        # so edits and watchlist badges show up straight away
+        key_prefix = f'movie_list:{get_version()}:{get_request_watchlist(request).version}'
+        return cache_page(60 * 15, key_prefix=key_prefix)(self.render_page)(request, *args, **kwargs)
+
+    def render_page(self, request, *args, **kwargs):
         try:
             # Get query parameters
             search_query = request.GET.get('search', '')
@@ -205,6 +226,7 @@ class MovieListView(LoginRequiredMixin, View):
                 'selected_genre': genre,
                 'featured': featured,
                 'trending': trending,
+                'watchlist_ids': get_request_watchlist(request),
             }
             
             return render(request, self.template_name, context)
@@ -217,6 +239,9 @@ class MovieListView(LoginRequiredMixin, View):
 
 def stream_video(request, movie_id):
     """Stream video file for better performance"""
+    # Time to first byte counts from the start of the request
+    timings = metrics.current_timings()
+    started = timings.started if timings else time.perf_counter()
     try:
         movie = get_object_or_404(Movie, id=movie_id)
         
@@ -231,20 +256,7 @@ def stream_video(request, movie_id):
                 raise Http404("Active subscription required")
         except Subscription.DoesNotExist:
             raise Http404("Subscription required")
-        
-        # Increment view count
-        movie.view_count += 1
-        movie.save()
-        
-        # Log user activity
-        UserActivity.objects.create(
-            user=request.user,
-            activity_type='movie_view',
-            description=f'Viewed movie: {movie.title}',
-            movie=movie,
-            ip_address=request.META.get('REMOTE_ADDR'),
-            user_agent=request.META.get('HTTP_USER_AGENT', '')
-        )
+        plan = subscription.subscription_plan
         
         # Get file path
         file_path = movie.video.path
@@ -255,29 +267,44 @@ def stream_video(request, movie_id):
         # Get file size
         file_size = os.path.getsize(file_path)
         
+        # View count and movie_view activity are written once per session,
+        # when it is finished, not on every range request. The range is
+        # accounted when its stream ends, with the bytes actually sent
+        def record_playback(sent):
+            try:
+                playback.record_range(request, movie, first_byte, sent, file_size, plan=plan)
+            except Exception as e:
+                logger.error(f"Error recording playback of movie {movie_id}: {e}")
+        
         # Get range header for partial content
         range_header = request.META.get('HTTP_RANGE', '').strip()
-        range_match = range_header.match(r'bytes=(\d*)-(\d*)')
+        range_match = re.match(r'bytes=(\d*)-(\d*)', range_header)
         
         if range_match:
             first_byte, last_byte = range_match.groups()
             first_byte = int(first_byte) if first_byte else 0
-            last_byte = int(last_byte) if last_byte else file_size - 1
+            last_byte = min(int(last_byte), file_size - 1) if last_byte else file_size - 1
             
             if first_byte >= file_size:
                 return HttpResponse(status=416)
             
             length = last_byte - first_byte + 1
             response = StreamingHttpResponse(
-                file_generator(file_path, first_byte, length),
+                metrics.instrument_stream(
+                    file_generator(file_path, first_byte, length), movie.pk, plan, first_byte, file_size, started,
+                    on_end=record_playback,
+                ),
                 status=206
             )
             response['Content-Range'] = f'bytes {first_byte}-{last_byte}/{file_size}'
             response['Accept-Ranges'] = 'bytes'
             response['Content-Length'] = str(length)
         else:
+            first_byte = 0
             response = StreamingHttpResponse(
-                file_generator(file_path),
+                metrics.instrument_stream(
+                    file_generator(file_path), movie.pk, plan, 0, file_size, started, on_end=record_playback
+                ),
                 status=200
             )
             response['Content-Length'] = str(file_size)
@@ -298,21 +325,78 @@ def file_generator(file_path, start=0, length=None):
     with open(file_path, 'rb') as f:
         f.seek(start)
         remaining = length
-        while True:
-            if remaining:
-                chunk_size = min(8192, remaining)
-                remaining -= chunk_size
-            else:
-                chunk_size = 8192
-            
+        # Stop at the end of the range, not of the file
+        while remaining is None or remaining > 0:
+            chunk_size = 8192 if remaining is None else min(8192, remaining)
             chunk = f.read(chunk_size)
             if not chunk:
                 break
+            if remaining is not None:
+                remaining -= len(chunk)
             yield chunk
 
 
+MAX_BULK_IDS = 200
+CONTINUE_WATCHING_LIMIT = 20
+ACTIVITY_LIMIT = 50
+MAX_SUMMARY_DAYS = 366
+
+
+def parse_ids(values):
+    """
+    Parse movie ids from a list or a comma separated string, in request
+    order. Values that are not ids come back as ``(value, None)``; anything
+    but a list or a string gives None.
+    """
+    if isinstance(values, str):
+        values = [value.strip() for value in values.split(',') if value.strip()]
+    elif not isinstance(values, list):
+        return None
+    parsed = []
+    for value in values:
+        try:
+            parsed.append((value, int(value)))
+        except (TypeError, ValueError):
+            parsed.append((value, None))
+    return parsed
+
+
 # API Viewsets
-class MovieViewSet(viewsets.ReadOnlyModelViewSet):
+class SparseFieldsViewMixin:
+    """
+    ``?fields=`` and ``?expand=`` for viewsets whose serializers use
+    SparseFieldsMixin, e.g. ``?fields=id,title,thumbnail`` or
+    ``?fields=id,genre.name&expand=genre``. The queryset is pruned to match.
+    """
+
+    def get_sparse_options(self):
+        return {
+            param: parse_fields(self.request.query_params[param])
+            for param in ('fields', 'expand')
+            if param in self.request.query_params
+        }
+
+    def get_serializer(self, *args, **kwargs):
+        if issubclass(self.get_serializer_class(), SparseFieldsMixin):
+            kwargs.update(self.get_sparse_options())
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        serializer = self.get_serializer()
+        if isinstance(serializer, SparseFieldsMixin):
+            queryset = serializer.optimize(queryset)
+        return queryset
+
+    def sparse_fast(self, fast):
+        """``fast``, recompiled for the requested fields if the request has any"""
+        options = self.get_sparse_options()
+        if not options:
+            return fast
+        return FastSerializer(fast.serializer_class(**options), fast.strings)
+
+
+class MovieViewSet(SparseFieldsViewMixin, viewsets.ReadOnlyModelViewSet):
     """API viewset for movies"""
     queryset = Movie.objects.all()
     serializer_class = MovieSerializer
@@ -324,7 +408,90 @@ class MovieViewSet(viewsets.ReadOnlyModelViewSet):
         elif self.action == 'retrieve':
             return MovieDetailSerializer
         return MovieSerializer
+
+    def serialize_movies(self, fast, rows):
+        """Serialize values() rows (including 'id') and flag the ones on the user's watchlist"""
+        rows = list(rows)
+        movies = fast.serialize(rows, self.get_serializer_context())
+        fields = self.get_sparse_options().get('fields')
+        if fields is None or 'in_watchlist' in fields:
+            watchlist = get_request_watchlist(self.request)
+            for row, movie in zip(rows, movies):
+                movie['in_watchlist'] = row['id'] in watchlist
+        return movies
+
+    def fast_response(self, fast, queryset):
+        """Response for a read-only list shape, built from values() rows"""
+        fast = self.sparse_fast(fast)
+        return Response(self.serialize_movies(fast, fast.values(queryset, 'id')))
+
+    @method_decorator(catalog_condition('movies', 'genres', per_user=True))
+    def list(self, request, *args, **kwargs):
+        # Same output as MovieListSerializer without the per-field overhead
+        fast = self.sparse_fast(movie_list_fast)
+        queryset = fast.values(self.filter_queryset(self.get_queryset()), 'id')
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.serialize_movies(fast, page))
+        return Response(self.serialize_movies(fast, queryset))
     
+    @action(detail=False, methods=['get'])
+    @method_decorator(catalog_condition('movies', 'genres', per_user=True))
+    def bulk(self, request):
+        """Get several movies by id (?ids=3,1,7), in request order with a status per id"""
+        parsed = parse_ids(request.query_params.get('ids', ''))
+        if not parsed:
+            return Response({'error': 'ids is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(parsed) > MAX_BULK_IDS:
+            return Response(
+                {'error': f'At most {MAX_BULK_IDS} ids per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fast = self.sparse_fast(movie_fast)
+        ids = {movie_id for _, movie_id in parsed if movie_id is not None}
+        rows = list(fast.values(Movie.objects.filter(id__in=ids), 'id'))
+        movies = {row['id']: movie for row, movie in zip(rows, self.serialize_movies(fast, rows))}
+
+        results = []
+        for value, movie_id in parsed:
+            if movie_id is None:
+                results.append({'id': value, 'status': 'invalid', 'movie': None})
+            elif movie_id in movies:
+                results.append({'id': movie_id, 'status': 'ok', 'movie': movies[movie_id]})
+            else:
+                results.append({'id': movie_id, 'status': 'not_found', 'movie': None})
+        return Response({'results': results})
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """Movies changed and deleted since ?cursor= (omit it for a full sync)"""
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 500)), 1000))
+        except ValueError:
+            return Response({'error': 'Invalid limit'}, status=status.HTTP_400_BAD_REQUEST)
+
+        fast = self.sparse_fast(movie_fast)
+        # A cursor must not move past rows a lagging replica has not received yet
+        with db_routers.primary():
+            try:
+                upserts, deletes, cursor, has_more = get_changes(fast, request.query_params.get('cursor'), limit)
+            except InvalidCursor:
+                return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+            except ExpiredCursor:
+                return Response(
+                    {'error': 'Cursor expired, sync again without a cursor'},
+                    status=status.HTTP_410_GONE
+                )
+            upserts = fast.serialize(upserts, self.get_serializer_context())
+
+        return Response({
+            'upserts': upserts,
+            'deletes': deletes,
+            'cursor': cursor,
+            'has_more': has_more,
+        })
+
     @action(detail=False, methods=['get'])
     def search(self, request):
         """Search movies by title, description, director, or cast"""
@@ -339,21 +506,71 @@ class MovieViewSet(viewsets.ReadOnlyModelViewSet):
         else:
             movies = self.queryset.none()
         
-        serializer = self.get_serializer(movies, many=True)
-        return Response(serializer.data)
+        return self.fast_response(movie_fast, movies)
     
     @action(detail=False, methods=['get'])
+    @method_decorator(catalog_condition('featured', 'genres', per_user=True))
     def featured(self, request):
         """Get featured movies"""
         movies = self.queryset.filter(is_featured=True)
-        serializer = self.get_serializer(movies, many=True)
-        return Response(serializer.data)
+        return self.fast_response(movie_fast, movies)
     
     @action(detail=False, methods=['get'])
+    @method_decorator(catalog_condition('trending', 'genres', per_user=True))
     def trending(self, request):
         """Get trending movies"""
         movies = self.queryset.filter(is_trending=True)
-        serializer = self.get_serializer(movies, many=True)
+        return self.fast_response(movie_fast, movies)
+    
+    @action(detail=True, methods=['get'])
+    def neighbours(self, request, pk=None):
+        """Movies most often watched together with this one"""
+        try:
+            movie_id = int(pk)
+            limit = int(request.query_params.get('limit', 10))
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid movie id or limit'}, status=status.HTTP_400_BAD_REQUEST)
+
+        limit = max(1, min(limit, 100))
+        source = 'interactions'
+        neighbours = get_neighbour_index().neighbours(movie_id, limit)
+        if not neighbours:
+            # New titles have no watch history yet, fall back to metadata
+            similar = get_content_index().similar(movie_id, limit)
+            if similar or neighbours is None:
+                source, neighbours = 'content', similar
+        if neighbours is None:
+            return Response({'error': 'No recommendations for this movie'}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            'movie_id': movie_id,
+            'source': source,
+            'neighbours': [{'id': neighbour_id, 'score': score} for neighbour_id, score in neighbours],
+        })
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """Titles with similar metadata (genre, director, cast, language, description)"""
+        try:
+            movie_id = int(pk)
+            limit = max(1, min(int(request.query_params.get('limit', 10)), 100))
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid movie id or limit'}, status=status.HTTP_400_BAD_REQUEST)
+
+        similar = get_content_index().similar(
+            movie_id, limit,
+            language=request.query_params.get('language') or None,
+            certification=request.query_params.get('certification') or None,
+        )
+        if similar is None:
+            return Response({'error': 'Movie is not in the similarity index'}, status=status.HTTP_404_NOT_FOUND)
+
+        serializer = MovieListSerializer(context=self.get_serializer_context(), **self.get_sparse_options())
+        movies = serializer.optimize(Movie.objects.all()).in_bulk([similar_id for similar_id, _ in similar])
+        results = [movies[similar_id] for similar_id, _ in similar if similar_id in movies]
+        serializer = MovieListSerializer(
+            results, many=True, context=self.get_serializer_context(), **self.get_sparse_options()
+        )
         return Response(serializer.data)
     
     @action(detail=True, methods=['post'])
@@ -383,6 +600,29 @@ class MovieViewSet(viewsets.ReadOnlyModelViewSet):
         serializer = MovieRatingSerializer(rating_obj)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get', 'post'])
+    def progress(self, request, pk=None):
+        """Resume position; players POST {"position": seconds} every few seconds"""
+        try:
+            movie_id = int(pk)
+        except ValueError:
+            raise Http404
+        if request.method == 'GET':
+            return Response({'movie_id': movie_id, 'position': watch_progress.get_position(request.user.pk, movie_id)})
+
+        try:
+            position = int(request.data.get('position'))
+        except (TypeError, ValueError):
+            position = -1
+        if position < 0:
+            return Response(
+                {'error': 'position must be a non-negative number of seconds'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        # Buffered in a shared cache; flush_watch_progress writes it to the database
+        watch_progress.record(request.user.pk, movie_id, position)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
     @action(detail=True, methods=['post'])
     def add_to_watchlist(self, request, pk=None):
         """Add movie to user's watchlist"""
@@ -393,6 +633,7 @@ class MovieViewSet(viewsets.ReadOnlyModelViewSet):
         )
         
         if created:
+            watchlist_cache.invalidate(request.user.pk)
             return Response({'message': 'Added to watchlist'}, status=status.HTTP_201_CREATED)
         else:
             return Response({'message': 'Already in watchlist'}, status=status.HTTP_200_OK)
@@ -404,12 +645,13 @@ class MovieViewSet(viewsets.ReadOnlyModelViewSet):
         try:
             watchlist = Watchlist.objects.get(user=request.user, movie=movie)
             watchlist.delete()
+            watchlist_cache.invalidate(request.user.pk)
             return Response({'message': 'Removed from watchlist'}, status=status.HTTP_200_OK)
         except Watchlist.DoesNotExist:
             return Response({'error': 'Not in watchlist'}, status=status.HTTP_404_NOT_FOUND)
 
 
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
+class UserViewSet(SparseFieldsViewMixin, viewsets.ReadOnlyModelViewSet):
     """API viewset for users"""
     queryset = User.objects.all()
     serializer_class = UserSerializer
@@ -425,32 +667,202 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
     def watchlist(self, request):
         """Get user's watchlist"""
         watchlist = Watchlist.objects.filter(user=request.user)
-        serializer = WatchlistSerializer(watchlist, many=True)
-        return Response(serializer.data)
+        fast = self.sparse_fast(watchlist_fast)
+        return Response(fast.serialize(fast.values(watchlist)))
     
+    def _watchlist_ids(self, request):
+        parsed = parse_ids(request.data.get('movie_ids'))
+        ids = [movie_id for _, movie_id in parsed or []]
+        if not ids or None in ids:
+            return None, Response(
+                {'error': 'movie_ids must be a non-empty list of movie ids'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(ids) > MAX_BULK_IDS:
+            return None, Response(
+                {'error': f'At most {MAX_BULK_IDS} movie ids per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return ids, None
+
+    @action(detail=False, methods=['post'], url_path='watchlist/add')
+    def watchlist_add(self, request):
+        """Add several movies to the watchlist: {"movie_ids": [1, 2, 3]}"""
+        ids, error = self._watchlist_ids(request)
+        if error:
+            return error
+
+        found = set(Movie.objects.filter(id__in=ids).order_by().values_list('id', flat=True))
+        existing = set(
+            Watchlist.objects.filter(user=request.user, movie_id__in=found).values_list('movie_id', flat=True)
+        )
+        new_ids = list(dict.fromkeys(movie_id for movie_id in ids if movie_id in found and movie_id not in existing))
+        # Rows added concurrently by another request are skipped by the unique constraint
+        Watchlist.objects.bulk_create(
+            [Watchlist(user=request.user, movie_id=movie_id) for movie_id in new_ids],
+            ignore_conflicts=True
+        )
+        if new_ids:
+            watchlist_cache.invalidate(request.user.pk)
+
+        added = set(new_ids)
+        results = [
+            {'movie_id': movie_id, 'status': (
+                'added' if movie_id in added else 'exists' if movie_id in existing else 'not_found'
+            )}
+            for movie_id in ids
+        ]
+        return Response({'added': len(added), 'results': results})
+
+    @action(detail=False, methods=['post'], url_path='watchlist/remove')
+    def watchlist_remove(self, request):
+        """Remove several movies from the watchlist: {"movie_ids": [1, 2, 3]}"""
+        ids, error = self._watchlist_ids(request)
+        if error:
+            return error
+
+        present = set(
+            Watchlist.objects.filter(user=request.user, movie_id__in=ids).values_list('movie_id', flat=True)
+        )
+        removed = 0
+        if present:
+            # No signals or cascades hang off Watchlist, so this is a single DELETE ... IN
+            removed, _ = Watchlist.objects.filter(user=request.user, movie_id__in=present).delete()
+            watchlist_cache.invalidate(request.user.pk)
+
+        results = [
+            {'movie_id': movie_id, 'status': 'removed' if movie_id in present else 'not_in_watchlist'}
+            for movie_id in ids
+        ]
+        return Response({'removed': removed, 'results': results})
+
+    @action(detail=False, methods=['get'])
+    def continue_watching(self, request):
+        """Movies the user started and has not finished, most recent first"""
+        progress = (
+            WatchProgress.objects
+            .filter(user=request.user, completed=False)
+            .order_by('-updated_at')[:CONTINUE_WATCHING_LIMIT]
+        )
+        return Response(watch_progress_fast.serialize(
+            watch_progress_fast.values(progress), self.get_serializer_context()
+        ))
+
     @action(detail=False, methods=['get'])
     def activity(self, request):
-        """Get user's activity"""
-        activity = UserActivity.objects.filter(user=request.user)[:50]
-        serializer = UserActivitySerializer(activity, many=True)
-        return Response(serializer.data)
+        """Get user's activity, newest first; past retention as daily counts"""
+        # prefetch rather than join: activity may be in the events database
+        activity = list(UserActivity.objects.filter(user=request.user).prefetch_related(
+            'user__userprofile', 'movie__genre'
+        )[:ACTIVITY_LIMIT])
+        data = list(UserActivitySerializer(activity, many=True).data)
+        if len(activity) < ACTIVITY_LIMIT:
+            # Raw rows are only kept for ACTIVITY_RETENTION_DAYS; older ones were rolled up
+            rollups = UserActivityRollup.objects.filter(user=request.user).prefetch_related(
+                'user__userprofile', 'movie__genre'
+            ).order_by('-day', 'activity_type', 'pk')[:ACTIVITY_LIMIT - len(activity)]
+            data += UserActivityRollupSerializer(rollups, many=True).data
+        return Response(data)
+
+    @action(detail=False, methods=['get'], url_path='activity/summary')
+    def activity_summary(self, request):
+        """Daily activity counts for the last ?days= days, including rolled up history"""
+        try:
+            days = int(request.query_params.get('days', 30))
+        except ValueError:
+            days = 0
+        if not 1 <= days <= MAX_SUMMARY_DAYS:
+            return Response(
+                {'error': f'days must be between 1 and {MAX_SUMMARY_DAYS}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(activity_summary(request.user.pk, days))
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def movie_statistics(request):
     """Get movie statistics"""
+    # The totals need every row anyway (no index serves them), so one pass
+    totals = Movie.objects.aggregate(
+        total_movies=Count('id'),
+        featured_movies=Count('id', filter=Q(is_featured=True)),
+        trending_movies=Count('id', filter=Q(is_trending=True)),
+        total_views=Sum('view_count'),
+        average_rating=Avg('rating'),
+    )
     stats = {
-        'total_movies': Movie.objects.count(),
-        'featured_movies': Movie.objects.filter(is_featured=True).count(),
-        'trending_movies': Movie.objects.filter(is_trending=True).count(),
-        'total_views': Movie.objects.aggregate(total=Sum('view_count'))['total'] or 0,
-        'average_rating': Movie.objects.aggregate(avg=Avg('rating'))['avg'] or 0,
+        'total_movies': totals['total_movies'],
+        'featured_movies': totals['featured_movies'],
+        'trending_movies': totals['trending_movies'],
+        'total_views': totals['total_views'] or 0,
+        'average_rating': totals['average_rating'] or 0,
         'movies_by_language': dict(Movie.objects.values('language').annotate(count=Count('id')).values_list('language', 'count')),
     }
     return Response(stats)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def home_feed(request):
+    """All home page rows (featured, trending, languages, watchlist) in one response"""
+    return Response(build_home_feed(request))
+
+
+@require_GET
+def prometheus_metrics(request):
+    """Per-route request metrics of every worker process on this host, for Prometheus to scrape"""
+    if settings.METRICS_TOKEN:
+        if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {settings.METRICS_TOKEN}'):
+            return HttpResponse(status=401)
+    elif not settings.DEBUG:
+        raise Http404
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@api_view(['GET', 'POST', 'DELETE'])
+@permission_classes([IsAdminUser])
+def profiling_sessions(request):
+    """
+    Staff only, with PROFILING on. GET: the running session and this host's
+    profiles. POST kind=cpu|heap, requests, seconds, interval_ms: start a
+    session the workers join on their next request. DELETE: end it.
+    """
+    if not settings.PROFILING:
+        raise Http404
+    if request.method == 'DELETE':
+        profiling.stop()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    if request.method == 'GET':
+        return Response({'session': profiling.current(), 'profiles': profiling.profiles()})
+
+    try:
+        numbers = {
+            name: cast(request.data[name]) for name, cast in
+            (('requests', int), ('seconds', float), ('interval_ms', float)) if request.data.get(name) not in (None, '')
+        }
+        session = profiling.new_session(request.data.get('kind', 'cpu'), **numbers)
+    except (TypeError, ValueError) as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if not profiling.start(session):
+        return Response(
+            {'error': 'A session is running; wait for it or DELETE it', 'session': profiling.current()},
+            status=status.HTTP_409_CONFLICT
+        )
+    logger.info(f"{request.user.username} started {session['kind']} profiling session {session['id']}")
+    return Response(session, status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profiling_download(request, session, name):
+    """Staff only: a profile written on this host, ``<pid>.cpu.folded`` or ``<pid>.heap.txt``"""
+    path = profiling.profile_path(session, name) if settings.PROFILING else None
+    if path is None or not os.path.isfile(path):
+        raise Http404
+    return FileResponse(open(path, 'rb'), as_attachment=True, content_type='text/plain; charset=utf-8')
+
+
 
 
 
@@ -499,6 +911,7 @@ def subscribe(request):
 
 
 
+@catalog_condition('language:Tamil', per_user=True)
 def movie_tamil(request):
     # Filter movies by language (e.g., Tamil)
     tamil_movies = Movie.objects.filter(language='Tamil')
@@ -507,6 +920,7 @@ def movie_tamil(request):
     return render(request, 'tamil.html', context)
 
 
+@catalog_condition('language:Malayalam', per_user=True)
 def movie_malayalam(request):
     # Filter movies by language (e.g., malayalam)
     tamil_movies = Movie.objects.filter(language='Malayalam')
@@ -514,6 +928,7 @@ def movie_malayalam(request):
     context = {'movies': tamil_movies}
     return render(request, 'malayalam.html', context)
 
+@catalog_condition('language:Telugu', per_user=True)
 def movie_telugu(request):
     # Filter movies by language (e.g., Telugu)
     tamil_movies = Movie.objects.filter(language='Telugu')
@@ -523,6 +938,7 @@ def movie_telugu(request):
 
 
 
+@catalog_condition('language:English', per_user=True)
 def movie_english(request):
     # Filter movies by language (e.g., english)
     tamil_movies = Movie.objects.filter(language='English')
@@ -531,6 +947,7 @@ def movie_english(request):
     return render(request, 'english.html', context)
 
 
+@catalog_condition('language:Hindi', per_user=True)
 def movie_hindi(request):
     # Filter movies by language (e.g., hindi)
     tamil_movies = Movie.objects.filter(language='hindi')
@@ -0,0 +1,96 @@
+"""
+Resume positions.
+
+Players report the playback position every few seconds. A heartbeat only
+writes the position to the cache; repeated heartbeats for the same movie
+overwrite each other (last write wins), and the first one since the last
+flush notes the ``(user, movie)`` pair in a journal.
+
+``manage.py flush_watch_progress`` upserts the latest position of every
+noted pair into WatchProgress in bulk, so the database sees one row write per
+movie being watched per flush, however often players report.
+
+The flush command only sees the heartbeats when the workers share the cache
+(Redis, see ``REDIS_URL``). With a per-process cache each heartbeat is
+upserted straight away instead.
+"""
+import logging
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from .buffers import CacheJournal, cache_is_shared
+from .models import Movie, WatchProgress
+from .upserts import upsert
+
+logger = logging.getLogger(__name__)
+
+POSITION_TIMEOUT = 60 * 60 * 24
+POSITION_KEY = 'progress:{}:{}'
+PENDING_KEY = 'progress:pending:{}:{}'
+# Past this share of the running time a movie counts as watched
+COMPLETED_RATIO = 0.95
+
+journal = CacheJournal('watch_progress', timeout=POSITION_TIMEOUT)
+
+
+def record(user_id, movie_id, position):
+    """Buffer a heartbeat; no database access with a shared cache"""
+    if not cache_is_shared():
+        _save({(user_id, movie_id): (position, time.time())})
+        return
+    cache.set(POSITION_KEY.format(user_id, movie_id), (position, time.time()), POSITION_TIMEOUT)
+    if cache.add(PENDING_KEY.format(user_id, movie_id), True, POSITION_TIMEOUT):
+        journal.append((user_id, movie_id))
+
+
+def get_position(user_id, movie_id):
+    """The latest known position in seconds, buffered or saved"""
+    buffered = cache.get(POSITION_KEY.format(user_id, movie_id))
+    if buffered is not None:
+        return buffered[0]
+    saved = WatchProgress.objects.filter(user_id=user_id, movie_id=movie_id).values_list('position', flat=True)
+    return next(iter(saved), 0)
+
+
+def flush_progress():
+    """Upsert the buffered positions into WatchProgress; returns how many"""
+    pairs = list(dict.fromkeys(tuple(pair) for pair in journal.drain()))
+    if not pairs:
+        return 0
+
+    # Clear the markers before reading, so a heartbeat arriving meanwhile is journalled again
+    cache.delete_many([PENDING_KEY.format(*pair) for pair in pairs])
+    found = cache.get_many([POSITION_KEY.format(*pair) for pair in pairs])
+    saved = _save({
+        pair: found[POSITION_KEY.format(*pair)] for pair in pairs if POSITION_KEY.format(*pair) in found
+    })
+    logger.info("Saved %d watch positions", saved)
+    return saved
+
+
+def _save(heartbeats):
+    """Upsert ``{(user id, movie id): (position, heard at)}``; returns how many rows were written"""
+    # Skip users and movies deleted since the heartbeat
+    user_ids = set(User.objects.filter(pk__in={user_id for user_id, _ in heartbeats}).values_list('pk', flat=True))
+    durations = dict(
+        Movie.objects.filter(pk__in={movie_id for _, movie_id in heartbeats}).values_list('pk', 'duration')
+    )
+
+    rows = []
+    for (user_id, movie_id), (position, heard_at) in heartbeats.items():
+        if user_id not in user_ids or movie_id not in durations:
+            continue
+        duration = durations[movie_id]
+        rows.append(WatchProgress(
+            user_id=user_id,
+            movie_id=movie_id,
+            position=position,
+            completed=bool(duration) and position >= duration.total_seconds() * COMPLETED_RATIO,
+            updated_at=datetime.fromtimestamp(heard_at, tz=dt_timezone.utc),
+        ))
+
+    upsert(WatchProgress, rows, unique_fields=['user', 'movie'], update_fields=['position', 'completed', 'updated_at'])
+    return len(rows)
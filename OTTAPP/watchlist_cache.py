@@ -0,0 +1,117 @@
+"""
+Per-user watchlist membership, kept in the cache.
+
+Each user's watchlist is one cache entry: the sorted movie ids as an
+``array('q')`` blob, tagged with the user's watchlist version. A request loads
+it once (``get_request_watchlist``) and every card on the page is checked
+against the in-memory set, so "in watchlist" badges cost no queries however
+large the page is.
+
+After a change (``invalidate``) the version is bumped with ``cache.incr`` and
+the entry deleted; the next read reloads it from the database. Nothing reads,
+modifies and writes back the entry, so concurrent changes cannot overwrite
+each other, and an entry tagged with an older version is never used. The
+version is part of per-user ETags and page cache keys, so a changed watchlist
+is never served from an older response. The time of the last change is kept
+too, for per-user Last-Modified headers.
+"""
+import time
+from array import array
+
+from django.core.cache import cache
+
+from .models import Watchlist
+
+CACHE_KEY = 'watchlist:ids:{}'
+VERSION_KEY = 'watchlist:version:{}'
+MODIFIED_KEY = 'watchlist:modified:{}'
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def _seed():
+    return time.time_ns() // 1000
+
+
+def encode_ids(ids):
+    return array('q', ids).tobytes()
+
+
+def decode_ids(blob):
+    ids = array('q')
+    ids.frombytes(blob)
+    return ids.tolist()
+
+
+class WatchlistIds:
+    """The movie ids on one user's watchlist; ``movie_id in ids`` is a set lookup"""
+
+    __slots__ = ('version', 'ids')
+
+    def __init__(self, version, ids):
+        self.version = version
+        self.ids = frozenset(ids)
+
+    def __contains__(self, movie_id):
+        return movie_id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+
+EMPTY = WatchlistIds(0, ())
+
+
+def get_version(user_id):
+    key = VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    if version is None:
+        # Never set or evicted: start again from the current time, above any version handed out before
+        cache.add(key, _seed(), CACHE_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def get_modified(user_id):
+    """When the user's watchlist last changed, as a timestamp"""
+    key = MODIFIED_KEY.format(user_id)
+    modified = cache.get(key)
+    if modified is None:
+        # Never set or evicted: count it as changed now
+        cache.add(key, time.time(), CACHE_TIMEOUT)
+        modified = cache.get(key)
+    return modified
+
+
+def load(user_id):
+    """The user's watchlist ids; two cache reads, plus one query on a miss"""
+    version = get_version(user_id)
+    entry = cache.get(CACHE_KEY.format(user_id))
+    if entry is None or entry[0] != version:
+        # Read after the version: a change committed meanwhile leaves this entry behind its version
+        ids = Watchlist.objects.filter(user_id=user_id).order_by('movie_id').values_list('movie_id', flat=True)
+        entry = (version, encode_ids(ids))
+        cache.set(CACHE_KEY.format(user_id), entry, CACHE_TIMEOUT)
+    return WatchlistIds(version, decode_ids(entry[1]))
+
+
+def get_request_watchlist(request):
+    """``load()`` for the request's user, at most once per request"""
+    if not hasattr(request, '_watchlist_ids'):
+        user = request.user
+        request._watchlist_ids = load(user.pk) if user.is_authenticated else EMPTY
+    return request._watchlist_ids
+
+
+def invalidate(*user_ids):
+    """Mark the watchlists of ``user_ids`` as changed, after the database write"""
+    for user_id in user_ids:
+        key = VERSION_KEY.format(user_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _seed(), CACHE_TIMEOUT)
+    cache.set_many({MODIFIED_KEY.format(user_id): time.time() for user_id in user_ids}, CACHE_TIMEOUT)
+    cache.delete_many([CACHE_KEY.format(user_id) for user_id in user_ids])
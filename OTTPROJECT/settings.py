@@ -61,17 +61,29 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'OTTAPP.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        # Binary formats for constrained clients, via Accept (if installed)
+        'OTTAPP.renderers.MessagePackRenderer',
+        'OTTAPP.renderers.CBORRenderer',
+    ],
+    'DEFAULT_CONTENT_NEGOTIATION_CLASS': 'OTTAPP.renderers.AvailableRendererNegotiation',
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
 }
 
 MIDDLEWARE = [
+    'OTTAPP.middleware.PerformanceMiddleware',
+    'OTTAPP.middleware.ProfilingMiddleware',
+    'OTTAPP.middleware.QueryInspectorMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'OTTAPP.middleware.PrimaryStickinessMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -90,7 +102,7 @@ ROOT_URLCONF = 'OTTPROJECT.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'OTTAPP.metrics.InstrumentedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR,'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -122,6 +134,44 @@ DATABASES = {
     }
 }
 
+# Read replicas for catalog reads: DB_REPLICA_HOSTS=host1,host2:3307
+# (same name and credentials as the primary, see OTTAPP/db_routers.py)
+REPLICA_DATABASES = []
+for number, replica in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), start=1):
+    replica_host, _, replica_port = replica.strip().partition(':')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': replica_host,
+        'PORT': replica_port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(f'replica{number}')
+
+# Append-only event tables (activity, playback sessions) in their own database:
+# EVENTS_DB_NAME and optionally EVENTS_DB_HOST / EVENTS_DB_PORT / EVENTS_DB_USER /
+# EVENTS_DB_PASSWORD (defaulting to the primary's). See OTTAPP/db_routers.py.
+EVENTS_DATABASE = 'default'
+if os.getenv('EVENTS_DB_NAME'):
+    DATABASES['events'] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('EVENTS_DB_NAME'),
+        'USER': os.getenv('EVENTS_DB_USER', DATABASES['default']['USER']),
+        'PASSWORD': os.getenv('EVENTS_DB_PASSWORD', DATABASES['default']['PASSWORD']),
+        'HOST': os.getenv('EVENTS_DB_HOST', DATABASES['default']['HOST']),
+        'PORT': os.getenv('EVENTS_DB_PORT', DATABASES['default']['PORT']),
+        # Appends only: keep connections open and skip gap locks between inserts
+        'CONN_MAX_AGE': 60,
+        'OPTIONS': {'isolation_level': 'read committed'},
+    }
+    EVENTS_DATABASE = 'events'
+
+DATABASE_ROUTERS = ['OTTAPP.db_routers.EventRouter', 'OTTAPP.db_routers.ReplicaRouter']
+# Replicas further behind than this are skipped, and catalog reads stay on
+# the primary for this long after a catalog change
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '5'))
+# A client that wrote reads from the primary for this long
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', '10'))
+
 
 
 # Password validation
@@ -172,13 +222,22 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
-# Caching configuration - Using local memory cache for now
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+# Caching configuration - Redis when REDIS_URL is set so all workers share
+# one cache, local memory cache otherwise
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'OTTAPP.metrics.InstrumentedRedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'OTTAPP.metrics.InstrumentedLocMemCache',
+            'LOCATION': 'unique-snowflake',
+        }
     }
-}
 
 # Session configuration - Using database sessions for now
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
@@ -245,3 +304,60 @@ EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
 STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY', '')
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', '')
 
+# Recommendations
+RECOMMENDATIONS_INDEX_PATH = os.getenv(
+    'RECOMMENDATIONS_INDEX_PATH', os.path.join(BASE_DIR, 'data', 'item_neighbours.npy')
+)
+RECOMMENDATIONS_TOP_K = int(os.getenv('RECOMMENDATIONS_TOP_K', '50'))
+CONTENT_SIMILARITY_DIR = os.getenv(
+    'CONTENT_SIMILARITY_DIR', os.path.join(BASE_DIR, 'data', 'content_index')
+)
+CONTENT_SIMILARITY_DIMS = int(os.getenv('CONTENT_SIMILARITY_DIMS', '512'))
+
+# Changes feed (delta sync)
+# Changes younger than this are held back, so transactions still committing
+# older timestamps cannot be skipped by a client's cursor
+CHANGES_SAFETY_WINDOW = int(os.getenv('CHANGES_SAFETY_WINDOW', '5'))
+CHANGES_TOMBSTONE_DAYS = int(os.getenv('CHANGES_TOMBSTONE_DAYS', '90'))
+
+
+# Playback sessions
+# A player that makes no range request for this long has finished its session
+PLAYBACK_IDLE_SECONDS = int(os.getenv('PLAYBACK_IDLE_SECONDS', '600'))
+
+# User activity retention
+# Raw activity older than this is rolled up into daily counts and deleted;
+# keep it above the personalised feeds' 30 day window
+ACTIVITY_RETENTION_DAYS = int(os.getenv('ACTIVITY_RETENTION_DAYS', '90'))
+ACTIVITY_ROLLUP_CHUNK_SIZE = int(os.getenv('ACTIVITY_ROLLUP_CHUNK_SIZE', '2000'))
+
+# Catalog ingestion
+# Probes videos for their duration; skipped when not installed
+FFPROBE_PATH = os.getenv('FFPROBE_PATH', 'ffprobe')
+
+# Performance metrics (see OTTAPP/metrics.py)
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'True').lower() == 'true'
+# Every process saves its metrics here for the metrics endpoint to sum;
+# clear it when redeploying
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(BASE_DIR, 'data', 'metrics'))
+METRICS_SAVE_SECONDS = int(os.getenv('METRICS_SAVE_SECONDS', '5'))
+# Bearer token for GET /metrics; without one the endpoint only answers with DEBUG on
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+# Most viewed movies with their own series in the stream metrics; the rest are labelled 'other'
+STREAM_METRICS_MOVIES = int(os.getenv('STREAM_METRICS_MOVIES', '100'))
+
+# N+1 and slow query inspection (see OTTAPP/query_inspector.py), for development
+QUERY_INSPECTOR = os.getenv('QUERY_INSPECTOR', 'False').lower() == 'true'
+# A query shape run this many times in one request is flagged as an N+1
+QUERY_INSPECTOR_REPEAT = int(os.getenv('QUERY_INSPECTOR_REPEAT', '5'))
+QUERY_INSPECTOR_SLOW_MS = float(os.getenv('QUERY_INSPECTOR_SLOW_MS', '100'))
+QUERY_INSPECTOR_REPORT = os.getenv(
+    'QUERY_INSPECTOR_REPORT', os.path.join(BASE_DIR, 'data', 'query_report.json')
+)
+
+# On-demand CPU and heap profiling of the workers by staff (see OTTAPP/profiling.py)
+PROFILING = os.getenv('PROFILING', 'False').lower() == 'true'
+PROFILING_DIR = os.getenv('PROFILING_DIR', os.path.join(BASE_DIR, 'data', 'profiles'))
+# How often a worker looks for a new session, and the longest a session runs
+PROFILING_POLL_SECONDS = float(os.getenv('PROFILING_POLL_SECONDS', '2'))
+PROFILING_MAX_SECONDS = int(os.getenv('PROFILING_MAX_SECONDS', '300'))